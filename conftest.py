@@ -0,0 +1,7 @@
+"""Общие настройки pytest для скриптов системы сигналов"""
+import os
+import tempfile
+
+# Бот при импорте открывает журнал состояния и архив свечей в текущем каталоге -
+# тесты не должны оставлять их в репозитории
+os.chdir(tempfile.mkdtemp(prefix='vtb-tests-'))
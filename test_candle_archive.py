@@ -0,0 +1,107 @@
+"""Архив свечей: слияние по времени и восстановление после сбоя"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import vtb_scalper_signals as signals
+
+
+def day_candles(count=200, start='2024-01-15 07:00'):
+    rng = np.random.default_rng(0)
+    close = np.round(25 + np.cumsum(rng.normal(0, 0.01, count)), 3)
+    index = pd.date_range(start, periods=count, freq='min', tz='UTC', name='time').as_unit('ns')
+    return pd.DataFrame({
+        'open': close, 'close': close, 'high': close + 0.01, 'low': close - 0.01,
+        'volume': rng.integers(1, 1000, count)
+    }, index=index)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return signals.CandleArchive(str(tmp_path))
+
+
+def stored(archive, figi='F'):
+    return archive.read(figi)[['open', 'close', 'high', 'low', 'volume']]
+
+
+def test_append_in_order(archive):
+    df = day_candles()
+    archive.append('F', df.iloc[:120])
+    archive.append('F', df.iloc[120:])
+    pd.testing.assert_frame_equal(stored(archive), df, check_freq=False)
+
+
+def test_sparse_batch_overwrites_only_matching_times(archive):
+    df = day_candles()
+    archive.append('F', df)
+    
+    # Пакет с двумя свечами из середины дня не трогает свечи между ними
+    changed = df.iloc[[50, 150]].copy()
+    changed['close'] += 1.0
+    archive.append('F', changed)
+    
+    expected = df.copy()
+    expected.iloc[[50, 150], expected.columns.get_loc('close')] += 1.0
+    pd.testing.assert_frame_equal(stored(archive), expected, check_freq=False)
+
+
+def test_missing_candles_are_inserted(archive):
+    df = day_candles()
+    archive.append('F', df.drop(df.index[100:140]))
+    archive.append('F', df.iloc[95:145])
+    pd.testing.assert_frame_equal(stored(archive), df, check_freq=False)
+
+
+def test_batch_spanning_two_days(archive):
+    df = pd.concat([day_candles(30, '2024-01-15 23:40'), day_candles(10, '2024-01-16 00:10')])
+    archive.append('F', df)
+    assert archive.days('F') == [19737, 19738]
+    pd.testing.assert_frame_equal(stored(archive), df, check_freq=False)
+
+
+def test_interrupted_append_is_cut_off(archive):
+    df = day_candles()
+    archive.append('F', df.iloc[:100])
+    
+    # Сбой после записи цен, но до записи времени
+    path = archive.day_dir('F', 19737)
+    with open(os.path.join(path, 'close'), 'ab') as f:
+        f.write(np.ones(5).tobytes())
+    pd.testing.assert_frame_equal(stored(archive), df.iloc[:100], check_freq=False)
+    
+    archive.append('F', df.iloc[100:])
+    pd.testing.assert_frame_equal(stored(archive), df, check_freq=False)
+
+
+def test_interrupted_rewrite(archive, monkeypatch):
+    df = day_candles()
+    archive.append('F', df)
+    changed = df.iloc[[50, 150]].copy()
+    changed['close'] += 1.0
+    expected = df.copy()
+    expected.iloc[[50, 150], expected.columns.get_loc('close')] += 1.0
+    
+    # Сбой на середине подмены колонок: день доводится до нового при следующем чтении
+    replace = os.replace
+    calls = []
+    
+    def failing_replace(source, target):
+        calls.append(target)
+        if len(calls) == 3:
+            raise OSError("Имитация сбоя")
+        replace(source, target)
+    
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        archive.append('F', changed)
+    monkeypatch.setattr(os, 'replace', replace)
+    pd.testing.assert_frame_equal(stored(archive), expected, check_freq=False)
+    
+    # Сбой до отметки commit: временные файлы не читаются, остается прежний день
+    path = archive.day_dir('F', 19737)
+    with open(os.path.join(path, 'close.tmp'), 'wb') as f:
+        f.write(np.zeros(3).tobytes())
+    pd.testing.assert_frame_equal(stored(archive), expected, check_freq=False)
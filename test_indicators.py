@@ -0,0 +1,70 @@
+"""Индикаторы реестра: векторная и инкрементальная формы против эталона pandas"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import vtb_scalper_signals as signals
+
+DAY_START = 120  # Первая свеча второго дня (UTC)
+
+
+def day_boundary_candles():
+    """Два дня свечей с шагом цены биржи: стоянки с первой свечи (RSI 0/0),
+    рост без падений (RSI 100), плато посреди блуждания и свеча без объема
+    на границе дней (VWAP 0/0)"""
+    rng = np.random.default_rng(7)
+    steps = np.concatenate([
+        np.zeros(40),
+        np.ones(20),
+        rng.choice([-1, 0, 0, 1], size=80),
+        np.zeros(30),
+        rng.choice([-1, 0, 1], size=130),
+    ]) * 0.005
+    close = np.round(25 + np.cumsum(steps), 3)
+    spread = rng.integers(0, 3, len(close)) * 0.005
+    volume = rng.integers(1, 1000, len(close)).astype(np.float64)
+    volume[DAY_START] = 0
+    index = pd.date_range('2024-01-15 22:00', periods=len(close), freq='min', tz='UTC', name='time')
+    return pd.DataFrame({
+        'open': close, 'high': close + spread, 'low': close - spread, 'close': close, 'volume': volume
+    }, index=index)
+
+
+def bars(df):
+    c = signals.frame_columns(df)
+    return list(zip(c['time'].tolist(), c['high'].tolist(), c['low'].tolist(), c['close'].tolist(), c['volume'].tolist()))
+
+
+def values(row):
+    return {k: np.nan if v is None else v for k, v in row.items()}
+
+
+def test_series_covers_edge_cases():
+    df = day_boundary_candles()
+    assert df.index[DAY_START].normalize() == df.index[DAY_START] and df['volume'].iloc[DAY_START] == 0
+    rsi = signals.rsi_reference(df)['rsi']
+    assert rsi.iloc[20:40].isna().all() and (rsi.iloc[45:60] == 100).all()
+
+
+@pytest.mark.parametrize('name', sorted(signals.INDICATORS))
+def test_indicator_matches_reference(name):
+    assert signals.verify_indicators(day_boundary_candles(), [name]) == []
+
+
+@pytest.mark.parametrize('name', sorted(signals.INDICATORS))
+def test_stream_amends_unclosed_candle(name):
+    # Незакрытая свеча приходит несколько раз с разными ценами и объемом:
+    # итог - как при одной подаче окончательных значений
+    df = day_boundary_candles()
+    rng = np.random.default_rng(1)
+    once = signals.INDICATORS[name].stream()
+    amended = signals.INDICATORS[name].stream()
+    for time, high, low, close, volume in bars(df):
+        expected = values(once.update(time, high, low, close, volume))
+        for _ in range(2):
+            shift = rng.choice([-1, 1]) * 0.01
+            amended.update(time, high + 0.02, low - 0.02, close + shift, volume + rng.integers(1, 100))
+        actual = values(amended.update(time, high, low, close, volume))
+        assert actual.keys() == expected.keys()
+        for column, value in expected.items():
+            assert np.isclose(actual[column], value, rtol=1e-9, atol=1e-12, equal_nan=True), (time, column)
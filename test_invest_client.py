@@ -0,0 +1,59 @@
+"""Клиент Invest API: переподключение только при сломанном канале"""
+import pytest
+
+import vtb_scalper_signals as signals
+
+
+class Manager:
+    """Client(token): каждое открытие канала - новый объект клиента"""
+    opened = 0
+    
+    def __init__(self, token):
+        pass
+    
+    def __enter__(self):
+        Manager.opened += 1
+        return object()
+    
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(signals, 'Client', Manager)
+    Manager.opened = 0
+    return signals.SharedInvestClient('token')
+
+
+def failing_once(error):
+    calls = []
+    
+    def func(client):
+        calls.append(client)
+        if len(calls) == 1:
+            raise error
+        return 'ok'
+    return func, calls
+
+
+@pytest.mark.parametrize('error', [
+    signals.RequestError(signals.StatusCode.UNAVAILABLE, 'канал закрыт'),
+    signals.RpcError('транспорт'),
+], ids=['request_error', 'rpc_error'])
+def test_broken_channel_reconnects_and_retries(client, error):
+    func, calls = failing_once(error)
+    assert client.call(func) == 'ok'
+    assert calls[0] is not calls[1] and client.reconnects == 1 and Manager.opened == 2
+
+
+@pytest.mark.parametrize('error', [
+    signals.RequestError(signals.StatusCode.INVALID_ARGUMENT, 'неверный FIGI'),
+    ValueError('ошибка разбора ответа'),
+], ids=['request_error', 'value_error'])
+def test_other_errors_are_raised_unchanged(client, error):
+    func, calls = failing_once(error)
+    with pytest.raises(type(error)) as raised:
+        client.call(func)
+    assert raised.value is error
+    assert len(calls) == 1 and client.reconnects == 0 and Manager.opened == 1
@@ -0,0 +1,88 @@
+"""Журнал состояния: история сигналов после перезапуска продолжается без повторов и пропусков"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import vtb_scalper_signals as signals
+
+FIGI = 'F0'
+SAVED = 60  # Свечей, закрытых до остановки
+
+
+@pytest.fixture
+def candles():
+    rng = np.random.default_rng(5)
+    close = np.round(25 + np.cumsum(rng.choice([-1, 0, 1], size=SAVED + 10) * 0.005), 3)
+    index = pd.date_range('2024-01-15 07:00', periods=len(close), freq='min', tz='UTC', name='time')
+    return pd.DataFrame({'close': close}, index=index)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = signals.StateJournal(str(tmp_path / 'state.db'))
+    yield journal
+    journal.close()
+
+
+def tick(state, scheduler, df):
+    """Догрузка свечей и учет сигналов, как в основном цикле; сигналы, попавшие в историю"""
+    state.candles.df = df
+    state.candles.close_until(int(df.index[-1].value))
+    recorded = []
+    for time_ns, _, signal in scheduler.evaluate().get(0, ()):
+        if state.record_signal(time_ns, signal):
+            recorded.append(time_ns)
+    return recorded
+
+
+def started(df, journal=None):
+    state = signals.InstrumentState(FIGI, FIGI)
+    if journal is not None:
+        journal.restore({FIGI: state})
+    scheduler = signals.SignalScheduler([state])
+    return state, scheduler, tick(state, scheduler, df)
+
+
+def saved_history(candles, journal):
+    state, scheduler, _ = started(candles.iloc[:signals.LONG_MA_PERIOD])
+    for end in range(signals.LONG_MA_PERIOD + 1, SAVED + 1):
+        tick(state, scheduler, candles.iloc[:end])
+    journal.save_signals([state])
+    return list(state.signals_history)
+
+
+def test_warmup_candle_already_in_history(candles, journal):
+    # Перезапуск без новых свечей: сигнал прогрева - по уже учтенной свече
+    history = saved_history(candles, journal)
+    state, _, recorded = started(candles.iloc[:SAVED], journal)
+    assert recorded == [] and list(state.signals_history) == history
+
+
+def test_history_continues_with_next_candle(candles, journal):
+    history = saved_history(candles, journal)
+    state, _, recorded = started(candles.iloc[:SAVED + 1], journal)
+    assert recorded == [candles.index[SAVED].value]
+    assert list(state.signals_history)[:-1] == history[-(len(state.signals_history) - 1):]
+
+
+def test_history_dropped_after_missed_candles(candles, journal):
+    # Две свечи закрылись во время простоя - их сигналов в истории нет
+    saved_history(candles, journal)
+    state, _, recorded = started(candles.iloc[:SAVED + 3], journal)
+    assert recorded == [candles.index[SAVED + 2].value] and len(state.signals_history) == 1
+
+
+def test_journal_without_candle_time(candles, tmp_path):
+    # Журнал прежней версии: история без времени свечи не восстанавливается
+    path = str(tmp_path / 'old.db')
+    with sqlite3.connect(path) as db:
+        db.execute('CREATE TABLE signals (figi TEXT PRIMARY KEY, history TEXT, saved_at REAL)')
+        db.execute('INSERT INTO signals VALUES (?, ?, ?)', (FIGI, '1,1,1', 1e12))
+    db.close()
+    journal = signals.StateJournal(path)
+    state, _, _ = started(candles.iloc[:SAVED], journal)
+    assert len(state.signals_history) == 1
+    journal.save_signals([state])
+    journal.close()
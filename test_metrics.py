@@ -0,0 +1,38 @@
+"""Метрики: вывод для /metrics и Prometheus при пустых и заполняемых гистограммах"""
+import threading
+
+import vtb_scalper_signals as signals
+
+
+def test_registered_stage_without_observations():
+    metrics = signals.Metrics(enabled=True)
+    metrics.histogram('idle')
+    metrics.observe('tick', 0.002)
+    
+    text = metrics.render_text()
+    assert '`tick`' in text and 'idle' not in text
+    prometheus = metrics.render_prometheus()
+    assert 'stage="tick"' in prometheus and 'idle' not in prometheus
+
+
+def test_render_while_stages_are_registered():
+    # Этапы регистрируются из пулов потоков прямо во время вывода
+    metrics = signals.Metrics(enabled=True)
+    stop = threading.Event()
+    
+    def observe():
+        k = 0
+        while not stop.is_set():
+            metrics.observe(f'stage_{k % 500}', 0.001)
+            k += 1
+    
+    thread = threading.Thread(target=observe)
+    thread.start()
+    try:
+        for _ in range(200):
+            metrics.render_text()
+            metrics.render_prometheus()
+    finally:
+        stop.set()
+        thread.join()
+    assert metrics.render_prometheus().count('vtb_stage_seconds_count') == 500
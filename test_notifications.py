@@ -0,0 +1,45 @@
+"""Уведомления о сигналах: текущая цена и пометка запоздавшего решения"""
+import asyncio
+import time
+
+import pytest
+
+import vtb_scalper_signals as signals
+
+
+@pytest.fixture
+def captions(monkeypatch):
+    captions = []
+    
+    async def get_order_book(state):
+        return None
+    
+    async def get_chart_png(state, df):
+        return b''
+    
+    async def telegram_send_photo(photo, caption=None, reply_markup=None, key=None):
+        captions.append(caption)
+    
+    monkeypatch.setattr(signals, 'get_order_book', get_order_book)
+    monkeypatch.setattr(signals, 'get_chart_png', get_chart_png)
+    monkeypatch.setattr(signals, 'telegram_send_photo', telegram_send_photo)
+    return captions
+
+
+def notify(candle_age):
+    """Уведомление о покупке по свече, закрытой candle_age секунд назад"""
+    state = signals.InstrumentState('F0', 'Тест')
+    candle_time = round((time.time() - candle_age - signals.TICK_INTERVAL) * signals.NANO)
+    asyncio.run(signals.send_signal_notification(state, 'BUY', 25.5, None, candle_time))
+
+
+def test_fresh_decision(captions):
+    notify(5)
+    assert "Текущая цена: `25.50 RUB`" in captions[0] and "в ближайшие 2-5 минут" in captions[0]
+
+
+def test_stale_decision_is_marked(captions):
+    # Инструмент догружался по очереди: решение по свече десятиминутной давности
+    notify(10 * 60)
+    assert "в ближайшие 2-5 минут" not in captions[0]
+    assert "⏳" in captions[0] and "(10 мин назад)" in captions[0]
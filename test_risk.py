@@ -0,0 +1,146 @@
+"""Риски и кнопки позиции: без цены позиция не меняется, нулевая цена входа не ломает расчеты"""
+import asyncio
+import datetime
+import types
+
+import pytest
+
+import vtb_scalper_signals as signals
+
+FIGI = 'F0'
+
+
+class Query:
+    """Нажатие кнопки: ответы бота сохраняются"""
+    
+    def __init__(self, data, replies):
+        self.data = data
+        self.replies = replies
+        self.message = types.SimpleNamespace(reply_text=self.reply_text)
+    
+    async def answer(self, *args, **kwargs):
+        pass
+    
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.replies.append((text, reply_markup))
+    
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        self.replies.append((text, reply_markup))
+
+
+def press(data):
+    replies = []
+    update = types.SimpleNamespace(callback_query=Query(data, replies), message=None)
+    asyncio.run(signals.button_handler(update, types.SimpleNamespace(args=[])))
+    return replies
+
+
+@pytest.fixture
+def state(monkeypatch):
+    state = signals.InstrumentState(FIGI, 'Тест')
+    monkeypatch.setattr(signals, 'instruments', {FIGI: state})
+    monkeypatch.setattr(signals, 'state_journal', None)
+    monkeypatch.setattr(signals, 'risk_monitor', signals.RiskMonitor())
+    monkeypatch.setattr(signals, 'outbox', signals.TelegramOutbox())
+    return state
+
+
+def legacy_position(state):
+    """Позиция, открытая по нулевой цене до проверки цены (например, из журнала)"""
+    state.position = 1
+    state.entry_price = 0.0
+    state.entry_time = datetime.datetime.now()
+
+
+def price_failure(monkeypatch):
+    async def get_current_price(figi=signals.FIGI):
+        return 0.0
+    monkeypatch.setattr(signals, 'get_current_price', get_current_price)
+
+
+@pytest.mark.parametrize('action, position', [('confirm_buy', 0), ('confirm_sell', 1), ('emergency_sell', 1)])
+def test_position_unchanged_without_price(state, monkeypatch, action, position):
+    price_failure(monkeypatch)
+    state.position = position
+    state.entry_price = 25.0
+    state.entry_time = datetime.datetime.now()
+    
+    [(text, reply_markup)] = press(f'{action}:{FIGI}')
+    assert state.position == position and state.entry_price == 25.0
+    assert "Попробуйте еще раз" in text
+    assert reply_markup.inline_keyboard[0][0].callback_data == f'{action}:{FIGI}'
+
+
+def test_zero_entry_price_does_not_break_stream(state):
+    legacy_position(state)
+    supervisor = signals.MarketDataStreamSupervisor(None, {FIGI: state})
+    price = signals.ReplayLastPrice(FIGI, datetime.datetime.now(datetime.timezone.utc), signals.fixed_to_quotation(25 * signals.NANO))
+    supervisor.handle_event('last_price', price)
+    assert state.last_price == 25.0
+    assert signals.risk_monitor.update(state, 25.0) is None
+
+
+def test_risk_check_errors_are_logged_per_event(state, monkeypatch):
+    def failing_update(state, price):
+        raise RuntimeError("сбой проверки")
+    monkeypatch.setattr(signals.risk_monitor, 'update', failing_update)
+    supervisor = signals.MarketDataStreamSupervisor(None, {FIGI: state})
+    price = signals.ReplayLastPrice(FIGI, datetime.datetime.now(datetime.timezone.utc), signals.fixed_to_quotation(25 * signals.NANO))
+    supervisor.handle_event('last_price', price)
+    assert state.last_price == 25.0
+
+
+def test_zero_entry_price_in_status_and_manual_sell(state, monkeypatch):
+    legacy_position(state)
+    state.snapshot = signals.MarketSnapshot(
+        datetime.datetime.now(datetime.timezone.utc), signals.pd.DataFrame(), 25.0, None, 0, None, {}
+    )
+    [(text, _)] = press(f'force_sell:{FIGI}')
+    assert "Прибыль: н/д" in text
+    
+    replies = []
+    update = types.SimpleNamespace(message=types.SimpleNamespace(reply_text=Query('', replies).reply_text), callback_query=None)
+    asyncio.run(signals.status_command(update, types.SimpleNamespace(args=[FIGI])))
+    assert "Прибыль: н/д" in replies[0][0]
+    
+    state.last_price = 25.0
+    signals.risk_monitor.report_status(state)
+    [(_, kwargs, _)] = signals.outbox.pending.values()
+    assert "Прибыль: `н/д`" in kwargs['text']
+
+
+class Bot:
+    """Бот Telegram: отправленные сообщения сохраняются"""
+    
+    def __init__(self):
+        self.sent = []
+    
+    async def send_message(self, text, **kwargs):
+        self.sent.append(text)
+
+
+async def deliver(bot):
+    task = asyncio.create_task(signals.outbox.run(bot))
+    await signals.outbox.flush(timeout=1)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_new_position_alert_after_delivered_one(state):
+    # Повтор оповещения о стоп-лоссе гасится в пределах позиции, но не для новой позиции
+    bot = Bot()
+    for entry_time in (datetime.datetime(2024, 1, 15, 10, 0), datetime.datetime(2024, 1, 15, 10, 1)):
+        state.position = 1
+        state.entry_price = 25.0
+        state.entry_time = entry_time
+        assert signals.risk_monitor.update(state, 24.0) == signals.RISK_STOP_LOSS
+        asyncio.run(deliver(bot))
+        state.position = 0
+        signals.risk_monitor.update(state, 24.0)
+    
+    assert len(bot.sent) == 2 and all("СТОП-ЛОССЕ" in text for text in bot.sent)
+    
+    # Та же позиция: повтор в пределах окна не отправляется
+    signals.outbox.submit('send_message', (signals.RISK_STOP_LOSS, FIGI, state.entry_time), text="повтор")
+    asyncio.run(deliver(bot))
+    assert len(bot.sent) == 2
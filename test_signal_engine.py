@@ -0,0 +1,195 @@
+"""Инкрементальные MA-сигналы против эталона calculate_indicators и бэктеста"""
+import asyncio
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import vtb_backtest as backtest
+import vtb_scalper_signals as signals
+
+
+def candles(close, index=None):
+    if index is None:
+        index = pd.date_range('2024-01-15 07:00', periods=len(close), freq='min', tz='UTC', name='time')
+    return pd.DataFrame({'close': np.asarray(close, dtype=np.float64)}, index=index)
+
+
+def tie_steps(count, tick, seed):
+    """Блуждание с шагом цены биржи и частыми стоянками - много равных MA"""
+    rng = np.random.default_rng(seed)
+    return rng.choice([-1, 0, 0, 0, 1], size=count) * tick
+
+
+def gapped_day():
+    """Синтетический день из 5000 свечей без строк 100:140"""
+    rng = np.random.default_rng(0)
+    close = np.round(25 + np.cumsum(rng.normal(0, 0.01, 5000)), 4)
+    df = candles(close)
+    return df.drop(df.index[100:140])
+
+
+SERIES = {
+    'plateau': candles([25.0] * 10 + [25.005] * 30 + [25.0] * 30),
+    'ties': candles(np.round(25 + np.cumsum(tie_steps(20_000, 0.005, 3)), 3)),
+    'ties_large_price': candles(np.round(250 + np.cumsum(tie_steps(20_000, 0.05, 4)), 2)),
+    'gapped': gapped_day(),
+}
+
+
+def reference_signals(df):
+    return signals.calculate_indicators(df.copy())['signal'].to_numpy()
+
+
+@pytest.mark.parametrize('name', SERIES)
+def test_engine_matches_reference(name):
+    df = SERIES[name]
+    reference = signals.calculate_indicators(df.copy())
+    engine = signals.CrossoverEngine()
+    result, short_ma, long_ma = [], [], []
+    for time, close in zip(df.index, df['close'].to_numpy()):
+        result.append(engine.update(time, close))
+        short_ma.append(np.nan if engine.short_ma is None else engine.short_ma)
+        long_ma.append(np.nan if engine.long_ma is None else engine.long_ma)
+    
+    np.testing.assert_array_equal(np.array(result), reference['signal'].to_numpy())
+    ready = ~np.isnan(np.array(long_ma))
+    np.testing.assert_allclose(np.array(short_ma)[ready], reference['short_ma'].to_numpy()[ready])
+    np.testing.assert_allclose(np.array(long_ma)[ready], reference['long_ma'].to_numpy()[ready])
+
+
+@pytest.mark.parametrize('name', SERIES)
+def test_backtest_matches_reference(name):
+    df = SERIES[name]
+    signal = backtest.crossover_signals(
+        backtest.centered_cumsum(df['close'].to_numpy()), signals.SHORT_MA_PERIOD, signals.LONG_MA_PERIOD
+    )
+    np.testing.assert_array_equal(signal, reference_signals(df))
+
+
+def test_plateau_gives_no_signal():
+    # С 29-й свечи обе MA равны 25.005 - до начала спада на 40-й
+    signal = reference_signals(SERIES['plateau'])
+    assert signal[19] == 1
+    assert (signal[29:40] == 0).all()
+    assert (signal[:signals.LONG_MA_PERIOD - 1] == 0).all()
+
+
+def test_engine_amends_unclosed_candle():
+    df = SERIES['ties'].iloc[:200]
+    engine = signals.CrossoverEngine()
+    for time, close in zip(df.index, df['close'].to_numpy()):
+        # Незакрытая свеча приходит несколько раз, итог - по последнему значению
+        engine.update(time, close + 0.1)
+        engine.update(time, close - 0.1)
+        engine.update(time, close)
+    assert engine.signal == reference_signals(df)[-1]
+    assert engine.long_ma == pytest.approx(df['close'].iloc[-signals.LONG_MA_PERIOD:].mean())
+
+
+@pytest.mark.parametrize('name', SERIES)
+def test_matrix_matches_reference(name):
+    df = SERIES[name]
+    matrix = signals.SignalMatrix(1)
+    result = []
+    for time, close in zip(df.index.as_unit('ns').asi8, df['close'].to_numpy()):
+        matrix.update(np.array([0]), np.array([time]), np.array([close]))
+        result.append(matrix.signals()[0][0])
+    np.testing.assert_array_equal(np.array(result), reference_signals(df))
+
+
+def scheduler_states(frames):
+    states = [signals.InstrumentState(figi, figi) for figi in frames]
+    return states, signals.SignalScheduler(states)
+
+
+def sync(state, df):
+    """Догрузка свечей инструмента: все свечи df закрыты"""
+    state.candles.df = df
+    state.candles.close_until(int(df.index[-1].value))
+
+
+def collect_fresh(frames, synced_every):
+    """Сигналы по свечам, если инструмент k догружает свечи раз в synced_every[k] тиков"""
+    states, scheduler = scheduler_states(frames)
+    collected = {state.figi: [] for state in states}
+    index = next(iter(frames.values())).index
+    for tick in range(signals.LONG_MA_PERIOD, len(index) + 1):
+        for state, every in zip(states, synced_every):
+            # Первый тик - прогрев по истории, дальше догрузка по очереди
+            if tick % every == 0 or tick == signals.LONG_MA_PERIOD:
+                sync(state, frames[state.figi].iloc[:tick])
+        for row, fresh in scheduler.evaluate().items():
+            collected[states[row].figi].extend(fresh)
+    return collected
+
+
+def test_scheduler_signal_per_closed_candle():
+    frames = {f'F{k}': SERIES['ties'].iloc[k * 300:(k + 1) * 300].set_axis(SERIES['ties'].index[:300]) for k in range(4)}
+    every_tick = collect_fresh(frames, [1, 1, 1, 1])
+    round_robin = collect_fresh(frames, [1, 2, 3, 5])
+    assert every_tick == round_robin
+    
+    for figi, df in frames.items():
+        # По одному сигналу на каждую закрытую свечу после заполнения длинного окна
+        times = [time for time, _, _ in every_tick[figi]]
+        assert times == df.index.as_unit('ns').asi8[signals.LONG_MA_PERIOD - 1:].tolist()
+        assert [signal for _, _, signal in every_tick[figi]] == reference_signals(df)[signals.LONG_MA_PERIOD - 1:].tolist()
+
+
+def test_scheduler_skips_instruments_without_new_candles():
+    frames = {'A': SERIES['ties'].iloc[:100], 'B': SERIES['ties'].iloc[100:200].set_axis(SERIES['ties'].index[:100])}
+    states, scheduler = scheduler_states(frames)
+    for state in states:
+        sync(state, frames[state.figi].iloc[:50])
+    assert set(scheduler.evaluate()) == {0, 1}
+    
+    # Новая свеча только у A: B не получает повторного сигнала по старой свече
+    sync(states[0], frames['A'].iloc[:51])
+    fresh = scheduler.evaluate()
+    assert list(fresh) == [0] and len(fresh[0]) == 1
+    assert scheduler.evaluate() == {}
+
+
+def test_scheduler_waits_for_candle_to_close():
+    df = SERIES['ties'].iloc[:60]
+    states, scheduler = scheduler_states({'A': df})
+    sync(states[0], df.iloc[:40])
+    scheduler.evaluate()
+    
+    # Свеча 40 загружена незакрытой (цена открытия) - учитывается только после догрузки
+    forming = df.iloc[:41].copy()
+    forming.iloc[-1, 0] = 30.0
+    states[0].candles.df = forming
+    assert scheduler.evaluate() == {}
+    sync(states[0], df.iloc[:41])
+    [(time, close, signal)] = scheduler.evaluate()[0]
+    assert close == df['close'].iloc[40] and signal == reference_signals(df.iloc[:41])[-1]
+
+
+def test_scheduler_polls_do_not_overlap(monkeypatch):
+    # Опрос, прерванный по таймауту, продолжается в потоке: следующий тик ждет его
+    states, scheduler = scheduler_states({'A': SERIES['ties'].iloc[:10]})
+    release = threading.Event()
+    running = []
+    calls = []
+    
+    def slow_poll():
+        running.append(1)
+        calls.append(len(running))
+        release.wait(5)
+        running.pop()
+    
+    monkeypatch.setattr(scheduler, 'poll', slow_poll)
+    
+    async def ticks():
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await scheduler.poll_tick(timeout=0.05)
+        release.set()
+        await scheduler.poll_tick(timeout=5)
+        await scheduler.poll_tick(timeout=5)
+    
+    asyncio.run(ticks())
+    assert calls == [1, 1]
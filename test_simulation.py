@@ -0,0 +1,62 @@
+"""Регрессия офлайн-прогона: протокол бота на свечах из testdata совпадает с эталоном"""
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+import vtb_backtest as backtest
+import vtb_scalper_signals as signals
+import vtb_simulation as sim
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+CANDLES = os.path.join(TESTDATA, 'sim_candles.csv')
+GOLDEN = os.path.join(TESTDATA, 'sim_golden.jsonl')
+
+
+@pytest.fixture(autouse=True)
+def utc(monkeypatch):
+    """Бот пишет местное время - протокол не должен зависеть от пояса машины"""
+    if not hasattr(time, 'tzset'):
+        pytest.skip("Нужен time.tzset")
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def golden():
+    with open(GOLDEN, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(frames, **options):
+    simulation = sim.Simulation(frames, {figi: signals.WATCHLIST.get(figi, figi) for figi in frames}, **options)
+    summary = asyncio.run(simulation.run())
+    return simulation.transcript.entries, summary
+
+
+def candle_frames():
+    return {signals.FIGI: backtest.load_candles(CANDLES)}
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['polling', 'streaming'])
+def test_transcript_matches_golden(stream):
+    # В стриме свеча закрывается приходом следующей, при опросе - тиком на границе:
+    # сигналы и ответы на нажатия совпадают с эталоном опроса запись в запись
+    entries, summary = run(candle_frames(), stream=stream)
+    assert summary['signals'] > 0 and summary['closed'] > 0
+    assert sim.compare_transcripts(golden(), entries) is None
+
+
+def test_recorded_stream_replays_to_golden(tmp_path):
+    # Запись всего дня (без прогрева) через StreamRecorder бота; при воспроизведении
+    # история до первого тика берется из записи, а события после него - из стрима
+    record = str(tmp_path / 'stream.jsonl')
+    run(candle_frames(), warmup=0, auto_confirm=False, record=record, stream=True)
+    
+    frames = sim.replay_frames(record)
+    entries, _ = run(frames, replay=record)
+    assert sim.compare_transcripts(golden(), entries) is None
@@ -0,0 +1,94 @@
+"""Потоковый режим: супервизор стрима и сигналы по закрытым свечам каждого инструмента"""
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import vtb_scalper_signals as signals
+
+WARMUP = 30
+MINUTES = 60
+
+
+def stream_candles(figi, seed):
+    """Свечи инструмента с ценой на шаге биржи; у неликвидного - пропуски минут"""
+    rng = np.random.default_rng(seed)
+    close = np.round(25 + np.cumsum(rng.choice([-1, 0, 0, 1], size=WARMUP + MINUTES) * 0.005), 3)
+    times = pd.date_range('2024-01-15 07:00', periods=len(close), freq='min', tz='UTC')
+    keep = np.ones(len(close), dtype=bool)
+    if seed == 2:
+        keep[WARMUP + 5::7] = False
+    candles = []
+    for time, price in zip(times[keep], close[keep]):
+        quotation = signals.fixed_to_quotation(round(price * signals.NANO))
+        candles.append(signals.ReplayCandle(figi, time.to_pydatetime(), quotation, quotation, quotation, quotation, 1))
+    return candles
+
+
+def stream_events(candles):
+    """По каждой минуте: свеча с ценой открытия, последняя цена, итоговая свеча - вперемешку по инструментам"""
+    events = []
+    minutes = sorted({candle.time for figi_candles in candles.values() for candle in figi_candles[WARMUP:]})
+    by_time = {figi: {candle.time: candle for candle in figi_candles} for figi, figi_candles in candles.items()}
+    for minute in minutes:
+        for figi in candles:
+            candle = by_time[figi].get(minute)
+            if candle is None:
+                continue
+            events.append(('candle', candle._replace(close=candle.open)))
+            events.append(('last_price', signals.ReplayLastPrice(figi, minute, candle.close)))
+        for figi in candles:
+            if minute in by_time[figi]:
+                events.append(('candle', by_time[figi][minute]))
+    return events
+
+
+async def drive(source, states):
+    """Цикл сигналов как в signal_monitoring: пробуждение по закрытию свечи и оценка"""
+    supervisor = signals.MarketDataStreamSupervisor(source, {state.figi: state for state in states})
+    scheduler = signals.SignalScheduler(states)
+    scheduler.evaluate()  # Сигналы по истории до стрима
+    collected = {state.figi: [] for state in states}
+    wakes = 0
+    task = asyncio.create_task(supervisor.run())
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(supervisor.candle_closed.wait(), 0.5)
+            except asyncio.TimeoutError:
+                break
+            supervisor.candle_closed.clear()
+            wakes += 1
+            for row, fresh in scheduler.evaluate().items():
+                collected[states[row].figi].extend(fresh)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    return collected, wakes
+
+
+@pytest.mark.parametrize('delay', [0.0, 0.0005])
+def test_one_evaluation_per_closed_candle(monkeypatch, delay):
+    monkeypatch.setattr(signals, 'candle_archive', None)
+    candles = {f'F{k}': stream_candles(f'F{k}', k) for k in range(3)}
+    states = []
+    for figi, figi_candles in candles.items():
+        state = signals.InstrumentState(figi, figi)
+        state.candles.df = signals.candles_to_dataframe(figi_candles[:WARMUP])
+        state.candles.close_until(signals.to_ns(figi_candles[WARMUP - 1].time))
+        states.append(state)
+    
+    source = signals.FakeStreamSource(stream_events(candles), delay=delay)
+    collected, wakes = asyncio.run(drive(source, states))
+    assert source.position == len(source.events_list)
+    if delay:
+        assert wakes >= MINUTES - 1
+    
+    for figi, figi_candles in candles.items():
+        # Последняя свеча не закрыта: следующая минута не пришла
+        closed = figi_candles[WARMUP:-1]
+        assert [time for time, _, _ in collected[figi]] == [signals.to_ns(candle.time) for candle in closed]
+        
+        reference = signals.calculate_indicators(signals.candles_to_dataframe(figi_candles[:-1]))
+        assert [signal for _, _, signal in collected[figi]] == reference['signal'].iloc[WARMUP:].tolist()
@@ -0,0 +1,290 @@
+"""Бэктест стратегии пересечения MA на сохраненных свечах, без доступа к бирже.
+
+Повторяет логику бота: сигнал calculate_indicators по каждой свече, решение
+analyze_signals после SIGNAL_CONFIRMATION одинаковых сигналов с очисткой
+истории после решения и пороги check_position_health. Считается, что
+пользователь подтверждает каждый сигнал, а позиция закрывается при
+достижении стоп-лосса или тейк-профита.
+
+Запуск:
+    python vtb_backtest.py candles.csv [--short 5] [--long 20] [--confirmation 3]
+    python vtb_backtest.py candles.parquet --trades
+    python vtb_backtest.py candles/ --figi BBG004730ZJ9   # архив свечей бота
+"""
+import argparse
+import os
+import time
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import pandas as pd
+
+import vtb_scalper_signals as signals
+
+SCAN = 64  # Сколько свечей после входа проверяется поэлементно, дальше - векторно
+CHUNK = 256  # Начальный размер окна векторного поиска срабатывания стопа
+
+
+def load_candles(path, figi=signals.FIGI):
+    """Свечи из CSV, Parquet (колонки time, open, high, low, close, volume) или архива бота"""
+    if os.path.isdir(path):
+        return signals.CandleArchive(path).read(figi)
+    if str(path).endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    
+    if 'time' in df.columns:
+        df['time'] = pd.to_datetime(df['time'], utc=True)
+        df = df.set_index('time')
+    return df.sort_index()
+
+
+def centered_cumsum(close):
+    """Накопленная сумма цен в нано-единицах (int64) с ведущим нулем; цены сдвинуты к первой
+    
+    Суммы целые и точные, поэтому равные MA не расходятся из-за округления.
+    """
+    fixed = signals.prices_to_fixed(close)
+    cumsum = np.zeros(len(fixed) + 1, dtype=np.int64)
+    if len(fixed):
+        np.cumsum(fixed - fixed[0], out=cumsum[1:])
+    return cumsum
+
+
+def window_total(cumsum, period):
+    """Суммы скользящего окна (без сдвига) по накопленной сумме: 0 до заполнения окна"""
+    n = len(cumsum) - 1
+    total = np.zeros(n, dtype=np.int64)
+    if n >= period:
+        total[period - 1:] = cumsum[period:] - cumsum[:-period]
+    return total
+
+
+def crossover_signals(cumsum, short_period, long_period):
+    """Сигналы как в calculate_indicators: 1 - short выше long, -1 - ниже, 0 - иначе"""
+    n = len(cumsum) - 1
+    if n < long_period:
+        return np.zeros(n, dtype=np.int8)
+    
+    # MA сравниваются перекрестным умножением сумм окон - без деления и округления.
+    # Сдвиг к первой цене входит в обе части одинаково и на знак не влияет
+    diff = window_total(cumsum, short_period) * long_period - window_total(cumsum, long_period) * short_period
+    result = np.sign(diff).astype(np.int8)
+    result[:long_period - 1] = 0
+    return result
+
+
+def confirmation_decisions(signal, confirmation):
+    """Решения analyze_signals: 1 - BUY, -1 - SELL, 0 - нет решения
+    
+    История очищается после каждого решения, поэтому внутри серии одинаковых
+    сигналов решение выдается на каждой confirmation-й свече от начала серии.
+    """
+    n = len(signal)
+    if n == 0:
+        return np.zeros(0, dtype=np.int8)
+    
+    index = np.arange(n)
+    change = np.empty(n, dtype=bool)
+    change[0] = True
+    change[1:] = signal[1:] != signal[:-1]
+    run_start = np.maximum.accumulate(np.where(change, index, 0))
+    position_in_run = index - run_start
+    
+    decided = (signal != 0) & ((position_in_run + 1) % confirmation == 0)
+    return np.where(decided, signal, 0).astype(np.int8)
+
+
+def first_exit(close, start, end, entry_price, stop_pct, take_pct, prices=None):
+    """Первая свеча в [start, end), где прибыль ниже стопа или выше тейка; -1 если нет
+    
+    prices - те же цены списком Python: поэлементно он читается быстрее массива.
+    """
+    if prices is None:
+        prices = close
+    low = entry_price * (1 + stop_pct / 100)
+    high = entry_price * (1 + take_pct / 100)
+    
+    # Большинство сделок короткие - первые свечи дешевле проверить без NumPy
+    scan_end = min(start + SCAN, end)
+    for i in range(start, scan_end):
+        price = prices[i]
+        if price < low or price > high:
+            return i
+    start = scan_end
+    
+    chunk = CHUNK
+    while start < end:
+        stop = min(start + chunk, end)
+        window = close[start:stop]
+        hit = (window < low) | (window > high)
+        if hit.any():
+            return start + int(np.argmax(hit))
+        start = stop
+        chunk *= 2
+    return -1
+
+
+def simulate(close, decisions, stop_pct=signals.STOP_LOSS_PCT, take_pct=signals.TAKE_PROFIT_PCT,
+             critical_pct=signals.CRITICAL_LOSS_PCT, commission_pct=0.0):
+    """Сделки по решениям: вход по BUY без позиции, выход по SELL, стопу или тейку"""
+    n = len(close)
+    buys = np.flatnonzero(decisions == 1).tolist()
+    sells = np.flatnonzero(decisions == -1).tolist()
+    prices = close.tolist()
+    
+    entries, exits, reasons = [], [], []
+    cursor = 0
+    while True:
+        k = bisect_left(buys, cursor)
+        if k == len(buys):
+            break
+        entry = buys[k]
+        
+        k = bisect_right(sells, entry)
+        next_sell = sells[k] if k < len(sells) else n
+        
+        exit_ = first_exit(close, entry + 1, next_sell, prices[entry], stop_pct, take_pct, prices)
+        if exit_ >= 0:
+            profit = (close[exit_] / close[entry] - 1) * 100
+            if profit > take_pct:
+                reason = 'take_profit'
+            elif profit < critical_pct:
+                reason = 'critical_loss'
+            else:
+                reason = 'stop_loss'
+        elif next_sell < n:
+            exit_, reason = next_sell, 'signal'
+        else:
+            exit_, reason = n - 1, 'open'  # Позиция не закрыта к концу данных
+        
+        entries.append(entry)
+        exits.append(exit_)
+        reasons.append(reason)
+        cursor = exit_ + 1
+    
+    entries = np.array(entries, dtype=np.int64)
+    exits = np.array(exits, dtype=np.int64)
+    pnl_pct = (close[exits] / close[entries] - 1) * 100 - 2 * commission_pct
+    return entries, exits, np.array(reasons, dtype=object), pnl_pct
+
+
+def equity_curve(close, entries, exits, commission_pct=0.0):
+    """Капитал по свечам (старт 1.0) с переоценкой открытой позиции"""
+    n = len(close)
+    returns = np.zeros(n)
+    returns[1:] = close[1:] / close[:-1] - 1
+    
+    # Позиция держится на свечах (entry, exit] - разметка через разностный массив
+    marks = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(marks, entries + 1, 1)
+    np.add.at(marks, exits + 1, -1)
+    in_position = np.cumsum(marks[:-1]) > 0
+    
+    growth = 1 + returns * in_position
+    fee = 1 - commission_pct / 100
+    np.multiply.at(growth, entries, fee)
+    np.multiply.at(growth, exits, fee)
+    return np.cumprod(growth)
+
+
+def max_drawdown(equity):
+    """Максимальная просадка капитала в процентах"""
+    if len(equity) == 0:
+        return 0.0
+    peak = np.maximum.accumulate(equity)
+    return float(((equity / peak) - 1).min() * -100)
+
+
+def run_backtest(df, short_period=signals.SHORT_MA_PERIOD, long_period=signals.LONG_MA_PERIOD,
+                 confirmation=signals.SIGNAL_CONFIRMATION, stop_pct=signals.STOP_LOSS_PCT,
+                 take_pct=signals.TAKE_PROFIT_PCT, critical_pct=signals.CRITICAL_LOSS_PCT,
+                 commission_pct=0.0):
+    """Полный прогон стратегии по DataFrame свечей"""
+    close = df['close'].to_numpy(dtype=np.float64)
+    if len(close) == 0:
+        raise ValueError("Нет свечей для бэктеста")
+    
+    signal = crossover_signals(centered_cumsum(close), short_period, long_period)
+    decisions = confirmation_decisions(signal, confirmation)
+    entries, exits, reasons, pnl_pct = simulate(
+        close, decisions, stop_pct, take_pct, critical_pct, commission_pct
+    )
+    equity = equity_curve(close, entries, exits, commission_pct)
+    
+    return {
+        'signal': signal,
+        'decisions': decisions,
+        'trades': pd.DataFrame({
+            'entry_time': df.index[entries],
+            'exit_time': df.index[exits],
+            'entry_price': close[entries],
+            'exit_price': close[exits],
+            'pnl_pct': pnl_pct,
+            'reason': reasons
+        }),
+        'equity': equity,
+        'summary': summarize(pnl_pct, equity)
+    }
+
+
+def summarize(pnl_pct, equity):
+    """Итоговые показатели: сделки, P&L, просадка, доля прибыльных"""
+    trades = len(pnl_pct)
+    return {
+        'trades': trades,
+        'total_pnl_pct': float((equity[-1] - 1) * 100) if len(equity) else 0.0,
+        'sum_trade_pnl_pct': float(pnl_pct.sum()),
+        'max_drawdown_pct': max_drawdown(equity),
+        'hit_rate_pct': float((pnl_pct > 0).mean() * 100) if trades else 0.0,
+        'avg_trade_pnl_pct': float(pnl_pct.mean()) if trades else 0.0
+    }
+
+
+def verify_signals(df, signal):
+    """Сверка сигналов бэктеста с эталонным calculate_indicators бота"""
+    reference = signals.calculate_indicators(df[['close']].copy())
+    if 'signal' not in reference.columns:
+        return int(np.count_nonzero(signal))
+    return int(np.count_nonzero(reference['signal'].to_numpy() != signal))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест стратегии пересечения MA")
+    parser.add_argument('path', help="CSV или Parquet со свечами либо каталог архива свечей")
+    parser.add_argument('--figi', default=signals.FIGI, help="Инструмент в архиве свечей")
+    parser.add_argument('--short', type=int, default=signals.SHORT_MA_PERIOD)
+    parser.add_argument('--long', type=int, default=signals.LONG_MA_PERIOD)
+    parser.add_argument('--confirmation', type=int, default=signals.SIGNAL_CONFIRMATION)
+    parser.add_argument('--stop', type=float, default=signals.STOP_LOSS_PCT)
+    parser.add_argument('--take', type=float, default=signals.TAKE_PROFIT_PCT)
+    parser.add_argument('--critical', type=float, default=signals.CRITICAL_LOSS_PCT)
+    parser.add_argument('--commission', type=float, default=0.0, help="Комиссия за сделку, %%")
+    parser.add_argument('--trades', action='store_true', help="Вывести список сделок")
+    parser.add_argument('--verify', action='store_true', help="Сверить сигналы с calculate_indicators")
+    args = parser.parse_args()
+    
+    df = load_candles(args.path, args.figi)
+    started = time.perf_counter()
+    result = run_backtest(
+        df, args.short, args.long, args.confirmation,
+        args.stop, args.take, args.critical, args.commission
+    )
+    elapsed = time.perf_counter() - started
+    
+    summary = result['summary']
+    print(f"Свечей: {len(df)}, расчет: {elapsed * 1000:.1f} мс")
+    print(f"Сделок: {summary['trades']}")
+    print(f"P&L: {summary['total_pnl_pct']:+.2f}% (сумма по сделкам {summary['sum_trade_pnl_pct']:+.2f}%)")
+    print(f"Максимальная просадка: {summary['max_drawdown_pct']:.2f}%")
+    print(f"Прибыльных сделок: {summary['hit_rate_pct']:.1f}%")
+    
+    if args.trades:
+        print(result['trades'].to_string(index=False))
+    if args.verify:
+        print(f"Расхождений с calculate_indicators: {verify_signals(df, result['signal'])}")
+
+
+if __name__ == '__main__':
+    main()
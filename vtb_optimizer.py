@@ -0,0 +1,205 @@
+"""Подбор параметров стратегии перебором по сетке или случайным поиском.
+
+Каждая комбинация (короткая MA, длинная MA, подтверждения, стоп, тейк)
+прогоняется через бэктест из vtb_backtest.py на всех ядрах. Цены и их
+накопленная сумма один раз кладутся в общую память, процессы читают их без
+копирования, а любое окно MA считается по накопленной сумме за O(1) на свечу.
+
+Запуск:
+    python vtb_optimizer.py candles.csv --short 3:10 --long 15:60:5 --confirmation 1:5
+    python vtb_optimizer.py candles.parquet --random 2000 --walk-forward 5 --output results.csv
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import vtb_backtest as backtest
+import vtb_scalper_signals as signals
+
+TASK_SIZE = 64  # Комбинаций в одной задаче процесса
+
+# Представления общей памяти внутри рабочего процесса
+worker_memory = None
+worker_close = None
+worker_cumsum = None
+
+
+def attach_shared(name, n):
+    """Инициализатор процесса: подключение к общей памяти с ценами и суммами"""
+    global worker_memory, worker_close, worker_cumsum
+    worker_memory = shared_memory.SharedMemory(name=name)
+    worker_close = np.ndarray((n,), dtype=np.float64, buffer=worker_memory.buf)
+    worker_cumsum = np.ndarray((n + 1,), dtype=np.int64, buffer=worker_memory.buf, offset=n * 8)
+
+
+def evaluate_task(params_list, start, end, commission_pct):
+    """Оценка пачки комбинаций на отрезке свечей [start, end)"""
+    close = worker_close[start:end]
+    results = []
+    
+    # Сигналы зависят только от пары периодов - считаем их один раз на пару
+    by_periods = defaultdict(list)
+    for params in params_list:
+        by_periods[(params['short'], params['long'])].append(params)
+    
+    for (short_period, long_period), group in by_periods.items():
+        # Окна считаются по полной истории, поэтому начало отрезка уже "прогрето"
+        signal = backtest.crossover_signals(worker_cumsum[:end + 1], short_period, long_period)[start:end]
+        decisions_cache = {}
+        for params in group:
+            confirmation = params['confirmation']
+            if confirmation not in decisions_cache:
+                decisions_cache[confirmation] = backtest.confirmation_decisions(signal, confirmation)
+            entries, exits, _, pnl_pct = backtest.simulate(
+                close, decisions_cache[confirmation],
+                params['stop'], params['take'], signals.CRITICAL_LOSS_PCT, commission_pct
+            )
+            equity = backtest.equity_curve(close, entries, exits, commission_pct)
+            results.append({**params, **backtest.summarize(pnl_pct, equity)})
+    return results
+
+
+def parse_values(text, cast=int):
+    """Значения из 'a:b[:шаг]' (включительно) или 'x,y,z'"""
+    if ':' in text:
+        parts = [cast(part) for part in text.split(':')]
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) > 2 else cast(1)
+        values = []
+        value = start
+        while value <= stop:
+            values.append(value)
+            value += step
+        return values
+    return [cast(part) for part in text.split(',')]
+
+
+def build_grid(shorts, longs, confirmations, stops, takes, samples=None, seed=0):
+    """Все допустимые комбинации (short < long) или случайная выборка из них"""
+    grid = [
+        {'short': s, 'long': l, 'confirmation': c, 'stop': st, 'take': tp}
+        for s, l, c, st, tp in itertools.product(shorts, longs, confirmations, stops, takes)
+        if s < l
+    ]
+    if samples is not None and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+class SharedCandles:
+    """Цены и накопленная сумма в общей памяти для пула процессов"""
+    
+    def __init__(self, close):
+        self.n = len(close)
+        self.memory = shared_memory.SharedMemory(create=True, size=(2 * self.n + 1) * 8)
+        # Цены float64, за ними накопленная сумма в нано-единицах int64
+        prices = np.ndarray((self.n,), dtype=np.float64, buffer=self.memory.buf)
+        cumsum = np.ndarray((self.n + 1,), dtype=np.int64, buffer=self.memory.buf, offset=self.n * 8)
+        prices[:] = close
+        cumsum[:] = backtest.centered_cumsum(close)
+    
+    def pool(self, workers):
+        return ProcessPoolExecutor(
+            max_workers=workers, initializer=attach_shared, initargs=(self.memory.name, self.n)
+        )
+    
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def run_grid(pool, grid, start, end, commission_pct=0.0, sort_by='total_pnl_pct'):
+    """Параллельная оценка сетки на отрезке, результат отсортирован по убыванию sort_by"""
+    # Комбинации с одной парой периодов идут подряд, чтобы делить расчет сигналов
+    grid = sorted(grid, key=lambda p: (p['short'], p['long'], p['confirmation']))
+    tasks = [grid[i:i + TASK_SIZE] for i in range(0, len(grid), TASK_SIZE)]
+    futures = [pool.submit(evaluate_task, task, start, end, commission_pct) for task in tasks]
+    
+    rows = []
+    for future in futures:
+        rows.extend(future.result())
+    return pd.DataFrame(rows).sort_values(sort_by, ascending=False, ignore_index=True)
+
+
+def walk_forward(pool, grid, n, folds, commission_pct=0.0, sort_by='total_pnl_pct'):
+    """Скользящая проверка: подбор на отрезке и проверка лучших параметров на следующем"""
+    edges = np.linspace(0, n, folds + 1, dtype=np.int64)
+    rows = []
+    for i in range(1, folds):
+        train_start, train_end, test_end = edges[i - 1], edges[i], edges[i + 1]
+        train = run_grid(pool, grid, train_start, train_end, commission_pct, sort_by)
+        best = {key: train.iloc[0][key] for key in ('short', 'long', 'confirmation', 'stop', 'take')}
+        best = {key: (int(value) if key in ('short', 'long', 'confirmation') else float(value))
+                for key, value in best.items()}
+        test = run_grid(pool, [best], train_end, test_end, commission_pct, sort_by).iloc[0]
+        rows.append({
+            'fold': i,
+            **best,
+            'train_' + sort_by: train.iloc[0][sort_by],
+            'test_total_pnl_pct': test['total_pnl_pct'],
+            'test_max_drawdown_pct': test['max_drawdown_pct'],
+            'test_trades': test['trades'],
+            'test_hit_rate_pct': test['hit_rate_pct']
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подбор параметров стратегии пересечения MA")
+    parser.add_argument('path', help="CSV или Parquet со свечами либо каталог архива свечей")
+    parser.add_argument('--figi', default=signals.FIGI, help="Инструмент в архиве свечей")
+    parser.add_argument('--short', default='3:10', help="Короткая MA: 'a:b[:шаг]' или 'x,y'")
+    parser.add_argument('--long', default='15:60:5', help="Длинная MA")
+    parser.add_argument('--confirmation', default='1:5', help="Количество подтверждений")
+    parser.add_argument('--stop', default=str(signals.STOP_LOSS_PCT), help="Стоп-лосс, %%")
+    parser.add_argument('--take', default=str(signals.TAKE_PROFIT_PCT), help="Тейк-профит, %%")
+    parser.add_argument('--random', type=int, default=None, help="Случайная выборка N комбинаций")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--commission', type=float, default=0.0, help="Комиссия за сделку, %%")
+    parser.add_argument('--sort', default='total_pnl_pct', help="Показатель для ранжирования")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--walk-forward', type=int, default=0, help="Количество отрезков проверки")
+    parser.add_argument('--output', help="Сохранить полную таблицу результатов в CSV")
+    args = parser.parse_args()
+    
+    df = backtest.load_candles(args.path, args.figi)
+    close = df['close'].to_numpy(dtype=np.float64)
+    grid = build_grid(
+        parse_values(args.short), parse_values(args.long), parse_values(args.confirmation),
+        parse_values(args.stop, float), parse_values(args.take, float),
+        args.random, args.seed
+    )
+    print(f"Свечей: {len(close)}, комбинаций: {len(grid)}, процессов: {args.workers}")
+    
+    shared = SharedCandles(close)
+    try:
+        with shared.pool(args.workers) as pool:
+            started = time.perf_counter()
+            results = run_grid(pool, grid, 0, len(close), args.commission, args.sort)
+            elapsed = time.perf_counter() - started
+            print(f"Перебор: {elapsed:.1f} с ({len(grid) / elapsed:.0f} комбинаций/с)")
+            print(results.head(args.top).to_string())
+            if args.output:
+                results.to_csv(args.output, index=False)
+            
+            if args.walk_forward > 1:
+                report = walk_forward(pool, grid, len(close), args.walk_forward, args.commission, args.sort)
+                print("\nСкользящая проверка:")
+                print(report.to_string(index=False))
+                compounded = (np.prod(1 + report['test_total_pnl_pct'] / 100) - 1) * 100
+                print(f"P&L на проверочных отрезках: {compounded:+.2f}%")
+    finally:
+        shared.close()
+
+
+if __name__ == '__main__':
+    main()
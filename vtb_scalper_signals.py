@@ -1,33 +1,119 @@
 import os
 import datetime
 import time
+STARTUP_STARTED = time.perf_counter()  # Отсчет фаз запуска - от начала импорта модулей
 import logging
 import asyncio
-import pandas as pd
+import functools
+import threading
+import operator
+import sqlite3
+import random
+import contextlib
+import importlib
+import json
+from bisect import bisect_left
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot, InputMediaPhoto
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from tinkoff.invest import Client, CandleInterval, SecurityTradingStatus
+from telegram.error import RetryAfter
+from tinkoff.invest import (
+    Client, AsyncClient, CandleInterval, SecurityTradingStatus,
+    CandleInstrument, LastPriceInstrument, OrderBookInstrument, TradeInstrument,
+    TradeDirection, SubscriptionInterval, RequestError
+)
+from grpc import StatusCode, RpcError
 from io import BytesIO
+from collections import OrderedDict, deque, namedtuple
+from decimal import Decimal
+
+# Графики рисуются в рабочем потоке - GUI-бэкенд не нужен, как и его поиск при импорте
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+class LazyModule:
+    """Модуль, импортируемый при первом обращении к атрибуту
+    
+    После импорта глобальное имя заменяется настоящим модулем, и дальше
+    обращения идут напрямую. pandas и matplotlib грузятся заметную долю
+    секунды, а для подключения к Telegram и ответа на /status не нужны.
+    """
+    
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+    
+    def load(self):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module
+        return module
+    
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+pd = LazyModule('pandas', 'pd')
+mdates = LazyModule('matplotlib.dates', 'mdates')
 
 # Конфигурация
 TOKEN = "your_token_invest_api"
 TELEGRAM_TOKEN = "your_noken_telegram_bot"
 TELEGRAM_CHAT_ID = "your_id_chat"
-FIGI = "BBG004730ZJ9"  # FIGI акции ВТБ
+FIGI = "BBG004730ZJ9"  # FIGI акции ВТБ (инструмент по умолчанию для команд)
+WATCHLIST = {FIGI: "ВТБ"}  # Инструменты для мониторинга: FIGI -> название
 TRADE_INTERVAL = CandleInterval.CANDLE_INTERVAL_1_MIN
 SHORT_MA_PERIOD = 5
 LONG_MA_PERIOD = 20
 HISTORY_DAYS = 1
 SIGNAL_CONFIRMATION = 3  # Количество подтверждающих сигналов
+# Дополнительные условия решения (должны выполняться все условия его стороны):
+# (индикатор, параметры, колонка, оператор, число или колонка, 'BUY' | 'SELL' | None[, таймфрейм]),
+# например ('rsi', {'period': 14}, 'rsi', '<', 70, 'BUY') или ('macd', {}, 'macd', '>', 'signal', 'BUY', '1h')
+SIGNAL_RULES = []
+TIMEFRAMES = {'5m': 5, '15m': 15, '1h': 60}  # Старшие таймфреймы из минутных свечей: название -> минут
+TIMEFRAME_AGREEMENT = []  # Таймфреймы, MA-сигнал которых должен совпадать с решением, например ['15m', '1h']
+CRITICAL_LOSS_PCT = -5  # Критический убыток по позиции (%)
+STOP_LOSS_PCT = -3  # Предупреждение о стоп-лоссе (%)
+TAKE_PROFIT_PCT = 5  # Предупреждение о тейк-профите (%)
+STREAMING_MODE = False  # Получать свечи и цены из стрима вместо опроса раз в минуту
+STREAM_RECONNECT_MIN_DELAY = 1  # Начальная пауза перед переподключением стрима (сек)
+STREAM_RECONNECT_MAX_DELAY = 60  # Максимальная пауза перед переподключением стрима (сек)
+STREAM_PRICE_MAX_AGE = 60  # Максимальный возраст цены из стрима (сек)
+CANDLE_SYNC_BATCH = 20  # Сколько инструментов за тик догружают свечи через API
+API_TIMEOUT = 15  # Таймаут запроса к Invest API (сек)
+RENDER_TIMEOUT = 30  # Таймаут построения графика (сек)
+CHART_CACHE_SIZE = 32  # Сколько готовых графиков держать в кэше
+IO_WORKERS = 4  # Потоков для блокирующих запросов к Invest API
+CLIENT_HEALTH_INTERVAL = 300  # Период проверки соединения с Invest API (сек)
+CANDLE_ARCHIVE_DIR = "candles"  # Каталог архива свечей на диске (None - без архива)
+STATE_DB_PATH = "vtb_state.db"  # SQLite-журнал позиций и сигналов (None - без сохранения)
+SIGNAL_HISTORY_SIZE = 60  # Сколько последних сигналов хранить по инструменту
+SIGNAL_HISTORY_MAX_AGE = 300  # Сохраненные сигналы старше этого не восстанавливаются (сек)
+TELEGRAM_RATE = 1  # Сообщений в секунду в чат (лимит Telegram)
+TELEGRAM_BURST = 3  # Сколько сообщений можно отправить подряд без паузы
+ALERT_DEDUP_WINDOW = 300  # Повтор однотипного предупреждения по инструменту не чаще (сек)
+RISK_HYSTERESIS_PCT = 0.5  # На сколько прибыль должна вернуться за порог, чтобы выйти из зоны (%)
+RISK_ALERT_COOLDOWN = 300  # Повторный вход в ту же зону риска не оповещается раньше (сек)
+POSITION_STATUS_INTERVAL = 30 * 60  # Период отчета о статусе позиции (сек)
+TICK_INTERVAL = 60  # Длительность свечи TRADE_INTERVAL - период тиков опроса (сек)
+TICK_SETTLE_DELAY = 2  # Пауза после закрытия свечи, чтобы биржа ее отдала (сек)
+DECISION_MAX_AGE = 2 * TICK_INTERVAL  # Решение по свече, закрытой раньше, помечается как запоздавшее (сек)
+LOOP_BACKOFF_MIN = 5  # Начальная пауза после ошибки основного цикла (сек)
+LOOP_BACKOFF_MAX = 120  # Максимальная пауза после ошибок подряд (сек)
+METRICS_ENABLED = True  # Замер времени этапов основного цикла
+METRICS_HTTP_PORT = None  # Порт для метрик в формате Prometheus на 127.0.0.1 (None - выключено)
+ORDER_BOOK_ENABLED = False  # Стакан и поток сделок в уведомлениях о сигналах
+ORDER_BOOK_DEPTH = 20  # Уровней стакана на сторону (глубина Invest API: 1, 10, 20, 30, 40, 50)
+ORDER_BOOK_IMBALANCE_LEVELS = 5  # По скольким лучшим уровням считать дисбаланс объемов
+ORDER_BOOK_MAX_AGE = 10  # Стакан старше этого запрашивается заново (сек)
+TRADE_FLOW_HALF_LIFE = 60  # Период полураспада объемов в потоке сделок (сек)
+STREAM_RECORD_PATH = None  # Запись событий стрима в JSON Lines для воспроизведения (None - без записи)
+
+NO_TIME = np.iinfo(np.int64).min  # Метка "свечей еще не было"
+NANO = 1_000_000_000  # Нано-единиц в единице цены и в секунде
 
 # Глобальные переменные состояния
-current_position = 0  # 0 - нет позиции, 1 - куплено
-entry_price = 0.0
-entry_time = None
-signals_history = []
+instruments = {}  # FIGI -> InstrumentState
 bot_instance = None
 
 # Настройка логгера
@@ -37,126 +123,660 @@ logging.basicConfig(
 )
 logger = logging.getLogger('VTBSignalSystem')
 
-# ================== Telegram Bot Functions ================== #
-async def telegram_send_message(text, reply_markup=None):
-    """Отправка сообщения в Telegram"""
-    try:
-        await bot_instance.send_message(
-            chat_id=TELEGRAM_CHAT_ID,
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+# Пулы для блокирующих операций, чтобы не останавливать цикл событий Telegram
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='invest-io')
+render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chart-render')  # Одна фигура на поток рендеринга
+
+async def run_blocking(func, *args, executor=None, timeout=API_TIMEOUT):
+    """Выполнение блокирующей функции в пуле потоков с таймаутом"""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor or io_executor, functools.partial(func, *args))
+    if timeout is None:
+        return await future
+    # По таймауту обработчик получает ошибку, а поток завершит запрос в фоне
+    return await asyncio.wait_for(future, timeout)
+
+# ================== Metrics ================== #
+# Границы корзин гистограмм задержек: от 0.1 мс до ~75 с с шагом sqrt(2)
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** (i / 2) for i in range(40))
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+    __slots__ = ('counts', 'total', 'count', 'lock')
+    
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()  # Замеры приходят и из пулов потоков
+    
+    def observe(self, seconds):
+        i = bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+    
+    def copy(self):
+        """Согласованная копия для вывода, пока замеры продолжаются"""
+        histogram = Histogram()
+        with self.lock:
+            histogram.counts = list(self.counts)
+            histogram.total, histogram.count = self.total, self.count
+        return histogram
+    
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попадает q-й процентиль"""
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)]
+        return LATENCY_BUCKETS[-1]
+
+class StageTimer:
+    """Контекстный менеджер замера одного этапа"""
+    __slots__ = ('histogram', 'started')
+    
+    def __init__(self, histogram):
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+NULL_TIMER = contextlib.nullcontext()
+
+class Metrics:
+    """Гистограммы времени этапов и счетчики; при выключенном режиме замеры ничего не делают"""
+    
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []  # Функции, возвращающие счетчики других подсистем
+        self.lock = threading.Lock()
+    
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        return histogram
+    
+    def time(self, stage):
+        """with metrics.time('этап'): ... - замер времени блока"""
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self.histogram(stage))
+    
+    def observe(self, stage, seconds):
+        if self.enabled:
+            self.histogram(stage).observe(seconds)
+    
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+    
+    def nonempty_histograms(self):
+        """Копии гистограмм с замерами, по имени этапа
+        
+        Словарь копируется под блокировкой: этапы регистрируются из пулов потоков
+        во время вывода. Зарегистрированный этап без замеров не выводится.
+        """
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        copies = ((stage, histogram.copy()) for stage, histogram in histograms)
+        return [(stage, histogram) for stage, histogram in copies if histogram.count]
+    
+    def all_counters(self):
+        with self.lock:
+            counters = dict(self.counters)
+        for collect in self.collectors:
+            counters.update(collect())
+        return counters
+    
+    def render_text(self):
+        """Сводка для команды /metrics"""
+        if not self.enabled:
+            return "Метрики выключены (METRICS_ENABLED = False)"
+        lines = ["📈 *Метрики* (мс: p50 / p95 / p99, количество)"]
+        for stage, histogram in self.nonempty_histograms():
+            p50, p95, p99 = (histogram.percentile(q) * 1000 for q in (50, 95, 99))
+            lines.append(f"• `{stage}`: {p50:.1f} / {p95:.1f} / {p99:.1f}, {histogram.count}")
+        counters = self.all_counters()
+        if counters:
+            lines.append("")
+            lines.extend(f"• `{name}`: {value}" for name, value in sorted(counters.items()))
+        return "\n".join(lines)
+    
+    def render_prometheus(self):
+        """Метрики в текстовом формате Prometheus"""
+        lines = ["# TYPE vtb_stage_seconds histogram"]
+        for stage, histogram in self.nonempty_histograms():
+            total, count = histogram.total, histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'vtb_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'vtb_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'vtb_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'vtb_stage_seconds_count{{stage="{stage}"}} {count}')
+        for name, value in sorted(self.all_counters().items()):
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            lines.append(f"# TYPE vtb_{name} {kind}")
+            lines.append(f"vtb_{name} {value}")
+        return "\n".join(lines) + "\n"
+    
+    async def serve_http(self, port, host='127.0.0.1'):
+        """Минимальный HTTP-сервер: на любой запрос отдает render_prometheus()"""
+        async def handle(reader, writer):
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+                body = self.render_prometheus().encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: text/plain; version=0.0.4\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                    b"Connection: close\r\n\r\n" + body
+                )
+                await writer.drain()
+            except Exception as e:
+                logger.warning(f"Ошибка HTTP-запроса метрик: {str(e)}")
+            finally:
+                writer.close()
+        
+        server = await asyncio.start_server(handle, host, port)
+        logger.info(f"Метрики Prometheus: http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+metrics = Metrics()
+
+class StartupTimer:
+    """Фазы запуска: длительность каждой и время готовности от начала импорта"""
+    
+    def __init__(self, started=STARTUP_STARTED):
+        self.started = started
+        self.phases = []  # (фаза, длительность, с начала запуска), сек
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - started)
+    
+    def mark(self, name, duration):
+        self.phases.append((name, duration, time.perf_counter() - self.started))
+        metrics.observe(f'startup_{name}', duration)
+    
+    def elapsed(self, name):
+        """Время от начала запуска до конца фазы (None, если ее еще не было)"""
+        for phase, _, since_start in self.phases:
+            if phase == name:
+                return since_start
+        return None
+    
+    def report(self):
+        return ", ".join(
+            f"{name} {duration * 1000:.0f} мс (готово через {since_start * 1000:.0f} мс)"
+            for name, duration, since_start in self.phases
         )
-        logger.info(f"Telegram: {text}")
-    except Exception as e:
-        logger.error(f"Ошибка Telegram: {str(e)}")
 
-async def telegram_send_photo(photo, caption=None):
-    """Отправка изображения в Telegram"""
-    try:
-        await bot_instance.send_photo(
-            chat_id=TELEGRAM_CHAT_ID,
-            photo=photo,
-            caption=caption,
-            parse_mode='Markdown'
+startup = StartupTimer()
+
+# ================== Invest API Client ================== #
+class SharedInvestClient:
+    """Единый долгоживущий клиент Invest API с переподключением и замером задержек"""
+    
+    # Коды, при которых канал считается сломанным и пересоздается
+    RECONNECT_CODES = (StatusCode.UNAVAILABLE, StatusCode.UNKNOWN, StatusCode.INTERNAL)
+    
+    def __init__(self, token):
+        self.token = token
+        self.manager = None
+        self.client = None
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.reconnects = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+    
+    def get(self):
+        """Сервисы клиента; соединение открывается при первом обращении"""
+        with self.lock:
+            if self.client is None:
+                self.manager = Client(self.token)
+                self.client = self.manager.__enter__()
+            return self.client
+    
+    def reconnect(self, failed_client):
+        """Закрытие сломанного канала; новый откроется при следующем вызове"""
+        with self.lock:
+            # Канал мог уже пересоздать другой поток
+            if self.client is not failed_client:
+                return
+            try:
+                self.manager.__exit__(None, None, None)
+            except Exception as e:
+                logger.warning(f"Ошибка закрытия канала Invest API: {str(e)}")
+            self.manager = None
+            self.client = None
+            self.reconnects += 1
+    
+    def is_broken(self, error):
+        """Ошибка сломанного канала: код из RECONNECT_CODES в ответе API или у транспорта gRPC"""
+        if isinstance(error, RequestError):
+            return error.code in self.RECONNECT_CODES
+        if isinstance(error, RpcError):
+            code = getattr(error, 'code', None)
+            return code is None or code() in self.RECONNECT_CODES
+        return False
+    
+    def call(self, func, *args):
+        """Вызов func(client, *args) с одной повторной попыткой после переподключения
+        
+        Переподключение и повтор - только при сломанном канале (is_broken).
+        Остальные ошибки, в том числе ошибки разбора ответа в func, пробрасываются
+        без изменений: повтор их не исправит, а переподключение оборвет запросы
+        других потоков.
+        """
+        for attempt in range(2):
+            client = self.get()
+            started = time.perf_counter()
+            try:
+                result = func(client, *args)
+            except Exception as e:
+                self.errors += 1
+                if not self.is_broken(e) or attempt == 1:
+                    raise
+                logger.warning(f"Соединение с Invest API потеряно, переподключение: {str(e)}")
+                self.reconnect(client)
+                self.retries += 1
+                continue
+            
+            latency = time.perf_counter() - started
+            metrics.observe('invest_api_call', latency)
+            self.calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            return result
+    
+    def health_check(self):
+        """Легкий запрос для проверки соединения"""
+        self.call(lambda client: client.users.get_info())
+    
+    def stats(self):
+        """Сводка по вызовам для логов"""
+        average = self.total_latency / self.calls * 1000 if self.calls else 0.0
+        return (
+            f"вызовов {self.calls}, ошибок {self.errors}, переподключений {self.reconnects}, "
+            f"средняя задержка {average:.1f} мс, максимальная {self.max_latency * 1000:.1f} мс"
         )
-    except Exception as e:
-        logger.error(f"Ошибка отправки фото: {str(e)}")
+    
+    def close(self):
+        with self.lock:
+            if self.manager is not None:
+                self.manager.__exit__(None, None, None)
+            self.manager = None
+            self.client = None
+
+invest_client = SharedInvestClient(TOKEN)
+metrics.collectors.append(lambda: {
+    'invest_api_calls_total': invest_client.calls,
+    'invest_api_errors_total': invest_client.errors,
+    'invest_api_retries_total': invest_client.retries,
+    'invest_api_reconnects_total': invest_client.reconnects
+})
+
+async def client_health_monitoring():
+    """Периодическая проверка соединения с Invest API"""
+    while True:
+        await asyncio.sleep(CLIENT_HEALTH_INTERVAL)
+        try:
+            await run_blocking(invest_client.health_check)
+            logger.info(f"Invest API: {invest_client.stats()}")
+            logger.info(f"Telegram: {outbox.stats()}")
+        except Exception as e:
+            logger.error(f"Проверка соединения с Invest API не прошла: {str(e)}")
+
+# ================== Telegram Outbox ================== #
+class TokenBucket:
+    """Ограничение частоты: rate токенов в секунду, не больше burst подряд"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def delay(self):
+        """Взять токен: 0 - если удалось, иначе сколько ждать до следующего"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    async def acquire(self):
+        while True:
+            delay = self.delay()
+            if delay == 0:
+                return
+            await asyncio.sleep(delay)
+
+class TelegramOutbox:
+    """Очередь исходящих сообщений с ограничением частоты и склейкой предупреждений
+    
+    Сообщение с ключом (тип предупреждения, FIGI и время входа в позицию) заменяет еще не отправленное
+    сообщение с тем же ключом, а после доставки повтор с этим ключом
+    отбрасывается в течение dedup_window. Ответ RetryAfter возвращает
+    сообщение в начало очереди после паузы, которую назвал Telegram.
+    """
+    
+    def __init__(self, rate=TELEGRAM_RATE, burst=TELEGRAM_BURST, dedup_window=ALERT_DEDUP_WINDOW):
+        self.bucket = TokenBucket(rate, burst)
+        self.dedup_window = dedup_window
+        self.pending = OrderedDict()  # ключ -> (метод бота, параметры, время постановки)
+        self.delivered_at = {}  # ключ -> время последней доставки
+        self.sequence = 0
+        self.wakeup = None
+        self.latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.coalesced = 0
+        self.deduplicated = 0
+        self.retries = 0
+        self.failed = 0
+    
+    def submit(self, method, key=None, **kwargs):
+        """Постановка сообщения в очередь без ожидания отправки"""
+        now = time.monotonic()
+        if key is None:
+            self.sequence += 1
+            key = ('message', self.sequence)
+        else:
+            delivered = self.delivered_at.get(key)
+            if delivered is not None and now - delivered < self.dedup_window:
+                self.deduplicated += 1
+                return
+            if key in self.pending:
+                # Новый текст занимает место и время постановки старого
+                self.pending[key] = (method, kwargs, self.pending[key][2])
+                self.coalesced += 1
+                return
+        
+        self.pending[key] = (method, kwargs, now)
+        if self.wakeup is not None:
+            self.wakeup.set()
+    
+    async def run(self, bot):
+        """Отправка очереди с учетом лимитов; работает до отмены задачи"""
+        self.wakeup = asyncio.Event()
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            await self.bucket.acquire()
+            key, (method, kwargs, queued_at) = self.pending.popitem(last=False)
+            try:
+                with metrics.time('telegram_send'):
+                    await getattr(bot, method)(chat_id=TELEGRAM_CHAT_ID, parse_mode='Markdown', **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Telegram ограничил отправку, пауза {retry_after} сек")
+                self.retries += 1
+                # Если за это время пришла новая версия, отправится она
+                self.pending.setdefault(key, (method, kwargs, queued_at))
+                self.pending.move_to_end(key, last=False)
+                await asyncio.sleep(retry_after)
+                continue
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка Telegram: {str(e)}")
+                continue
+            
+            now = time.monotonic()
+            self.sent += 1
+            self.latencies.append(now - queued_at)
+            metrics.observe('telegram_delivery', now - queued_at)
+            if key[0] != 'message':
+                # Ключи закрытых позиций не копятся: устаревшие отметки удаляются
+                self.delivered_at = {k: t for k, t in self.delivered_at.items() if now - t < self.dedup_window}
+                self.delivered_at[key] = now
+            logger.info(f"Telegram: {kwargs.get('text') or kwargs.get('caption')}")
+    
+    async def flush(self, timeout=10):
+        """Ожидание отправки очереди, но не дольше timeout"""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            'sent': self.sent,
+            'queued': len(self.pending),
+            'coalesced': self.coalesced,
+            'deduplicated': self.deduplicated,
+            'retries': self.retries,
+            'failed': self.failed,
+            'p50_latency_s': round(latencies[len(latencies) // 2], 3) if latencies else None,
+            'max_latency_s': round(latencies[-1], 3) if latencies else None
+        }
 
-def create_signal_keyboard():
+outbox = TelegramOutbox()
+metrics.collectors.append(lambda: {
+    'telegram_sent_total': outbox.sent,
+    'telegram_coalesced_total': outbox.coalesced,
+    'telegram_deduplicated_total': outbox.deduplicated,
+    'telegram_retries_total': outbox.retries,
+    'telegram_errors_total': outbox.failed,
+    'telegram_queued': len(outbox.pending)
+})
+
+# ================== Telegram Bot Functions ================== #
+async def telegram_send_message(text, reply_markup=None, key=None):
+    """Отправка сообщения в Telegram через очередь"""
+    outbox.submit('send_message', key, text=text, reply_markup=reply_markup)
+
+async def telegram_send_photo(photo, caption=None, reply_markup=None, key=None):
+    """Отправка изображения в Telegram через очередь"""
+    outbox.submit('send_photo', key, photo=photo, caption=caption, reply_markup=reply_markup)
+
+def resolve_instrument(args):
+    """Поиск инструмента по аргументу команды (FIGI или название)"""
+    if not args:
+        return instruments.get(FIGI)
+    
+    key = args[0].strip()
+    if key.upper() in instruments:
+        return instruments[key.upper()]
+    for state in instruments.values():
+        if state.name.lower() == key.lower():
+            return state
+    return None
+
+def snapshot_price(state):
+    """Цена из снимка последнего тика (None, пока тиков не было)"""
+    return None if state.snapshot is None else state.snapshot.price
+
+def position_profit(state, current_price):
+    """Прибыль позиции в процентах; None без текущей цены или цены входа"""
+    if current_price is None or state.entry_price <= 0:
+        return None
+    return (current_price - state.entry_price) / state.entry_price * 100
+
+def format_profit(profit):
+    return "н/д" if profit is None else f"{profit:+.2f}%"
+
+def price_retry_keyboard(data, state):
+    """Кнопки повтора действия, если цену получить не удалось"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Повторить", callback_data=data)],
+        [InlineKeyboardButton("❌ Отменить", callback_data=f'cancel_signal:{state.figi}')]
+    ])
+
+def parse_callback_data(data):
+    """Разбор callback_data вида 'действие:FIGI'"""
+    action, _, figi = data.partition(':')
+    return action, instruments.get(figi or FIGI)
+
+def create_signal_keyboard(state):
     """Создание клавиатуры для управления позицией"""
     keyboard = [
-        [InlineKeyboardButton("✅ Подтвердить покупку", callback_data='confirm_buy')],
-        [InlineKeyboardButton("❌ Отменить сигнал", callback_data='cancel_signal')],
-        [InlineKeyboardButton("📊 Показать график", callback_data='show_chart')]
+        [InlineKeyboardButton("✅ Подтвердить покупку", callback_data=f'confirm_buy:{state.figi}')],
+        [InlineKeyboardButton("❌ Отменить сигнал", callback_data=f'cancel_signal:{state.figi}')],
+        [InlineKeyboardButton("📊 Показать график", callback_data=f'show_chart:{state.figi}')]
     ]
-    if current_position == 1:
-        keyboard[0][0] = InlineKeyboardButton("✅ Подтвердить продажу", callback_data='confirm_sell')
-        keyboard.append([InlineKeyboardButton("⚡ Экстренная продажа", callback_data='emergency_sell')])
+    if state.position == 1:
+        keyboard[0][0] = InlineKeyboardButton("✅ Подтвердить продажу", callback_data=f'confirm_sell:{state.figi}')
+        keyboard.append([InlineKeyboardButton("⚡ Экстренная продажа", callback_data=f'emergency_sell:{state.figi}')])
     
     return InlineKeyboardMarkup(keyboard)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка команды /start"""
     await update.message.reply_text(
-        "🚀 Система сигналов для торговли акциями ВТБ активирована!\n"
-        "Используйте команды:\n"
-        "/status - текущий статус\n"
-        "/chart - текущий график\n"
-        "/position - управление позицией"
+        "🚀 Система сигналов для торговли акциями активирована!\n"
+        "Используйте команды (инструмент - FIGI или название, по умолчанию ВТБ):\n"
+        "/status [инструмент] - текущий статус\n"
+        "/chart [инструмент] - текущий график\n"
+        "/position [инструмент] - управление позицией\n"
+        "/metrics - время этапов и счетчики"
     )
 
+SIGNAL_NAMES = {1: "📈 покупка", -1: "📉 продажа", 0: "нет"}
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка команды /status"""
-    status = "🟢 Активна" if len(signals_history) > 0 else "🟡 Ожидание данных"
-    position_status = "Куплено" if current_position == 1 else "Нет позиции"
-    
-    message = (
-        f"📊 *Статус системы*\n"
-        f"• Система: {status}\n"
-        f"• Позиция: {position_status}\n"
-        f"• Акция: ВТБ\n"
-        f"• FIGI: `{FIGI}`\n"
-        f"• Последних сигналов: {len(signals_history)}"
-    )
+    state = resolve_instrument(context.args)
+    message_target = update.message or update.callback_query.message
+    if not instruments:
+        await message_target.reply_text("⏳ Система запускается, загружается история свечей")
+        return
+    if state is None:
+        await message_target.reply_text("⚠️ Инструмент не найден в списке мониторинга")
+        return
     
-    if current_position == 1:
-        current_price = await get_current_price()
-        profit = (current_price - entry_price) / entry_price * 100
-        hold_time = (datetime.datetime.now() - entry_time).total_seconds() / 60
+    # Только данные последнего тика и состояние в памяти - без запросов к бирже
+    with metrics.time('status_command'):
+        snapshot = state.snapshot
+        status = "🟢 Активна" if snapshot is not None else "🟡 Ожидание данных"
+        position_status = "Куплено" if state.position == 1 else "Нет позиции"
+        open_positions = sum(1 for s in instruments.values() if s.position == 1)
         
-        message += (
-            f"\n\n💰 *Текущая позиция*\n"
-            f"• Цена входа: {entry_price:.2f} RUB\n"
-            f"• Время входа: {entry_time.strftime('%Y-%m-%d %H:%M')}\n"
-            f"• Текущая цена: {current_price:.2f} RUB\n"
-            f"• Прибыль: {profit:+.2f}%\n"
-            f"• Время удержания: {hold_time:.1f} мин"
+        message = (
+            f"📊 *Статус системы*\n"
+            f"• Система: {status}\n"
+            f"• Инструментов в мониторинге: {len(instruments)}\n"
+            f"• Открытых позиций: {open_positions}\n"
+            f"• Позиция: {position_status}\n"
+            f"• Акция: {state.name}\n"
+            f"• FIGI: `{state.figi}`\n"
+            f"• Последних сигналов: {len(state.signals_history)}"
         )
+        
+        current_price = None
+        if snapshot is not None:
+            current_price = snapshot.price
+            message += f"\n• Последний сигнал: {SIGNAL_NAMES.get(snapshot.signal, 'нет')}"
+            if snapshot.timeframes:
+                trends = ", ".join(f"{name} {SIGNAL_NAMES[signal]}" for name, signal in snapshot.timeframes.items())
+                message += f"\n• Таймфреймы: {trends}"
+            if current_price is not None:
+                message += (
+                    f"\n• Цена: {current_price:.2f} RUB "
+                    f"(тик {snapshot.time.astimezone().strftime('%H:%M:%S')})"
+                )
+        
+        if state.position == 1:
+            hold_time = (datetime.datetime.now() - state.entry_time).total_seconds() / 60
+            message += (
+                f"\n\n💰 *Текущая позиция*\n"
+                f"• Цена входа: {state.entry_price:.2f} RUB\n"
+                f"• Время входа: {state.entry_time.strftime('%Y-%m-%d %H:%M')}\n"
+            )
+            if current_price is not None:
+                message += (
+                    f"• Текущая цена: {current_price:.2f} RUB\n"
+                    f"• Прибыль: {format_profit(position_profit(state, current_price))}\n"
+                )
+            message += f"• Время удержания: {hold_time:.1f} мин"
     
-    await update.message.reply_text(message, parse_mode='Markdown')
+    await message_target.reply_text(message, parse_mode='Markdown')
 
-async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка команды /chart"""
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка команды /metrics"""
+    await update.message.reply_text(metrics.render_text(), parse_mode='Markdown')
+
+async def reply_with_chart(message, state):
+    """Ответ графиком инструмента из хранилища свечей"""
     try:
-        with Client(TOKEN) as client:
-            df = get_historical_candles(client, HISTORY_DAYS)
-            if df.empty:
-                await update.message.reply_text("⚠️ Недостаточно данных для построения графика")
-                return
-            
-            fig = generate_chart(df)
-            
-            # Сохраняем график в буфер
-            buf = BytesIO()
-            fig.savefig(buf, format='png', dpi=100)
-            buf.seek(0)
-            
-            await update.message.reply_photo(
-                photo=buf,
-                caption="📈 Текущий график ВТБ с индикаторами",
-                parse_mode='Markdown'
-            )
+        # График по снимку последнего тика - те же свечи и индикаторы, что у сигналов
+        snapshot = state.snapshot
+        if snapshot is None or snapshot.candles.empty:
+            await message.reply_text("⚠️ Недостаточно данных для построения графика")
+            return
+        
+        png = await get_chart_png(state, snapshot.indicators())
+        
+        await message.reply_photo(
+            photo=png,
+            caption=f"📈 Текущий график {state.name} с индикаторами",
+            parse_mode='Markdown'
+        )
     except Exception as e:
         logger.error(f"Ошибка при построении графика: {str(e)}", exc_info=True)
-        await update.message.reply_text(f"⚠️ Ошибка при построении графика: {str(e)}")
+        await message.reply_text(f"⚠️ Ошибка при построении графика: {str(e)}")
+
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка команды /chart"""
+    state = resolve_instrument(context.args)
+    if state is None:
+        await update.message.reply_text("⚠️ Инструмент не найден в списке мониторинга")
+        return
+    
+    await reply_with_chart(update.message, state)
 
 async def position_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка команды /position"""
+    state = resolve_instrument(context.args)
+    if state is None:
+        await update.message.reply_text("⚠️ Инструмент не найден в списке мониторинга")
+        return
+    
     keyboard = []
     
-    if current_position == 0:
-        keyboard.append([InlineKeyboardButton("📈 Сигнал на покупку", callback_data='force_buy')])
+    if state.position == 0:
+        keyboard.append([InlineKeyboardButton("📈 Сигнал на покупку", callback_data=f'force_buy:{state.figi}')])
     else:
-        keyboard.append([InlineKeyboardButton("📉 Сигнал на продажу", callback_data='force_sell')])
-        keyboard.append([InlineKeyboardButton("🔥 Экстренная продажа", callback_data='emergency_sell')])
+        keyboard.append([InlineKeyboardButton("📉 Сигнал на продажу", callback_data=f'force_sell:{state.figi}')])
+        keyboard.append([InlineKeyboardButton("🔥 Экстренная продажа", callback_data=f'emergency_sell:{state.figi}')])
     
-    keyboard.append([InlineKeyboardButton("🔄 Обновить статус", callback_data='refresh_status')])
+    keyboard.append([InlineKeyboardButton("🔄 Обновить статус", callback_data=f'refresh_status:{state.figi}')])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await update.message.reply_text(
-        "⚙️ Управление позицией:",
+        f"⚙️ Управление позицией {state.name}:",
         reply_markup=reply_markup
     )
 
@@ -165,19 +785,30 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    global current_position, entry_price, entry_time
+    action, state = parse_callback_data(query.data)
+    if state is None:
+        await query.edit_message_text("⚠️ Инструмент больше не отслеживается")
+        return
     
-    if query.data == 'confirm_buy' and current_position == 0:
-        current_price = await get_current_price()
-        current_position = 1
-        entry_price = current_price
-        entry_time = datetime.datetime.now()
+    if action == 'confirm_buy':
+        # Повторное нажатие ждет первое и видит уже открытую позицию
+        async with state.lock:
+            if state.position != 0:
+                return
+            current_price = await get_current_price(state.figi)
+            if not current_price or current_price <= 0:
+                await query.edit_message_text(
+                    f"⚠️ Не удалось получить цену {state.name}, позиция не открыта. Попробуйте еще раз",
+                    reply_markup=price_retry_keyboard(query.data, state)
+                )
+                return
+            state.open_position(current_price)
         
         await query.edit_message_text(
             f"✅ *Позиция открыта!*\n"
-            f"• Активирована покупка ВТБ\n"
+            f"• Активирована покупка {state.name}\n"
             f"• Цена: {current_price:.2f} RUB\n"
-            f"• Время: {entry_time.strftime('%Y-%m-%d %H:%M')}\n"
+            f"• Время: {state.entry_time.strftime('%Y-%m-%d %H:%M')}\n"
             f"• Следующий сигнал на продажу будет автоматически проанализирован",
             parse_mode='Markdown'
         )
@@ -187,142 +818,570 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         take_profit_price = current_price * 1.03
         
         await telegram_send_message(
-            f"⚡ *Рекомендация по управлению рисками*\n"
+            f"⚡ *Рекомендация по управлению рисками ({state.name})*\n"
             f"Установите ордера для защиты позиции:\n"
             f"• Стоп-лосс: `{stop_loss_price:.2f} RUB` (-3%)\n"
             f"• Тейк-профит: `{take_profit_price:.2f} RUB` (+3%)\n"
             f"\n"
-            f"Изменить позицию: /position"
+            f"Изменить позицию: /position {state.figi}"
         )
     
-    elif query.data == 'confirm_sell' and current_position == 1:
-        current_price = await get_current_price()
-        profit = (current_price - entry_price) / entry_price * 100
-        hold_time = (datetime.datetime.now() - entry_time).total_seconds() / 60
-        
-        current_position = 0
-        entry_price = 0.0
+    elif action == 'confirm_sell':
+        async with state.lock:
+            if state.position != 1:
+                return
+            current_price = await get_current_price(state.figi)
+            if not current_price or current_price <= 0:
+                await query.edit_message_text(
+                    f"⚠️ Не удалось получить цену {state.name}, позиция не закрыта. Попробуйте еще раз",
+                    reply_markup=price_retry_keyboard(query.data, state)
+                )
+                return
+            profit = position_profit(state, current_price)
+            hold_time = (datetime.datetime.now() - state.entry_time).total_seconds() / 60
+            state.close_position(current_price)
         
         await query.edit_message_text(
             f"✅ *Позиция закрыта!*\n"
-            f"• Активирована продажа ВТБ\n"
+            f"• Активирована продажа {state.name}\n"
             f"• Цена: {current_price:.2f} RUB\n"
-            f"• Прибыль: {profit:+.2f}%\n"
+            f"• Прибыль: {format_profit(profit)}\n"
             f"• Время удержания: {hold_time:.1f} мин",
             parse_mode='Markdown'
         )
     
-    elif query.data == 'cancel_signal':
+    elif action == 'cancel_signal':
         await query.edit_message_text("❌ Сигнал отменен")
     
-    elif query.data == 'show_chart':
-        try:
-            with Client(TOKEN) as client:
-                df = get_historical_candles(client, HISTORY_DAYS)
-                if df.empty:
-                    await query.message.reply_text("⚠️ Недостаточно данных для построения графика")
-                    return
-                
-                fig = generate_chart(df)
-                
-                # Сохраняем график в буфер
-                buf = BytesIO()
-                fig.savefig(buf, format='png', dpi=100)
-                buf.seek(0)
-                
-                await query.message.reply_photo(
-                    photo=buf,
-                    caption="📈 Текущий график ВТБ с индикаторами",
-                    parse_mode='Markdown'
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при построении графика: {str(e)}", exc_info=True)
-            await query.message.reply_text(f"⚠️ Ошибка при построении графика: {str(e)}")
+    elif action == 'show_chart':
+        await reply_with_chart(query.message, state)
     
-    elif query.data == 'force_buy':
-        current_price = await get_current_price()
+    elif action == 'force_buy':
+        current_price = snapshot_price(state)
+        if current_price is None:
+            await query.edit_message_text("⚠️ Нет данных о цене, попробуйте после следующего тика")
+            return
         reply_markup = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Подтвердить покупку", callback_data='confirm_buy')],
-            [InlineKeyboardButton("❌ Отменить", callback_data='cancel_signal')]
+            [InlineKeyboardButton("✅ Подтвердить покупку", callback_data=f'confirm_buy:{state.figi}')],
+            [InlineKeyboardButton("❌ Отменить", callback_data=f'cancel_signal:{state.figi}')]
         ])
         
         await query.edit_message_text(
             f"⚠️ *Ручной сигнал на покупку*\n"
             f"• Текущая цена: {current_price:.2f} RUB\n"
-            f"• Рекомендуется покупка ВТБ\n"
+            f"• Рекомендуется покупка {state.name}\n"
             f"• Подтвердите действие:",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     
-    elif query.data == 'force_sell':
-        current_price = await get_current_price()
-        profit = (current_price - entry_price) / entry_price * 100
+    elif action == 'force_sell':
+        current_price = snapshot_price(state)
+        if current_price is None:
+            await query.edit_message_text("⚠️ Нет данных о цене, попробуйте после следующего тика")
+            return
+        profit = position_profit(state, current_price)
         
         reply_markup = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Подтвердить продажу", callback_data='confirm_sell')],
-            [InlineKeyboardButton("❌ Отменить", callback_data='cancel_signal')]
+            [InlineKeyboardButton("✅ Подтвердить продажу", callback_data=f'confirm_sell:{state.figi}')],
+            [InlineKeyboardButton("❌ Отменить", callback_data=f'cancel_signal:{state.figi}')]
         ])
         
         await query.edit_message_text(
             f"⚠️ *Ручной сигнал на продажу*\n"
             f"• Текущая цена: {current_price:.2f} RUB\n"
-            f"• Прибыль: {profit:+.2f}%\n"
-            f"• Рекомендуется продажа ВТБ\n"
+            f"• Прибыль: {format_profit(profit)}\n"
+            f"• Рекомендуется продажа {state.name}\n"
             f"• Подтвердите действие:",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     
-    elif query.data == 'emergency_sell' and current_position == 1:
-        current_price = await get_current_price()
-        profit = (current_price - entry_price) / entry_price * 100
-        
-        current_position = 0
-        entry_price = 0.0
+    elif action == 'emergency_sell':
+        async with state.lock:
+            if state.position != 1:
+                return
+            current_price = await get_current_price(state.figi)
+            if not current_price or current_price <= 0:
+                await query.edit_message_text(
+                    f"⚠️ Не удалось получить цену {state.name}, позиция не закрыта. Попробуйте еще раз",
+                    reply_markup=price_retry_keyboard(query.data, state)
+                )
+                return
+            profit = position_profit(state, current_price)
+            state.close_position(current_price, 'emergency_sell')
         
         await query.edit_message_text(
             f"🚨 *Экстренная продажа!*\n"
-            f"• Позиция принудительно закрыта\n"
+            f"• Позиция {state.name} принудительно закрыта\n"
             f"• Цена: {current_price:.2f} RUB\n"
-            f"• Прибыль: {profit:+.2f}%",
+            f"• Прибыль: {format_profit(profit)}",
             parse_mode='Markdown'
         )
     
-    elif query.data == 'refresh_status':
+    elif action == 'refresh_status':
+        context.args = [state.figi]
         await status_command(update, context)
 
+# ================== State Persistence ================== #
+class StateJournal:
+    """Журнал позиций и истории сигналов в SQLite (WAL) для восстановления после перезапуска
+    
+    Изменение позиции фиксируется сразу, история сигналов всех инструментов -
+    одной транзакцией за тик. В режиме WAL с synchronous=NORMAL коммит не
+    вызывает fsync, данные переживают падение процесса, а на диск журнал
+    сбрасывается пачками при checkpoint.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+    
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.executescript(
+                'CREATE TABLE IF NOT EXISTS positions ('
+                ' figi TEXT PRIMARY KEY, position INTEGER, entry_price REAL, entry_time TEXT);'
+                'CREATE TABLE IF NOT EXISTS position_events ('
+                ' id INTEGER PRIMARY KEY, time TEXT, figi TEXT, action TEXT, price REAL);'
+                'CREATE TABLE IF NOT EXISTS signals ('
+                ' figi TEXT PRIMARY KEY, history TEXT, saved_at REAL, candle_time INTEGER);'
+            )
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(signals)')]
+            if 'candle_time' not in columns:
+                # Журнал прежней версии: его история без времени свечи не восстанавливается
+                self.db.execute('ALTER TABLE signals ADD COLUMN candle_time INTEGER')
+        return self.db
+    
+    def record_position(self, state, action, price):
+        """Сохранение позиции и запись события в журнал"""
+        db = self.connect()
+        entry_time = state.entry_time.isoformat() if state.entry_time else None
+        with db:
+            db.execute(
+                'INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?)',
+                (state.figi, state.position, state.entry_price, entry_time)
+            )
+            db.execute(
+                'INSERT INTO position_events (time, figi, action, price) VALUES (?, ?, ?, ?)',
+                (datetime.datetime.now().isoformat(), state.figi, action, float(price))
+            )
+    
+    def save_signals(self, states):
+        """Снимок истории сигналов всех инструментов одной транзакцией
+        
+        Вместе с историей сохраняется время последней учтенной свечи: после
+        перезапуска по нему видно, какие свечи уже в истории, а какие закрылись
+        во время простоя.
+        """
+        db = self.connect()
+        saved_at = time.time()
+        with db:
+            db.executemany(
+                'INSERT OR REPLACE INTO signals VALUES (?, ?, ?, ?)',
+                [(state.figi, ','.join(str(int(s)) for s in state.signals_history), saved_at, state.signals_time)
+                 for state in states]
+            )
+    
+    def restore(self, states):
+        """Восстановление позиций и свежей истории сигналов; возвращает число открытых позиций"""
+        db = self.connect()
+        opened = 0
+        for figi, position, entry_price, entry_time in db.execute('SELECT * FROM positions'):
+            state = states.get(figi)
+            if state is None:
+                continue
+            state.position = position
+            state.entry_price = entry_price
+            state.entry_time = datetime.datetime.fromisoformat(entry_time) if entry_time else None
+            if position == 1:
+                opened += 1
+        
+        # Продолжение истории проверяется по первой новой свече (InstrumentState.record_signal)
+        cutoff = time.time() - SIGNAL_HISTORY_MAX_AGE
+        for figi, history, saved_at, candle_time in db.execute('SELECT figi, history, saved_at, candle_time FROM signals'):
+            state = states.get(figi)
+            if state is not None and history and saved_at >= cutoff and candle_time is not None:
+                state.signals_history.extend(int(s) for s in history.split(','))
+                state.signals_time = candle_time
+                state.history_restored = True
+        return opened
+    
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+state_journal = StateJournal(STATE_DB_PATH) if STATE_DB_PATH else None
+
 # ================== Trading Signal Functions ================== #
-def get_historical_candles(client, days):
-    """Получение исторических данных"""
-    now_time = datetime.datetime.utcnow()
+def get_historical_candles(client, days, figi=FIGI):
+    """Получение исторических данных: из архива на диске, через API - только недостающее"""
+    now_time = datetime.datetime.now(datetime.timezone.utc)
     from_time = now_time - datetime.timedelta(days=days)
-    
+    if candle_archive is not None:
+        return candle_archive.load(client, figi, from_time, now_time)
+    return get_candles_range(client, figi, from_time, now_time)
+
+def get_candles_range(client, figi, from_time, to_time):
+    """Получение свечей за произвольный интервал"""
     candles = client.get_all_candles(
-        figi=FIGI,
+        figi=figi,
         from_=from_time,
-        to=now_time,
+        to=to_time,
         interval=TRADE_INTERVAL
     )
     
-    data = []
-    for c in candles:
-        data.append({
-            'time': c.time,
-            'open': c.open.units + c.open.nano / 1e9,
-            'close': c.close.units + c.close.nano / 1e9,
-            'high': c.high.units + c.high.nano / 1e9,
-            'low': c.low.units + c.low.nano / 1e9,
-            'volume': c.volume
+    return candles_to_dataframe(candles)
+
+# Поля свечи, извлекаемые одним вызовом на свечу
+CANDLE_TIME = operator.attrgetter('time')
+CANDLE_NUMBERS = operator.attrgetter(
+    'open.units', 'open.nano', 'close.units', 'close.nano',
+    'high.units', 'high.nano', 'low.units', 'low.nano', 'volume'
+)
+
+def decode_candles(candles, fixed_point=False):
+    """Разбор свечей Invest API в колонки NumPy без промежуточных словарей
+    
+    Цены собираются в int64 в нано-единицах (units * 1e9 + nano) - это точное
+    представление Quotation. При fixed_point=True они так и возвращаются,
+    иначе переводятся в float64 одной векторной операцией.
+    """
+    candles = list(candles)
+    n = len(candles)
+    
+    # Время свечей кратно секунде, поэтому перевод через timestamp() точен
+    seconds = np.fromiter(
+        (t.timestamp() for t in map(CANDLE_TIME, candles)), dtype=np.float64, count=n
+    )
+    numbers = np.fromiter(
+        chain.from_iterable(map(CANDLE_NUMBERS, candles)), dtype=np.int64, count=9 * n
+    ).reshape(n, 9)
+    
+    # Колонки open, close, high, low: units * 1e9 + nano
+    prices = numbers[:, 0:8:2] * NANO + numbers[:, 1:8:2]
+    if not fixed_point:
+        prices = prices / NANO
+    return {
+        'time': np.rint(seconds).astype(np.int64) * NANO,
+        'open': prices[:, 0],
+        'close': prices[:, 1],
+        'high': prices[:, 2],
+        'low': prices[:, 3],
+        'volume': numbers[:, 8]
+    }
+
+def fixed_to_decimal(value):
+    """Точное десятичное значение цены из нано-единиц"""
+    return Decimal(int(value)).scaleb(-9)
+
+def prices_to_fixed(values):
+    """Цены float в нано-единицах int64 (точно для цен с не более чем 9 знаками)"""
+    return np.rint(np.asarray(values, dtype=np.float64) * NANO).astype(np.int64)
+
+def candles_to_dataframe(candles):
+    """Сборка DataFrame из последовательности свечей"""
+    with metrics.time('dataframe_build'):
+        return columns_to_dataframe(decode_candles(candles))
+
+def columns_to_dataframe(columns):
+    """Сборка DataFrame из колонок decode_candles (время в нс UTC)"""
+    if len(columns['time']) == 0:
+        return pd.DataFrame()
+    
+    columns = dict(columns)
+    index = pd.DatetimeIndex(columns.pop('time').view('datetime64[ns]'), tz='UTC', name='time')
+    return pd.DataFrame(columns, index=index)
+
+def to_ns(value):
+    """Время (datetime или Timestamp) в наносекундах UTC"""
+    return pd.Timestamp(value).value
+
+def from_ns(value):
+    """Наносекунды UTC в datetime с часовым поясом"""
+    return pd.Timestamp(int(value), tz='UTC').to_pydatetime()
+
+# Колонки архива свечей в порядке decode_candles и их типы на диске
+ARCHIVE_COLUMNS = (
+    ('time', np.int64), ('open', np.float64), ('close', np.float64),
+    ('high', np.float64), ('low', np.float64), ('volume', np.int64)
+)
+DAY_NS = 86400 * NANO
+
+class CandleArchive:
+    """Архив свечей на диске: FIGI / интервал / день / файл на колонку
+    
+    Колонки - сырые бинарные файлы, в которые свечи дописываются в конец, а
+    читаются через mmap только дни нужного окна. Последняя свеча полученного
+    пакета может быть еще не закрыта, поэтому в архив не попадает. Свечи
+    внутри уже сохраненного дня сливаются с ним по времени, а день
+    переписывается целиком через временные файлы (см. write_day).
+    """
+    
+    def __init__(self, root, interval=TRADE_INTERVAL):
+        self.root = root
+        self.interval = interval.name.lower()
+        self.lock = threading.Lock()
+    
+    def instrument_dir(self, figi):
+        return os.path.join(self.root, figi, self.interval)
+    
+    def day_dir(self, figi, day):
+        return os.path.join(self.instrument_dir(figi), str(np.datetime64(int(day), 'D')))
+    
+    def days(self, figi):
+        """Номера дней (от эпохи), за которые в архиве есть свечи"""
+        try:
+            names = os.listdir(self.instrument_dir(figi))
+        except FileNotFoundError:
+            return []
+        return sorted(
+            int(np.datetime64(name, 'D').astype(np.int64)) for name in names if name[0].isdigit()
+        )
+    
+    def map_day(self, path):
+        """Колонки дня через mmap; недописанный после сбоя хвост отбрасывается"""
+        self.finish_rewrite(path)
+        columns = {}
+        for name, dtype in ARCHIVE_COLUMNS:
+            file = os.path.join(path, name)
+            size = os.path.getsize(file) // np.dtype(dtype).itemsize if os.path.exists(file) else 0
+            if size == 0:
+                return None
+            columns[name] = np.memmap(file, dtype=dtype, mode='r', shape=(size,))
+        n = min(len(column) for column in columns.values())
+        return {name: column[:n] for name, column in columns.items()}
+    
+    def read(self, figi, from_time=None, to_time=None):
+        """Свечи из архива за [from_time, to_time) одним DataFrame"""
+        start = NO_TIME if from_time is None else to_ns(from_time)
+        end = np.iinfo(np.int64).max if to_time is None else to_ns(to_time)
+        parts = []
+        with self.lock:
+            for day in self.days(figi):
+                if not start // DAY_NS <= day <= (end - 1) // DAY_NS:
+                    continue
+                columns = self.map_day(self.day_dir(figi, day))
+                if columns is None:
+                    continue
+                # Копируется только нужный срез дня, остальные страницы не читаются
+                lo, hi = np.searchsorted(columns['time'], [start, end])
+                parts.append({name: np.array(column[lo:hi]) for name, column in columns.items()})
+        
+        if not parts:
+            return pd.DataFrame()
+        return columns_to_dataframe({
+            name: np.concatenate([part[name] for part in parts]) for name, _ in ARCHIVE_COLUMNS
         })
     
-    df = pd.DataFrame(data)
-    if df.empty:
-        return df
+    def last_time(self, figi):
+        """Время последней свечи в архиве (нс) или None"""
+        with self.lock:
+            for day in reversed(self.days(figi)):
+                columns = self.map_day(self.day_dir(figi, day))
+                if columns is not None:
+                    return int(columns['time'][-1])
+        return None
+    
+    def append(self, figi, df):
+        """Запись закрытых свечей; свечи с совпадающим временем перезаписываются"""
+        if df.empty:
+            return
         
-    df['time'] = pd.to_datetime(df['time'])
-    df = df.set_index('time')
-    return df
+        times = df.index.as_unit('ns').asi8
+        rows = {'time': times, **{name: df[name].to_numpy() for name, _ in ARCHIVE_COLUMNS[1:]}}
+        days = times // DAY_NS
+        bounds = np.flatnonzero(np.diff(days)) + 1
+        with self.lock:
+            for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(times)]):
+                self.write_day(
+                    self.day_dir(figi, days[lo]), {name: rows[name][lo:hi] for name in rows}
+                )
+    
+    def write_day(self, path, rows):
+        """Запись свечей дня со слиянием по времени: совпадающие перезаписываются
+        
+        Свечи позже последней сохраненной дописываются в конец файлов. Время
+        пишется последним, и после сбоя недописанное отсекается по его длине.
+        Остальные записи переписывают день целиком: колонки пишутся во
+        временные файлы, затем отметка commit разрешает подменить ими
+        прежние. Сбой до отметки оставляет прежний день, после - новый.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.finish_rewrite(path)
+        time_file = os.path.join(path, 'time')
+        existing = np.fromfile(time_file, dtype=np.int64) if os.path.exists(time_file) else np.empty(0, np.int64)
+        times = np.asarray(rows['time'], dtype=np.int64)
+        
+        if len(existing) == 0 or times[0] > existing[-1]:
+            for name, dtype in ARCHIVE_COLUMNS[1:] + ARCHIVE_COLUMNS[:1]:
+                data = np.asarray(rows[name], dtype=dtype)
+                with open(os.path.join(path, name), 'ab') as f:
+                    # Хвост, недописанный до сбоя, отрезается
+                    f.truncate(len(existing) * data.itemsize)
+                    f.write(data.tobytes())
+            return
+        
+        # Слияние по времени: сохраненные свечи без совпадающих с новыми плюс новые
+        kept = ~np.isin(existing, times)
+        order = np.argsort(np.concatenate([existing[kept], times]), kind='stable')
+        for name, dtype in ARCHIVE_COLUMNS:
+            stored = np.fromfile(os.path.join(path, name), dtype=dtype)[:len(existing)]
+            data = np.concatenate([stored[kept], np.asarray(rows[name], dtype=dtype)])[order]
+            with open(os.path.join(path, name + '.tmp'), 'wb') as f:
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        open(os.path.join(path, 'commit'), 'w').close()
+        self.finish_rewrite(path)
+    
+    def finish_rewrite(self, path):
+        """Подмена колонок дня временными файлами, если перезапись дошла до отметки commit
+        
+        Повторный вызов после сбоя на середине подмены доводит ее до конца.
+        Временные файлы без отметки не читаются и затираются следующей перезаписью.
+        """
+        commit = os.path.join(path, 'commit')
+        if not os.path.exists(commit):
+            return
+        for name, _ in ARCHIVE_COLUMNS:
+            temporary = os.path.join(path, name + '.tmp')
+            if os.path.exists(temporary):
+                os.replace(temporary, os.path.join(path, name))
+        os.remove(commit)
+    
+    def covered_from(self, figi):
+        """С какого момента (нс) история инструмента уже загружена из API"""
+        try:
+            with open(os.path.join(self.instrument_dir(figi), 'covered_from')) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def set_covered_from(self, figi, value):
+        os.makedirs(self.instrument_dir(figi), exist_ok=True)
+        with open(os.path.join(self.instrument_dir(figi), 'covered_from'), 'w') as f:
+            f.write(str(int(value)))
+    
+    def load(self, client, figi, from_time, to_time):
+        """Свечи за интервал из архива с догрузкой через API только недостающих"""
+        start = to_ns(from_time)
+        covered = self.covered_from(figi)
+        last = self.last_time(figi)
+        
+        if covered is None or last is None or last < start:
+            # Архив пуст или устарел целиком - история грузится заново с начала окна
+            self.set_covered_from(figi, start)
+            last = None
+        elif start < covered:
+            # Окно стало глубже загруженного - догружается только начало
+            self.append(figi, get_candles_range(client, figi, from_time, from_ns(covered)))
+            self.set_covered_from(figi, start)
+        
+        # Последняя сохраненная свеча запрашивается повторно вместе с новыми
+        tail_from = from_time if last is None else from_ns(last)
+        tail = get_candles_range(client, figi, tail_from, to_time)
+        self.append(figi, tail.iloc[:-1])
+        
+        stored = self.read(figi, from_time, tail_from)
+        logger.info(f"Свечей {figi} из архива: {len(stored)}, из API: {len(tail)}")
+        if stored.empty:
+            return tail
+        if tail.empty:
+            return stored
+        return pd.concat([stored, tail])
+
+candle_archive = CandleArchive(CANDLE_ARCHIVE_DIR) if CANDLE_ARCHIVE_DIR else None
+
+class CandleStore:
+    """Хранилище свечей в памяти процесса с инкрементальной подгрузкой"""
+    
+    def __init__(self, figi, history_days):
+        self.figi = figi
+        self.history_days = history_days
+        self.df = pd.DataFrame()
+        self.closed_until = None  # Время открытия (нс) последней свечи, известной закрытой
+    
+    def close_until(self, time_ns):
+        """Отметка свечей по time_ns включительно как закрытых (отметка только растет)"""
+        if self.closed_until is None or time_ns > self.closed_until:
+            self.closed_until = time_ns
+    
+    @staticmethod
+    def sync_boundary():
+        """Последняя свеча, закрытая к моменту запроса (с задержкой на закрытие), нс"""
+        now = time.time() - TICK_SETTLE_DELAY
+        return int(now // TICK_INTERVAL * TICK_INTERVAL - TICK_INTERVAL) * NANO
+    
+    @property
+    def last_time(self):
+        """Время последней (возможно, еще не закрытой) свечи"""
+        if self.df.empty:
+            return None
+        return self.df.index[-1]
+    
+    def previous_time(self, time_ns):
+        """Время (нс) свечи перед свечой time_ns; None, если ее нет в хранилище"""
+        times = self.df.index.as_unit('ns').asi8 if not self.df.empty else ()
+        i = int(np.searchsorted(times, time_ns))
+        return int(times[i - 1]) if i > 0 else None
+    
+    def backfill(self, client):
+        """Первичная загрузка истории за HISTORY_DAYS"""
+        boundary = self.sync_boundary()
+        self.df = get_historical_candles(client, self.history_days, self.figi)
+        self.close_until(boundary)
+        logger.info(f"Загружено свечей в хранилище {self.figi}: {len(self.df)}")
+        return self.df
+    
+    def update(self, client):
+        """Догрузка свечей начиная с последней сохраненной"""
+        if self.df.empty:
+            return self.backfill(client)
+        
+        # Последняя свеча могла быть незакрытой - запрашиваем ее повторно
+        boundary = self.sync_boundary()
+        from_time = self.last_time.to_pydatetime()
+        new_df = get_candles_range(client, self.figi, from_time, datetime.datetime.now(datetime.timezone.utc))
+        if not new_df.empty:
+            self.merge(new_df)
+        self.close_until(boundary)
+        return self.df
+    
+    def merge(self, new_df):
+        """Слияние новых свечей с перезаписью совпадающих по времени"""
+        if candle_archive is not None:
+            # Закрыты все новые свечи, кроме последней, и прежняя последняя,
+            # если новые начинаются позже нее
+            closed = new_df.iloc[:-1]
+            if not self.df.empty and self.df.index[-1] < new_df.index[0]:
+                closed = pd.concat([self.df.iloc[-1:], closed])
+            candle_archive.append(self.figi, closed)
+        
+        kept = self.df[self.df.index < new_df.index[0]]
+        df = pd.concat([kept, new_df])
+        
+        # Окно хранения не превышает HISTORY_DAYS
+        cutoff = df.index[-1] - datetime.timedelta(days=self.history_days)
+        self.df = df[df.index >= cutoff]
+    
+    def tail(self, since=None):
+        """Время (нс) и цены закрытия свечей начиная с since включительно"""
+        if self.df.empty:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        
+        start = 0 if since is None else self.df.index.searchsorted(since)
+        times = self.df.index[start:].as_unit('ns').asi8
+        closes = self.df['close'].values[start:]
+        return times, closes
+    
+    def frame(self):
+        """Копия свечей для расчетов и графиков"""
+        return self.df.copy()
 
 def calculate_indicators(df):
     """Расчет индикаторов"""
@@ -333,237 +1392,2148 @@ def calculate_indicators(df):
     df['short_ma'] = df['close'].rolling(SHORT_MA_PERIOD).mean()
     df['long_ma'] = df['close'].rolling(LONG_MA_PERIOD).mean()
     
+    # MA сравниваются по суммам окон в целых нано-единицах: равенство MA (частое
+    # при шаге цены 0.005) не превращается в сигнал из-за ошибки округления
+    fixed = pd.Series(prices_to_fixed(df['close']), index=df.index)
+    diff = (
+        fixed.rolling(SHORT_MA_PERIOD).sum() * LONG_MA_PERIOD
+        - fixed.rolling(LONG_MA_PERIOD).sum() * SHORT_MA_PERIOD
+    )
+    
     # Определение сигналов
     df['signal'] = 0
-    df.loc[df['short_ma'] > df['long_ma'], 'signal'] = 1  # Покупка
-    df.loc[df['short_ma'] < df['long_ma'], 'signal'] = -1  # Продажа
+    df.loc[diff > 0, 'signal'] = 1  # Покупка
+    df.loc[diff < 0, 'signal'] = -1  # Продажа
     
     return df
 
-async def get_current_price():
-    """Текущая цена инструмента"""
-    try:
-        with Client(TOKEN) as client:
-            last_price = client.market_data.get_last_prices(figi=[FIGI]).last_prices[0]
-            return last_price.price.units + last_price.price.nano / 1e9
-    except Exception as e:
-        logger.error(f"Ошибка получения цены: {str(e)}")
-        return 0.0
-
-def generate_chart(df):
-    """Генерация графика с индикаторами"""
-    plt.figure(figsize=(12, 8))
+class RollingMean:
+    """Скользящее среднее на кольцевом буфере с накопленной суммой - O(1) на свечу
     
-    # График цены
-    plt.subplot(2, 1, 1)
-    plt.plot(df.index, df['close'], label='Цена ВТБ', color='blue')
+    Для целых значений (цены в нано-единицах) сумма окна точная.
+    """
+    __slots__ = ('period', 'buffer', 'pos', 'count', 'total')
     
-    # Добавляем индикаторы только если они есть в данных
-    if 'short_ma' in df.columns:
-        plt.plot(df.index, df['short_ma'], label=f'MA {SHORT_MA_PERIOD}', color='orange', linestyle='--')
+    def __init__(self, period):
+        self.period = period
+        self.buffer = [0] * period
+        self.pos = 0  # Индекс следующей записи
+        self.count = 0
+        self.total = 0
     
-    if 'long_ma' in df.columns:
-        plt.plot(df.index, df['long_ma'], label=f'MA {LONG_MA_PERIOD}', color='green', linestyle='-.')
+    def push(self, value):
+        """Добавление значения новой свечи"""
+        self.total += value - self.buffer[self.pos]
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.period
+        if self.count < self.period:
+            self.count += 1
+        # Раз в полный оборот пересчитываем сумму, чтобы не копилась ошибка округления
+        if self.pos == 0:
+            self.total = sum(self.buffer)
     
-    # Пометки сигналов (если есть данные)
-    if 'signal' in df.columns:
-        buy_signals = df[df['signal'] == 1]
-        sell_signals = df[df['signal'] == -1]
-        
-        if not buy_signals.empty:
-            plt.scatter(buy_signals.index, buy_signals['close'], marker='^', color='g', s=100, label='Сигнал покупки')
-        if not sell_signals.empty:
-            plt.scatter(sell_signals.index, sell_signals['close'], marker='v', color='r', s=100, label='Сигнал продажи')
+    def amend(self, value):
+        """Замена значения последней (незакрытой) свечи"""
+        last = (self.pos - 1) % self.period
+        self.total += value - self.buffer[last]
+        self.buffer[last] = value
     
-    plt.title('График ВТБ с торговыми сигналами')
-    plt.ylabel('Цена (RUB)')
-    plt.legend()
-    plt.grid(True)
+    @property
+    def ready(self):
+        return self.count >= self.period
     
-    # Форматирование даты
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    plt.gca().xaxis.set_major_locator(mdates.HourLocator(interval=1))
+    @property
+    def value(self):
+        if self.count < self.period:
+            return None
+        return self.total / self.period
+
+class CrossoverEngine:
+    """Инкрементальный расчет MA и сигнала пересечения по мере прихода свечей
     
-    # График объема
-    plt.subplot(2, 1, 2)
-    plt.bar(df.index, df['volume'], color='blue', alpha=0.3)
-    plt.title('Объем торгов')
-    plt.ylabel('Объем')
-    plt.grid(True)
+    Окна хранят цены в нано-единицах, а MA сравниваются по целым суммам окон -
+    как в calculate_indicators, поэтому равные MA дают сигнал 0.
+    """
+    __slots__ = ('short', 'long', 'last_time', 'short_ma', 'long_ma', 'signal')
     
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    plt.gca().xaxis.set_major_locator(mdates.HourLocator(interval=1))
+    def __init__(self, short_period=SHORT_MA_PERIOD, long_period=LONG_MA_PERIOD):
+        self.short = RollingMean(short_period)
+        self.long = RollingMean(long_period)
+        self.last_time = None
+        self.short_ma = None
+        self.long_ma = None
+        self.signal = 0
     
-    plt.tight_layout()
-    return plt
+    def update(self, time, close):
+        """Учет свечи: новая добавляется, повтор последней - перезаписывается"""
+        fixed = round(close * NANO)
+        if self.last_time is not None and time == self.last_time:
+            self.short.amend(fixed)
+            self.long.amend(fixed)
+        else:
+            self.short.push(fixed)
+            self.long.push(fixed)
+            self.last_time = time
+        
+        short, long = self.short, self.long
+        self.short_ma = short.total / short.period / NANO if short.ready else None
+        self.long_ma = long.total / long.period / NANO if long.ready else None
+        if not short.ready or not long.ready:
+            self.signal = 0
+        else:
+            diff = short.total * long.period - long.total * short.period
+            self.signal = (diff > 0) - (diff < 0)  # 1 - покупка, -1 - продажа
+        return self.signal
 
-def analyze_signals():
-    """Анализ сигналов для принятия решения"""
-    global signals_history
+class SignalMatrix:
+    """Векторный расчет MA-сигналов сразу по всем инструментам: строка матрицы - инструмент
     
-    if len(signals_history) < SIGNAL_CONFIRMATION:
-        return None
-    
-    # Анализ последних сигналов
-    last_signals = signals_history[-SIGNAL_CONFIRMATION:]
+    Цены хранятся в нано-единицах, а суммы окон целые и точные - сигналы
+    совпадают с CrossoverEngine и calculate_indicators и при равных MA.
+    """
     
-    # Проверка на устойчивый сигнал покупки
-    if all(s == 1 for s in last_signals):
-        return "BUY"
+    def __init__(self, rows, short_period=SHORT_MA_PERIOD, long_period=LONG_MA_PERIOD):
+        self.short_period = short_period
+        self.long_period = long_period
+        self.closes = np.zeros((rows, long_period), dtype=np.int64)  # Кольцевые буферы цен закрытия
+        self.pos = np.full(rows, long_period - 1)  # Индекс последней записи в буфере
+        self.count = np.zeros(rows, dtype=np.int64)
+        self.last_time = np.full(rows, NO_TIME, dtype=np.int64)
+        self.short_sum = np.zeros(rows, dtype=np.int64)
+        self.long_sum = np.zeros(rows, dtype=np.int64)
     
-    # Проверка на устойчивый сигнал продажи
-    if all(s == -1 for s in last_signals):
-        return "SELL"
+    def update(self, rows, times, closes):
+        """Учет по одной свече на строку: новая добавляется, повтор последней - перезаписывается"""
+        keep = times >= self.last_time[rows]
+        rows, times, closes = rows[keep], times[keep], prices_to_fixed(closes[keep])
+        is_new = times > self.last_time[rows]
+        
+        # Новые свечи: сдвигаем позицию и убираем выпадающие из окон значения
+        new_rows = rows[is_new]
+        pos = (self.pos[new_rows] + 1) % self.long_period
+        self.long_sum[new_rows] -= self.closes[new_rows, pos]
+        self.short_sum[new_rows] -= self.closes[new_rows, (pos - self.short_period) % self.long_period]
+        self.pos[new_rows] = pos
+        self.count[new_rows] = np.minimum(self.count[new_rows] + 1, self.long_period)
+        self.last_time[new_rows] = times[is_new]
+        
+        # Незакрытые свечи: убираем прежнее значение последней записи
+        amended_rows = rows[~is_new]
+        previous = self.closes[amended_rows, self.pos[amended_rows]]
+        self.long_sum[amended_rows] -= previous
+        self.short_sum[amended_rows] -= previous
+        
+        self.closes[rows, self.pos[rows]] = closes
+        self.long_sum[rows] += closes
+        self.short_sum[rows] += closes
     
-    return None
+    def signals(self):
+        """Сигналы пересечения (1/-1/0) и маска строк с заполненным длинным окном"""
+        ready = self.count >= self.long_period
+        diff = self.short_sum * self.long_period - self.long_sum * self.short_period
+        signals = np.sign(diff)
+        signals[~ready] = 0
+        return signals, ready
+
+# ================== Indicator Library ================== #
+RECURRENCE_BLOCK = 64  # Размер блока векторного расчета рекуррентных индикаторов
+
+def frame_columns(df):
+    """Колонки свечей DataFrame в массивах NumPy (время в нс)"""
+    columns = {name: df[name].to_numpy(dtype=np.float64) for name in ('open', 'high', 'low', 'close', 'volume')}
+    columns['time'] = df.index.as_unit('ns').asi8
+    return columns
+
+def linear_recurrence(u, d, y0):
+    """y[t] = d * y[t-1] + u[t] при y[-1] = y0 без цикла по свечам
+    
+    Внутри блока решение - произведение на нижнетреугольную матрицу степеней d,
+    состояние на входе блоков - та же рекуррентность по концам блоков (рекурсивно).
+    Все веса не больше 1, поэтому ошибка округления не накапливается.
+    """
+    n = len(u)
+    if n == 0:
+        return np.empty(0)
+    b = RECURRENCE_BLOCK
+    m = -(-n // b)
+    padded = np.zeros(m * b)
+    padded[:n] = u
+    
+    powers = d ** np.arange(b + 1, dtype=np.float64)
+    lags = np.subtract.outer(np.arange(b), np.arange(b))
+    weights = np.where(lags >= 0, powers[lags.clip(0)], 0.0)
+    local = padded.reshape(m, b) @ weights.T
+    
+    carry = np.empty(m)
+    carry[0] = y0
+    if m > 1:
+        carry[1:] = linear_recurrence(local[:-1, -1], powers[b], y0)
+    return (local + carry[:, None] * powers[1:]).ravel()[:n]
+
+def ewm_kernel(x, alpha, min_periods=0):
+    """Экспоненциальное среднее как pandas ewm(alpha, adjust=False)"""
+    if len(x) == 0:
+        return np.empty(0)
+    result = linear_recurrence(alpha * x, 1 - alpha, x[0])
+    result[:max(min_periods - 1, 0)] = np.nan
+    return result
+
+def window_sum(x, period):
+    """Сумма по скользящему окну; NaN до заполнения окна
+    
+    Считается через префиксные и суффиксные суммы блоков длины period, поэтому
+    величины не растут с длиной ряда, как у общей накопленной суммы.
+    """
+    n = len(x)
+    result = np.full(n, np.nan)
+    if n < period:
+        return result
+    m = -(-n // period)
+    padded = np.zeros(m * period)
+    padded[:n] = x
+    blocks = padded.reshape(m, period)
+    prefix = np.cumsum(blocks, axis=1).ravel()
+    suffix = np.cumsum(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    
+    end = np.arange(period - 1, n)
+    start = end - period + 1
+    aligned = start % period == 0  # Окно совпадает с блоком
+    result[period - 1:] = np.where(aligned, prefix[end], suffix[start] + prefix[end])
+    return result
+
+def sma_kernel(c, period=20):
+    return {'sma': window_sum(c['close'], period) / period}
+
+def ema_kernel(c, period=20):
+    return {'ema': ewm_kernel(c['close'], 2 / (period + 1))}
+
+def rsi_kernel(c, period=14):
+    close = c['close']
+    result = np.full(len(close), np.nan)
+    if len(close) < 2:
+        return {'rsi': result}
+    delta = np.diff(close)
+    gain = ewm_kernel(np.clip(delta, 0, None), 1 / period, period)
+    loss = ewm_kernel(np.clip(-delta, 0, None), 1 / period, period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[1:] = 100 - 100 / (1 + gain / loss)
+    return {'rsi': result}
+
+def macd_kernel(c, fast=12, slow=26, signal=9):
+    close = c['close']
+    macd = ewm_kernel(close, 2 / (fast + 1)) - ewm_kernel(close, 2 / (slow + 1))
+    signal_line = ewm_kernel(macd, 2 / (signal + 1))
+    return {'macd': macd, 'signal': signal_line, 'hist': macd - signal_line}
+
+def bollinger_kernel(c, period=20, width=2.0):
+    close = c['close']
+    if len(close) == 0:
+        return {'middle': np.empty(0), 'upper': np.empty(0), 'lower': np.empty(0)}
+    # Сдвиг к первой цене уменьшает потерю точности в E[x^2] - E[x]^2
+    shifted = close - close[0]
+    mean = window_sum(shifted, period) / period
+    variance = np.maximum(window_sum(shifted * shifted, period) / period - mean * mean, 0.0)
+    middle = mean + close[0]
+    std = np.sqrt(variance)
+    return {'middle': middle, 'upper': middle + width * std, 'lower': middle - width * std}
+
+def vwap_kernel(c):
+    """VWAP с начала торгового дня (UTC)"""
+    typical = (c['high'] + c['low'] + c['close']) / 3
+    volume = c['volume']
+    day = c['time'] // DAY_NS
+    if len(day) == 0:
+        return {'vwap': np.empty(0)}
+    starts = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    
+    # Накопленные суммы сбрасываются в начале каждого дня
+    value = np.cumsum(typical * volume)
+    total = np.cumsum(volume)
+    segment = np.repeat(starts, np.diff(np.r_[starts, len(day)]))
+    value_before = np.where(segment > 0, value[segment - 1], 0.0)
+    total_before = np.where(segment > 0, total[segment - 1], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'vwap': (value - value_before) / (total - total_before)}
+
+def atr_kernel(c, period=14):
+    high, low, close = c['high'], c['low'], c['close']
+    true_range = high - low
+    if len(close) > 1:
+        previous = close[:-1]
+        true_range[1:] = np.maximum.reduce([
+            true_range[1:], np.abs(high[1:] - previous), np.abs(low[1:] - previous)
+        ])
+    return {'atr': ewm_kernel(true_range, 1 / period, period)}
+
+# Эталонные расчеты на pandas - для сверки и замеров
+def sma_reference(df, period=20):
+    return pd.DataFrame({'sma': df['close'].rolling(period).mean()})
+
+def ema_reference(df, period=20):
+    return pd.DataFrame({'ema': df['close'].ewm(span=period, adjust=False).mean()})
+
+def rsi_reference(df, period=14):
+    delta = df['close'].diff()
+    gain = delta.clip(lower=0).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    return pd.DataFrame({'rsi': 100 - 100 / (1 + gain / loss)})
+
+def macd_reference(df, fast=12, slow=26, signal=9):
+    close = df['close']
+    macd = close.ewm(span=fast, adjust=False).mean() - close.ewm(span=slow, adjust=False).mean()
+    signal_line = macd.ewm(span=signal, adjust=False).mean()
+    return pd.DataFrame({'macd': macd, 'signal': signal_line, 'hist': macd - signal_line})
+
+def bollinger_reference(df, period=20, width=2.0):
+    rolling = df['close'].rolling(period)
+    middle = rolling.mean()
+    std = rolling.std(ddof=0)
+    return pd.DataFrame({'middle': middle, 'upper': middle + width * std, 'lower': middle - width * std})
+
+def vwap_reference(df):
+    typical = (df['high'] + df['low'] + df['close']) / 3
+    day = df.index.normalize()
+    value = (typical * df['volume']).groupby(day).cumsum()
+    return pd.DataFrame({'vwap': value / df['volume'].groupby(day).cumsum()})
+
+def atr_reference(df, period=14):
+    previous = df['close'].shift()
+    true_range = pd.concat([
+        df['high'] - df['low'], (df['high'] - previous).abs(), (df['low'] - previous).abs()
+    ], axis=1).max(axis=1)
+    return pd.DataFrame({'atr': true_range.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()})
+
+class StreamingIndicator:
+    """Инкрементальная форма индикатора: O(1) на свечу
+    
+    Повтор времени последней свечи откатывает состояние к снимку перед ней и
+    пересчитывает ее с новыми данными - так обновляется незакрытая свеча.
+    """
+    
+    def __init__(self):
+        self.last_time = None
+        self.saved = None
+        self.value = None
+    
+    def update(self, time, high, low, close, volume):
+        if self.last_time is not None and time == self.last_time:
+            self.restore(self.saved)
+        else:
+            self.saved = self.snapshot()
+            self.last_time = time
+        self.value = self.step(time, high, low, close, volume)
+        return self.value
+
+class EwmState:
+    """Экспоненциальное среднее для инкрементальных индикаторов"""
+    __slots__ = ('alpha', 'min_periods', 'value', 'count')
+    
+    def __init__(self, alpha, min_periods=0):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.value = None
+        self.count = 0
+    
+    def push(self, x):
+        self.value = x if self.value is None else self.value + self.alpha * (x - self.value)
+        self.count += 1
+        return self.value if self.count >= self.min_periods else None
+    
+    def snapshot(self):
+        return self.value, self.count
+    
+    def restore(self, saved):
+        self.value, self.count = saved
+
+class SmaStream(StreamingIndicator):
+    def __init__(self, period=20):
+        super().__init__()
+        self.mean = RollingMean(period)
+    
+    def update(self, time, high, low, close, volume):
+        if self.last_time is not None and time == self.last_time:
+            self.mean.amend(close)
+        else:
+            self.mean.push(close)
+            self.last_time = time
+        self.value = {'sma': self.mean.value}
+        return self.value
+
+class EmaStream(StreamingIndicator):
+    def __init__(self, period=20):
+        super().__init__()
+        self.ema = EwmState(2 / (period + 1))
+    
+    def snapshot(self):
+        return self.ema.snapshot()
+    
+    def restore(self, saved):
+        self.ema.restore(saved)
+    
+    def step(self, time, high, low, close, volume):
+        return {'ema': self.ema.push(close)}
+
+class RsiStream(StreamingIndicator):
+    def __init__(self, period=14):
+        super().__init__()
+        self.gain = EwmState(1 / period, period)
+        self.loss = EwmState(1 / period, period)
+        self.previous = None
+    
+    def snapshot(self):
+        return self.gain.snapshot(), self.loss.snapshot(), self.previous
+    
+    def restore(self, saved):
+        gain, loss, self.previous = saved
+        self.gain.restore(gain)
+        self.loss.restore(loss)
+    
+    def step(self, time, high, low, close, volume):
+        previous, self.previous = self.previous, close
+        if previous is None:
+            return {'rsi': None}
+        delta = close - previous
+        gain = self.gain.push(max(delta, 0.0))
+        loss = self.loss.push(max(-delta, 0.0))
+        if gain is None:
+            return {'rsi': None}
+        if loss == 0:
+            return {'rsi': 100.0 if gain > 0 else None}
+        return {'rsi': 100 - 100 / (1 + gain / loss)}
+
+class MacdStream(StreamingIndicator):
+    def __init__(self, fast=12, slow=26, signal=9):
+        super().__init__()
+        self.fast = EwmState(2 / (fast + 1))
+        self.slow = EwmState(2 / (slow + 1))
+        self.signal = EwmState(2 / (signal + 1))
+    
+    def snapshot(self):
+        return self.fast.snapshot(), self.slow.snapshot(), self.signal.snapshot()
+    
+    def restore(self, saved):
+        for ewm, state in zip((self.fast, self.slow, self.signal), saved):
+            ewm.restore(state)
+    
+    def step(self, time, high, low, close, volume):
+        macd = self.fast.push(close) - self.slow.push(close)
+        signal = self.signal.push(macd)
+        return {'macd': macd, 'signal': signal, 'hist': macd - signal}
+
+class BollingerStream(StreamingIndicator):
+    def __init__(self, period=20, width=2.0):
+        super().__init__()
+        self.width = width
+        self.base = None  # Сдвиг к первой цене, как в векторном расчете
+        self.mean = RollingMean(period)
+        self.square = RollingMean(period)
+    
+    def update(self, time, high, low, close, volume):
+        if self.base is None:
+            self.base = close
+        x = close - self.base
+        if self.last_time is not None and time == self.last_time:
+            self.mean.amend(x)
+            self.square.amend(x * x)
+        else:
+            self.mean.push(x)
+            self.square.push(x * x)
+            self.last_time = time
+        
+        mean = self.mean.value
+        if mean is None:
+            self.value = {'middle': None, 'upper': None, 'lower': None}
+            return self.value
+        std = max(self.square.value - mean * mean, 0.0) ** 0.5
+        middle = mean + self.base
+        self.value = {'middle': middle, 'upper': middle + self.width * std, 'lower': middle - self.width * std}
+        return self.value
+
+class VwapStream(StreamingIndicator):
+    def __init__(self):
+        super().__init__()
+        self.day = None
+        self.value_sum = 0.0
+        self.volume_sum = 0.0
+    
+    def snapshot(self):
+        return self.day, self.value_sum, self.volume_sum
+    
+    def restore(self, saved):
+        self.day, self.value_sum, self.volume_sum = saved
+    
+    def step(self, time, high, low, close, volume):
+        day = time // DAY_NS
+        if day != self.day:
+            self.day, self.value_sum, self.volume_sum = day, 0.0, 0.0
+        self.value_sum += (high + low + close) / 3 * volume
+        self.volume_sum += volume
+        return {'vwap': self.value_sum / self.volume_sum if self.volume_sum else None}
+
+class AtrStream(StreamingIndicator):
+    def __init__(self, period=14):
+        super().__init__()
+        self.atr = EwmState(1 / period, period)
+        self.previous = None
+    
+    def snapshot(self):
+        return self.atr.snapshot(), self.previous
+    
+    def restore(self, saved):
+        atr, self.previous = saved
+        self.atr.restore(atr)
+    
+    def step(self, time, high, low, close, volume):
+        true_range = high - low
+        if self.previous is not None:
+            true_range = max(true_range, abs(high - self.previous), abs(low - self.previous))
+        self.previous = close
+        return {'atr': self.atr.push(true_range)}
+
+class Indicator:
+    """Описание индикатора в реестре: векторный расчет, инкрементальный и эталон на pandas"""
+    __slots__ = ('name', 'kernel', 'stream', 'reference', 'columns')
+    
+    def __init__(self, name, kernel, stream, reference, columns):
+        self.name = name
+        self.kernel = kernel
+        self.stream = stream
+        self.reference = reference
+        self.columns = columns
+
+INDICATORS = {}
+
+def register_indicator(name, kernel, stream, reference, columns):
+    """Добавление индикатора в реестр"""
+    INDICATORS[name] = Indicator(name, kernel, stream, reference, columns)
+
+register_indicator('sma', sma_kernel, SmaStream, sma_reference, ('sma',))
+register_indicator('ema', ema_kernel, EmaStream, ema_reference, ('ema',))
+register_indicator('rsi', rsi_kernel, RsiStream, rsi_reference, ('rsi',))
+register_indicator('macd', macd_kernel, MacdStream, macd_reference, ('macd', 'signal', 'hist'))
+register_indicator('bollinger', bollinger_kernel, BollingerStream, bollinger_reference, ('middle', 'upper', 'lower'))
+register_indicator('vwap', vwap_kernel, VwapStream, vwap_reference, ('vwap',))
+register_indicator('atr', atr_kernel, AtrStream, atr_reference, ('atr',))
+
+def compute_indicator(name, df, **params):
+    """Векторный расчет индикатора по DataFrame свечей"""
+    columns = INDICATORS[name].kernel(frame_columns(df), **params)
+    return pd.DataFrame(columns, index=df.index)
+
+def stream_indicator(name, df, **params):
+    """Прогон свечей через инкрементальную форму; значения по каждой свече"""
+    stream = INDICATORS[name].stream(**params)
+    c = frame_columns(df)
+    rows = [
+        stream.update(*bar)
+        for bar in zip(c['time'].tolist(), c['high'].tolist(), c['low'].tolist(), c['close'].tolist(), c['volume'].tolist())
+    ]
+    return pd.DataFrame(
+        [{k: np.nan if v is None else v for k, v in row.items()} for row in rows], index=df.index
+    )
+
+def verify_indicators(df, names=None, rtol=1e-7, atol=1e-9):
+    """Сверка векторных и инкрементальных форм с pandas; возвращает имена с расхождениями"""
+    failed = []
+    for name in names or INDICATORS:
+        reference = INDICATORS[name].reference(df)
+        results = (compute_indicator(name, df), stream_indicator(name, df))
+        matches = (
+            np.allclose(result[column].to_numpy(dtype=np.float64), reference[column].to_numpy(dtype=np.float64),
+                        rtol=rtol, atol=atol, equal_nan=True)
+            for result in results for column in reference.columns
+        )
+        if not all(matches):
+            failed.append(name)
+    return failed
+
+class SignalRule:
+    """Условие на индикатор для решения: колонка, оператор, число или другая колонка"""
+    OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+    
+    def __init__(self, indicator, params, column, op, threshold, side=None, timeframe=None):
+        if timeframe is not None and timeframe not in TIMEFRAMES:
+            raise ValueError(f"Таймфрейм правила не задан в TIMEFRAMES: {timeframe}")
+        self.indicator = indicator
+        self.params = dict(params)
+        self.key = (indicator, tuple(sorted(self.params.items())))
+        self.column = column
+        self.compare = self.OPERATORS[op]
+        self.threshold = threshold
+        self.side = side  # 'BUY', 'SELL' или None - для обоих решений
+        self.timeframe = timeframe  # Название из TIMEFRAMES или None - минутные свечи
+    
+    def check(self, values):
+        """Выполнено ли условие; без готовых значений индикатора - нет"""
+        value = values.get(self.column)
+        threshold = values.get(self.threshold) if isinstance(self.threshold, str) else self.threshold
+        if value is None or threshold is None:
+            return False
+        return self.compare(value, threshold)
+
+class IndicatorSet:
+    """Инкрементальные индикаторы инструмента, нужные правилам сигналов"""
+    
+    def __init__(self, rules):
+        self.rules = rules
+        self.streams = {}
+        for rule in rules:
+            if rule.key not in self.streams:
+                self.streams[rule.key] = INDICATORS[rule.indicator].stream(**rule.params)
+        self.last_time = None
+    
+    def feed(self, df, closed_until):
+        """Учет закрытых свечей с последней учтенной
+        
+        closed_until - время открытия (нс) последней закрытой свечи хранилища
+        (CandleStore.closed_until), более поздние не учитываются.
+        """
+        if not self.streams or df.empty or closed_until is None:
+            return
+        if self.last_time is not None and closed_until <= self.last_time:
+            return
+        times = df.index.as_unit('ns').asi8
+        start = 0 if self.last_time is None else int(np.searchsorted(times, self.last_time))
+        end = closed_end(times, closed_until)
+        if start >= end:
+            return
+        
+        bars = zip(
+            times[start:end].tolist(), df['high'].values[start:end].tolist(), df['low'].values[start:end].tolist(),
+            df['close'].values[start:end].tolist(), df['volume'].values[start:end].tolist()
+        )
+        for bar in bars:
+            for stream in self.streams.values():
+                stream.update(*bar)
+        self.last_time = times[end - 1]
+    
+    def allows(self, decision):
+        """Все правила для этого решения выполнены"""
+        for rule in self.rules:
+            if rule.side is not None and rule.side != decision:
+                continue
+            stream = self.streams[rule.key]
+            if stream.value is None or not rule.check(stream.value):
+                return False
+        return True
+
+signal_rules = [SignalRule(*rule) for rule in SIGNAL_RULES]
+minute_rules = [rule for rule in signal_rules if rule.timeframe is None]
+
+def closed_end(times, closed_until):
+    """Число закрытых свечей в начале times (нс) по отметке CandleStore.closed_until"""
+    if closed_until is None:
+        return 0
+    return int(np.searchsorted(times, closed_until, side='right'))
+
+# ================== Timeframes ================== #
+MINUTE_NS = 60 * NANO
+BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+def aggregate_candles(times, columns, minutes):
+    """Свечи старшего таймфрейма из минутных без цикла по свечам
+    
+    times - время открытия минутных свечей (нс, по возрастанию), columns - массивы
+    open, high, low, close, volume. Свеча таймфрейма начинается на границе,
+    кратной minutes от полуночи UTC; интервалы без минутных свечей пропускаются.
+    """
+    buckets = times - times % (minutes * MINUTE_NS)
+    if len(times) == 0:
+        return buckets, {name: np.empty(0) for name in BAR_COLUMNS}
+    
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    return buckets[starts], {
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+        'volume': np.add.reduceat(columns['volume'], starts)
+    }
+
+def aggregate_frame(df, minutes):
+    """DataFrame минутных свечей в DataFrame свечей таймфрейма"""
+    times, bars = aggregate_candles(df.index.as_unit('ns').asi8, frame_columns(df), minutes)
+    return pd.DataFrame(bars, index=pd.DatetimeIndex(times, tz='UTC', name=df.index.name))
+
+class TimeframeBars:
+    """Старший таймфрейм инструмента: текущая свеча из закрытых минутных и индикаторы по ней
+    
+    Каждая закрытая минутная свеча дополняет текущую свечу таймфрейма, а MA и
+    индикаторы правил пересчитывают ее как незакрытую (повтор времени заменяет
+    последнее значение) - O(1) на минуту. История при первом учете
+    агрегируется векторно.
+    """
+    
+    def __init__(self, name, minutes, rules=()):
+        self.name = name
+        self.minutes = minutes
+        self.step = minutes * MINUTE_NS
+        self.bar = None  # [время открытия (нс), open, high, low, close, volume]
+        self.last_time = None  # Последняя учтенная минутная свеча (нс)
+        self.crossover = CrossoverEngine()
+        self.indicators = IndicatorSet(rules)
+    
+    @property
+    def signal(self):
+        """MA-сигнал таймфрейма с учетом текущей свечи: 1, -1 или 0"""
+        return self.crossover.signal
+    
+    def pending(self, times):
+        """Индекс первой еще не учтенной минутной свечи в times"""
+        if self.last_time is None:
+            return 0
+        return int(np.searchsorted(times, self.last_time, side='right'))
+    
+    def feed(self, times, columns):
+        """Учет закрытых минутных свечей (время в нс и колонки BAR_COLUMNS) после последней учтенной"""
+        start = self.pending(times)
+        if start >= len(times):
+            return
+        if start == len(times) - 1:
+            self.push(int(times[start]), *(float(columns[name][start]) for name in BAR_COLUMNS))
+        else:
+            self.extend(times[start:], {name: columns[name][start:] for name in BAR_COLUMNS})
+    
+    def push(self, time, open_, high, low, close, volume):
+        """Учет одной закрытой минутной свечи"""
+        start = time - time % self.step
+        bar = self.bar
+        if bar is None or start > bar[0]:
+            self.bar = bar = [start, open_, high, low, close, volume]
+        else:
+            bar[2] = max(bar[2], high)
+            bar[3] = min(bar[3], low)
+            bar[4] = close
+            bar[5] += volume
+        self.last_time = time
+        self.emit(bar)
+    
+    def extend(self, times, columns):
+        """Учет пачки закрытых минутных свечей: агрегация векторная, индикаторы - по свечам таймфрейма"""
+        starts, bars = aggregate_candles(times, columns, self.minutes)
+        rows = zip(starts.tolist(), *(bars[name].tolist() for name in BAR_COLUMNS))
+        for start, open_, high, low, close, volume in rows:
+            bar = self.bar
+            if bar is not None and start == bar[0]:
+                # Продолжение текущей свечи таймфрейма
+                bar[2] = max(bar[2], high)
+                bar[3] = min(bar[3], low)
+                bar[4] = close
+                bar[5] += volume
+            else:
+                self.bar = bar = [start, open_, high, low, close, volume]
+            self.emit(bar)
+        self.last_time = int(times[-1])
+    
+    def emit(self, bar):
+        """Пересчет MA и индикаторов правил по текущей свече"""
+        time, _, high, low, close, volume = bar
+        self.crossover.update(time, close)
+        for stream in self.indicators.streams.values():
+            stream.update(time, high, low, close, volume)
+
+def verify_timeframes(df, timeframes=None):
+    """Сверка агрегации с resample pandas и поминутного учета с векторным; имена с расхождениями"""
+    failed = []
+    for name, minutes in (timeframes or TIMEFRAMES).items():
+        reference = df[list(BAR_COLUMNS)].resample(f'{minutes}min').agg(
+            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+        ).dropna(subset=['open'])
+        result = aggregate_frame(df, minutes)
+        
+        # Поминутно (как в живом режиме) и одной пачкой (как при загрузке истории)
+        times = df.index.as_unit('ns').asi8
+        columns = frame_columns(df)
+        live, batch = TimeframeBars(name, minutes), TimeframeBars(name, minutes)
+        for end in range(1, len(times) + 1):
+            live.feed(times[:end], columns)
+        batch.feed(times, columns)
+        
+        same = (
+            result.index.equals(reference.index)
+            and all(np.allclose(result[column].values, reference[column].values) for column in BAR_COLUMNS)
+            and live.signal == batch.signal
+            and np.allclose(live.bar[1:], batch.bar[1:])
+            and (live.crossover.long_ma is None) == (batch.crossover.long_ma is None)
+            and (live.crossover.long_ma is None or np.isclose(live.crossover.long_ma, batch.crossover.long_ma))
+        )
+        if not same:
+            failed.append(name)
+    return failed
+
+class MarketSnapshot:
+    """Данные инструмента на момент тика, общие для основного цикла и обработчиков
+    
+    Цикл публикует новый снимок раз в тик и больше его не меняет, поэтому
+    /status и /chart читают его без запросов к бирже. Индикаторы для графика
+    считаются при первом обращении и сохраняются в снимке: уведомление о
+    сигнале и /chart показывают один и тот же расчет.
+    """
+    __slots__ = ('time', 'candles', 'last_price', 'last_price_time', 'signal', 'decision', 'timeframes', '_indicators')
+    
+    def __init__(self, time_, candles, last_price=None, last_price_time=None, signal=None, decision=None,
+                 timeframes=None):
+        self.time = time_
+        self.candles = candles  # Закрытые свечи; DataFrame не изменяется
+        self.last_price = last_price
+        self.last_price_time = last_price_time
+        self.signal = signal  # Последний рассчитанный сигнал: 1, -1, 0 или None
+        self.decision = decision  # Решение analyze_signals на этом тике
+        self.timeframes = timeframes or {}  # Название таймфрейма -> его MA-сигнал
+        self._indicators = None
+    
+    @property
+    def price(self):
+        """Последняя цена, а без нее - закрытие последней свечи"""
+        if self.last_price is not None:
+            return self.last_price
+        if self.candles.empty:
+            return None
+        return float(self.candles['close'].iloc[-1])
+    
+    def indicators(self):
+        """Свечи с MA и сигналами для графика (расчет один раз на снимок)"""
+        if self._indicators is None:
+            with metrics.time('calculate_indicators'):
+                self._indicators = calculate_indicators(self.candles.copy())
+        return self._indicators
+
+class InstrumentState:
+    """Состояние одного инструмента: свечи, позиция, история сигналов, последняя цена"""
+    
+    def __init__(self, figi, name):
+        self.figi = figi
+        self.name = name
+        self.candles = CandleStore(figi, HISTORY_DAYS)
+        self.position = 0  # 0 - нет позиции, 1 - куплено
+        self.entry_price = 0.0
+        self.entry_time = None
+        self.signals_history = deque(maxlen=max(SIGNAL_HISTORY_SIZE, SIGNAL_CONFIRMATION))
+        self.signals_time = None  # Время (нс) последней свечи, сигнал которой учтен в истории
+        self.history_restored = False  # История из журнала, продолжение еще не проверено
+        self.indicators = IndicatorSet(minute_rules)
+        self.timeframes = {
+            name: TimeframeBars(name, minutes, [rule for rule in signal_rules if rule.timeframe == name])
+            for name, minutes in TIMEFRAMES.items()
+        }
+        self.last_price = None
+        self.last_price_time = None
+        self.order_book = OrderBook(figi) if ORDER_BOOK_ENABLED else None
+        self.trade_flow = TradeFlow() if ORDER_BOOK_ENABLED else None
+        self.snapshot = None  # MarketSnapshot последнего тика
+        self.lock = asyncio.Lock()  # Изменения позиции из обработчиков кнопок
+    
+    def publish(self, signal=None, decision=None):
+        """Новый снимок тика из закрытых свечей и текущей цены"""
+        df = self.candles.df
+        if not df.empty:
+            df = df.iloc[:closed_end(df.index.as_unit('ns').asi8, self.candles.closed_until)]
+        if signal is None and self.snapshot is not None:
+            signal = self.snapshot.signal
+        self.snapshot = MarketSnapshot(
+            datetime.datetime.now(datetime.timezone.utc), df,
+            self.last_price, self.last_price_time, signal, decision,
+            {name: timeframe.signal for name, timeframe in self.timeframes.items()}
+        )
+        return self.snapshot
+    
+    def record_signal(self, time_ns, signal):
+        """Сигнал новой закрытой свечи в историю; False, если свеча уже учтена
+        
+        После перезапуска история из журнала продолжается, только если первая
+        новая свеча идет сразу за последней учтенной. Иначе свечи, закрывшиеся
+        во время простоя, выпали бы из подтверждений, и история сбрасывается.
+        """
+        if self.signals_time is not None and time_ns <= self.signals_time:
+            return False
+        if self.history_restored:
+            self.history_restored = False
+            if self.candles.previous_time(time_ns) != self.signals_time:
+                self.signals_history.clear()
+        self.signals_history.append(signal)
+        self.signals_time = time_ns
+        return True
+    
+    def feed_timeframes(self):
+        """Учет новых закрытых минутных свечей в старших таймфреймах"""
+        df = self.candles.df
+        closed_until = self.candles.closed_until
+        if not self.timeframes or df.empty or closed_until is None:
+            return
+        if all(timeframe.last_time is not None and timeframe.last_time >= closed_until
+               for timeframe in self.timeframes.values()):
+            return
+        times = df.index.as_unit('ns').asi8
+        end = closed_end(times, closed_until)
+        start = min(timeframe.pending(times) for timeframe in self.timeframes.values())
+        if start >= end:
+            return
+        
+        # Колонки читаются один раз на инструмент и только для новых свечей
+        times = times[start:end]
+        columns = {name: np.asarray(df[name].values[start:end], dtype=np.float64) for name in BAR_COLUMNS}
+        for timeframe in self.timeframes.values():
+            timeframe.feed(times, columns)
+    
+    def open_position(self, price):
+        """Открытие позиции с записью в журнал"""
+        self.position = 1
+        self.entry_price = price
+        self.entry_time = datetime.datetime.now()
+        if state_journal is not None:
+            state_journal.record_position(self, 'buy', price)
+    
+    def close_position(self, price, action='sell'):
+        """Закрытие позиции с записью в журнал"""
+        self.position = 0
+        self.entry_price = 0.0
+        if state_journal is not None:
+            state_journal.record_position(self, action, price)
+
+class SignalScheduler:
+    """Оценка сигналов по всему списку инструментов за один тик"""
+    
+    def __init__(self, states):
+        self.states = list(states)
+        self.by_figi = {state.figi: state for state in self.states}
+        self.matrix = SignalMatrix(len(self.states))
+        self.sync_cursor = 0
+        self.polling = None  # Опрос в пуле потоков, еще не завершившийся
+    
+    def refresh_prices(self, client):
+        """Последние цены всех инструментов одним запросом"""
+        response = client.market_data.get_last_prices(figi=list(self.by_figi))
+        for last_price in response.last_prices:
+            state = self.by_figi.get(last_price.figi)
+            if state is None:
+                continue
+            state.last_price = last_price.price.units + last_price.price.nano / 1e9
+            state.last_price_time = last_price.time
+    
+    def poll(self):
+        """Блокирующий опрос тика: догрузка свечей и пакет последних цен"""
+        for state in self.next_sync_batch():
+            invest_client.call(state.candles.update)
+        invest_client.call(self.refresh_prices)
+    
+    async def poll_tick(self, timeout=API_TIMEOUT):
+        """Опрос тика в пуле потоков; опросы не идут параллельно
+        
+        По таймауту поток продолжает запросы в фоне. Пока он не завершится,
+        следующий тик ждет его, а не начинает второй опрос: догрузка свечей
+        хранилища и sync_cursor меняются только из одного потока.
+        """
+        if self.polling is not None and self.polling.done():
+            # Брошенный по таймауту опрос завершился между тиками
+            error = self.polling.exception()
+            if error is not None:
+                logger.warning(f"Ошибка опроса, прерванного по таймауту: {str(error)}")
+            self.polling = None
+        if self.polling is None:
+            self.polling = asyncio.get_running_loop().run_in_executor(io_executor, self.poll)
+        try:
+            await asyncio.wait_for(asyncio.shield(self.polling), timeout)
+        finally:
+            if self.polling.done():
+                self.polling = None
+    
+    def next_sync_batch(self):
+        """Инструменты для догрузки свечей по очереди, не более CANDLE_SYNC_BATCH за тик"""
+        batch = []
+        for _ in range(min(CANDLE_SYNC_BATCH, len(self.states))):
+            batch.append(self.states[self.sync_cursor])
+            self.sync_cursor = (self.sync_cursor + 1) % len(self.states)
+        return batch
+    
+    def evaluate(self):
+        """Передача новых закрытых свечей в матрицу и сигналы по ним
+        
+        Свеча учитывается, только если хранилище знает ее закрытой
+        (CandleStore.closed_until): догрузка отмечает закрытыми свечи до границы
+        на момент запроса, стрим - при приходе свечи следующей минуты. У
+        инструментов, не догружавшихся в этом тике, последняя свеча могла быть
+        загружена незакрытой - она ждет следующей догрузки.
+        
+        Возвращает строка -> [(время, цена закрытия, сигнал), ...] по каждой новой
+        свече с заполненным длинным окном. Инструменты, к которым за тик не
+        пришло новых закрытых свечей, в результат не попадают: сигналы копятся по
+        одному на свечу, как в бэктесте, независимо от CANDLE_SYNC_BATCH.
+        """
+        tails = []
+        for row, state in enumerate(self.states):
+            # Без новых закрытых свечей инструмент не читается
+            since = self.matrix.last_time[row]
+            closed_until = state.candles.closed_until
+            if closed_until is None or closed_until <= since:
+                continue
+            times, closes = state.candles.tail(
+                None if since == NO_TIME else pd.Timestamp(since, tz='UTC')
+            )
+            keep = np.searchsorted(times, closed_until, side='right')
+            times, closes = times[:keep], closes[:keep]
+            if since == NO_TIME:
+                # Прогрев: достаточно последних LONG_MA_PERIOD свечей, сигнал - по последней
+                times, closes = times[-LONG_MA_PERIOD:], closes[-LONG_MA_PERIOD:]
+            tails.append((row, times, closes))
+        
+        # Обычно у инструмента 1-2 свечи с прошлого тика - обновляем слоями по всем сразу
+        fresh = {}
+        depth = max((len(times) for _, times, _ in tails), default=0)
+        for k in range(depth):
+            layer = [(row, times[k], closes[k]) for row, times, closes in tails if len(times) > k]
+            rows, times, closes = (np.array(column) for column in zip(*layer))
+            is_new = times > self.matrix.last_time[rows]
+            self.matrix.update(rows, times.astype(np.int64), closes)
+            signals, ready = self.matrix.signals()
+            for row, time_, close in zip(rows[is_new].tolist(), times[is_new].tolist(), closes[is_new].tolist()):
+                if ready[row]:
+                    fresh.setdefault(row, []).append((time_, close, int(signals[row])))
+        return fresh
+
+async def get_current_price(figi=FIGI):
+    """Текущая цена инструмента"""
+    # В потоковом режиме цена уже есть в состоянии - запрос не нужен
+    state = instruments.get(figi)
+    if STREAMING_MODE and state is not None and state.last_price is not None:
+        age = (datetime.datetime.now(datetime.timezone.utc) - state.last_price_time).total_seconds()
+        if age <= STREAM_PRICE_MAX_AGE:
+            metrics.count('price_cache_hits_total')
+            return state.last_price
+    
+    try:
+        with metrics.time('get_current_price'):
+            return await run_blocking(fetch_last_price, figi)
+    except Exception as e:
+        metrics.count('price_errors_total')
+        logger.error(f"Ошибка получения цены: {str(e)}")
+        return 0.0
+
+def fetch_last_price(figi):
+    """Блокирующий запрос последней цены (выполняется в пуле потоков)"""
+    last_price = invest_client.call(
+        lambda client: client.market_data.get_last_prices(figi=[figi]).last_prices[0]
+    )
+    return last_price.price.units + last_price.price.nano / 1e9
+
+class ChartRenderer:
+    """График через объектный API matplotlib: фигура и линии создаются один раз и обновляются"""
+    
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        
+        self.fig = Figure(figsize=(12, 8))
+        FigureCanvasAgg(self.fig)
+        self.price_ax, self.volume_ax = self.fig.subplots(2, 1)
+        
+        # График цены
+        self.price_line, = self.price_ax.plot([], [], label='Цена', color='blue')
+        self.short_line, = self.price_ax.plot([], [], label=f'MA {SHORT_MA_PERIOD}', color='orange', linestyle='--')
+        self.long_line, = self.price_ax.plot([], [], label=f'MA {LONG_MA_PERIOD}', color='green', linestyle='-.')
+        self.buy_markers, = self.price_ax.plot(
+            [], [], linestyle='none', marker='^', color='g', markersize=10, label='Сигнал покупки'
+        )
+        self.sell_markers, = self.price_ax.plot(
+            [], [], linestyle='none', marker='v', color='r', markersize=10, label='Сигнал продажи'
+        )
+        self.price_ax.set_ylabel('Цена (RUB)')
+        self.price_ax.grid(True)
+        
+        # График объема
+        self.volume_bars = self.volume_ax.vlines([], [], [], color='blue', alpha=0.3, linewidth=2)
+        self.volume_ax.set_title('Объем торгов')
+        self.volume_ax.set_ylabel('Объем')
+        self.volume_ax.grid(True)
+        
+        # Форматирование даты
+        for ax in (self.price_ax, self.volume_ax):
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+            ax.xaxis.set_major_locator(mdates.HourLocator(interval=1))
+        
+        # Фиксированные поля вместо tight_layout на каждом кадре
+        self.fig.subplots_adjust(left=0.07, right=0.98, top=0.95, bottom=0.05, hspace=0.25)
+    
+    def render(self, df, name='ВТБ'):
+        """Обновление данных на графике и кодирование в PNG"""
+        x = mdates.date2num(df.index)
+        close = df['close'].values
+        
+        self.price_line.set_data(x, close)
+        self.price_line.set_label(f'Цена {name}')
+        self.price_ax.set_title(f'График {name} с торговыми сигналами')
+        
+        # Индикаторы - только если они есть в данных
+        empty = np.empty(0)
+        if 'short_ma' in df.columns and 'long_ma' in df.columns:
+            self.short_line.set_data(x, df['short_ma'].values)
+            self.long_line.set_data(x, df['long_ma'].values)
+        else:
+            self.short_line.set_data(empty, empty)
+            self.long_line.set_data(empty, empty)
+        
+        # Маркеры только в точках смены сигнала, а не на каждой свече
+        if 'signal' in df.columns:
+            signal = df['signal'].values
+            changed = np.empty(len(signal), dtype=bool)
+            changed[:1] = False
+            changed[1:] = signal[1:] != signal[:-1]
+            buy = changed & (signal == 1)
+            sell = changed & (signal == -1)
+            self.buy_markers.set_data(x[buy], close[buy])
+            self.sell_markers.set_data(x[sell], close[sell])
+        else:
+            self.buy_markers.set_data(empty, empty)
+            self.sell_markers.set_data(empty, empty)
+        
+        visible = [line for line in (
+            self.price_line, self.short_line, self.long_line, self.buy_markers, self.sell_markers
+        ) if len(line.get_xdata())]
+        self.price_ax.legend(handles=visible)
+        
+        volume = df['volume'].values
+        self.volume_bars.set_segments(np.stack([
+            np.column_stack([x, np.zeros(len(x))]),
+            np.column_stack([x, volume])
+        ], axis=1))
+        
+        for ax in (self.price_ax, self.volume_ax):
+            ax.relim()
+            ax.autoscale_view()
+        if len(x):
+            self.volume_ax.set_xlim(self.price_ax.get_xlim())
+            self.volume_ax.set_ylim(0, max(volume.max(), 1) * 1.05)
+        
+        buf = BytesIO()
+        # Слабое сжатие: кодирование PNG заметно быстрее, размер вырастает умеренно
+        self.fig.savefig(buf, format='png', dpi=100, pil_kwargs={'compress_level': 1})
+        return buf.getvalue()
+
+class PngCache:
+    """LRU-кэш готовых PNG-графиков"""
+    
+    def __init__(self, maxsize=CHART_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        png = self.items.get(key)
+        if png is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return png
+    
+    def put(self, key, png):
+        self.items[key] = png
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+chart_renderer = None  # Создается в потоке рендеринга при первом графике
+chart_cache = PngCache()
+
+def get_chart_renderer():
+    """Фигура потока рендеринга; matplotlib импортируется при первом вызове"""
+    global chart_renderer
+    if chart_renderer is None:
+        chart_renderer = ChartRenderer()
+    return chart_renderer
 
-async def send_signal_notification(signal_type, current_price, df):
-    """Отправка уведомления о сигнале"""
+def render_chart_png(df, name='ВТБ'):
+    """Построение графика в PNG (выполняется в потоке рендеринга)"""
+    renderer = get_chart_renderer()
+    with metrics.time('chart_render'):
+        return renderer.render(df, name)
+
+async def get_chart_png(state, df):
+    """PNG-график инструмента: из кэша или с построением в пуле рендеринга"""
+    # Ключ: инструмент, последняя свеча, параметры индикаторов
+    key = (
+        state.figi, df.index[-1], 'signal' in df.columns,
+        SHORT_MA_PERIOD, LONG_MA_PERIOD
+    )
+    png = chart_cache.get(key)
+    if png is None:
+        png = await run_blocking(
+            render_chart_png, df, state.name,
+            executor=render_executor, timeout=RENDER_TIMEOUT
+        )
+        chart_cache.put(key, png)
+    return png
+
+def analyze_signals(state):
+    """Анализ сигналов для принятия решения"""
+    signals_history = state.signals_history
+    
+    if len(signals_history) < SIGNAL_CONFIRMATION:
+        return None
+    
+    # Анализ последних сигналов
+    last_signals = list(islice(reversed(signals_history), SIGNAL_CONFIRMATION))
+    
+    # Проверка на устойчивый сигнал покупки или продажи
+    if all(s == 1 for s in last_signals):
+        decision = "BUY"
+    elif all(s == -1 for s in last_signals):
+        decision = "SELL"
+    else:
+        return None
+    
+    # Старшие таймфреймы из TIMEFRAME_AGREEMENT должны показывать тот же тренд
+    expected = 1 if decision == "BUY" else -1
+    for name in TIMEFRAME_AGREEMENT:
+        if state.timeframes[name].signal != expected:
+            logger.info(f"Сигнал {decision} {state.name} не подтвержден таймфреймом {name}")
+            return None
+    
+    # Дополнительные условия на индикаторы из SIGNAL_RULES
+    allowed = state.indicators.allows(decision) and all(
+        timeframe.indicators.allows(decision) for timeframe in state.timeframes.values()
+    )
+    if not allowed:
+        logger.info(f"Сигнал {decision} {state.name} отклонен правилами индикаторов")
+        return None
+    return decision
+
+async def send_signal_notification(state, signal_type, current_price, df, candle_time=None):
+    """Отправка уведомления о сигнале
+    
+    candle_time - время открытия (нс) свечи, по которой принято решение. Если
+    она закрылась раньше DECISION_MAX_AGE назад (инструмент давно не
+    догружался, пропуск в стриме), вместо срока действия - пометка о задержке.
+    """
     if signal_type == "BUY":
         action = "ПОКУПКА"
         reason = "устойчивый восходящий тренд"
-        recommendation = (
-            "Рекомендуется открыть позицию в ближайшие 2-5 минут.\n"
-            "Оптимальная цена входа: на 0.1-0.3% ниже текущей."
-        )
+        timing = "Рекомендуется открыть позицию в ближайшие 2-5 минут."
+        price_hint = "Оптимальная цена входа: на 0.1-0.3% ниже текущей."
     else:
         action = "ПРОДАЖА"
         reason = "устойчивый нисходящий тренд"
-        recommendation = (
-            "Рекомендуется закрыть позицию в ближайшие 2-5 минут.\n"
-            "Оптимальная цена выхода: на 0.1-0.3% выше текущей."
-        )
+        timing = "Рекомендуется закрыть позицию в ближайшие 2-5 минут."
+        price_hint = "Оптимальная цена выхода: на 0.1-0.3% выше текущей."
+    
+    if candle_time is not None:
+        closed_at = candle_time / NANO + TICK_INTERVAL
+        delay = time.time() - closed_at
+        if delay > DECISION_MAX_AGE:
+            closed = datetime.datetime.fromtimestamp(closed_at).strftime('%H:%M')
+            timing = (
+                f"⏳ Сигнал по свече, закрытой в {closed} ({delay / 60:.0f} мин назад) - "
+                f"проверьте, что тренд сохраняется, прежде чем действовать."
+            )
+    
+    # Стакан: спред, дисбаланс и цена заявки по нему вместо общей оценки
+    book_block = ""
+    book = await get_order_book(state)
+    features = book.features() if book is not None else None
+    if features is not None:
+        price_hint = order_book_price_hint(signal_type, features)
+        flow = state.trade_flow.imbalance() if state.trade_flow is not None else None
+        book_block = "\n\n" + format_order_book(features, flow)
+    
+    # Таймфреймы, подтвердившие тренд
+    agreement = ""
+    if TIMEFRAME_AGREEMENT:
+        agreement = f"• Подтверждено таймфреймами: {', '.join(TIMEFRAME_AGREEMENT)}\n"
     
     # Генерация графика
-    fig = generate_chart(df)
-    buf = BytesIO()
-    fig.savefig(buf, format='png', dpi=100)
-    buf.seek(0)
+    png = await get_chart_png(state, df)
     
     # Формирование сообщения
     message = (
-        f"🚨 *СИГНАЛ {action} ВТБ*\n"
+        f"🚨 *СИГНАЛ {action} {state.name}*\n"
         f"• Текущая цена: `{current_price:.2f} RUB`\n"
         f"• Причина: {reason}\n"
-        f"• Подтверждающих сигналов: {SIGNAL_CONFIRMATION}\n\n"
+        f"• Подтверждающих сигналов: {SIGNAL_CONFIRMATION}\n"
+        f"{agreement}\n"
         f"📌 *Рекомендация*\n"
-        f"{recommendation}"
+        f"{timing}\n{price_hint}"
+        f"{book_block}"
     )
     
-    # Отправка сообщения с графиком
-    await telegram_send_photo(buf, caption=message)
-    
-    # Отправка клавиатуры для подтверждения действия
-    reply_markup = create_signal_keyboard()
-    await telegram_send_message("Подтвердите действие:", reply_markup)
+    # Одно сообщение: график, текст и клавиатура для подтверждения действия
+    await telegram_send_photo(png, caption=message, reply_markup=create_signal_keyboard(state))
 
-async def check_position_health():
+async def check_position_health(state, current_price=None):
     """Проверка текущей позиции на предмет рисков"""
-    if current_position != 1:
+    if state.position != 1:
         return
     
-    current_price = await get_current_price()
-    profit = (current_price - entry_price) / entry_price * 100
-    hold_time = (datetime.datetime.now() - entry_time).total_seconds() / 60
+    # Цена из пакетного запроса тика, иначе - отдельный запрос
+    if current_price is None:
+        current_price = await get_current_price(state.figi)
+    risk_monitor.update(state, current_price)
+
+# Зоны риска от лучшей к худшей
+RISK_NORMAL, RISK_TAKE_PROFIT, RISK_STOP_LOSS, RISK_CRITICAL = 'normal', 'take_profit', 'stop_loss', 'critical_loss'
+
+class PositionRisk:
+    """Состояние мониторинга одной позиции"""
+    __slots__ = ('entry_time', 'zone', 'alerted_at', 'next_status_at')
     
-    # Критический стоп-лосс
-    if profit < -5:
-        await telegram_send_message(
-            f"🚨 *КРИТИЧЕСКИЙ УБЫТОК!*\n"
-            f"• Текущая цена: `{current_price:.2f} RUB`\n"
-            f"• Убыток: `{profit:.2f}%`\n"
-            f"• Рекомендуется немедленная продажа!",
-            reply_markup=create_signal_keyboard()
-        )
-    # Предупреждение о стоп-лоссе
-    elif profit < -3:
-        await telegram_send_message(
-            f"⚠️ *ПРЕДУПРЕЖДЕНИЕ О СТОП-ЛОССЕ*\n"
-            f"• Текущая цена: `{current_price:.2f} RUB`\n"
-            f"• Убыток: `{profit:.2f}%`\n"
-            f"• Рассмотрите возможность продажи"
+    def __init__(self, entry_time):
+        self.entry_time = entry_time
+        self.zone = RISK_NORMAL
+        self.alerted_at = {}  # зона -> время последнего оповещения
+        # Отчеты идут по таймеру от времени входа, в том числе после перезапуска
+        entry = entry_time.timestamp() if entry_time else time.time()
+        periods = max(0, (time.time() - entry) // POSITION_STATUS_INTERVAL) + 1
+        self.next_status_at = entry + periods * POSITION_STATUS_INTERVAL
+
+class RiskMonitor:
+    """Контроль стоп-лосса и тейк-профита по каждому обновлению цены
+    
+    Оповещение отправляется только при переходе в новую зону риска. Выход из
+    зоны требует отката прибыли на RISK_HYSTERESIS_PCT за порог, а повторный
+    вход в ту же зону молчит RISK_ALERT_COOLDOWN секунд, поэтому колебания
+    цены около порога не порождают поток сообщений.
+    """
+    
+    def __init__(self, hysteresis_pct=RISK_HYSTERESIS_PCT, cooldown=RISK_ALERT_COOLDOWN):
+        self.hysteresis_pct = hysteresis_pct
+        self.cooldown = cooldown
+        self.positions = {}  # FIGI -> PositionRisk
+    
+    def track(self, state):
+        """Состояние мониторинга открытой позиции; None если позиции нет"""
+        if state.position != 1:
+            self.positions.pop(state.figi, None)
+            return None
+        risk = self.positions.get(state.figi)
+        if risk is None or risk.entry_time != state.entry_time:
+            risk = self.positions[state.figi] = PositionRisk(state.entry_time)
+        return risk
+    
+    def classify(self, zone, profit):
+        """Новая зона риска с учетом гистерезиса на выходе из текущей"""
+        h = self.hysteresis_pct
+        if profit < CRITICAL_LOSS_PCT or (zone == RISK_CRITICAL and profit < CRITICAL_LOSS_PCT + h):
+            return RISK_CRITICAL
+        if profit < STOP_LOSS_PCT or (zone in (RISK_CRITICAL, RISK_STOP_LOSS) and profit < STOP_LOSS_PCT + h):
+            return RISK_STOP_LOSS
+        if profit > TAKE_PROFIT_PCT or (zone == RISK_TAKE_PROFIT and profit > TAKE_PROFIT_PCT - h):
+            return RISK_TAKE_PROFIT
+        return RISK_NORMAL
+    
+    def update(self, state, current_price):
+        """Обработка новой цены; возвращает зону, о которой отправлено оповещение"""
+        risk = self.track(state)
+        profit = position_profit(state, current_price)
+        if risk is None or profit is None:
+            return None
+        
+        previous, risk.zone = risk.zone, self.classify(risk.zone, profit)
+        
+        # Оповещение только о входе в зону, а не о выходе в более спокойную
+        if risk.zone == previous or risk.zone == RISK_NORMAL:
+            return None
+        if previous == RISK_CRITICAL and risk.zone == RISK_STOP_LOSS:
+            return None
+        now = time.monotonic()
+        alerted = risk.alerted_at.get(risk.zone)
+        if alerted is not None and now - alerted < self.cooldown:
+            return None
+        risk.alerted_at[risk.zone] = now
+        self.alert(state, risk.zone, current_price, profit)
+        return risk.zone
+    
+    def alert(self, state, zone, current_price, profit):
+        if zone == RISK_CRITICAL:
+            text = (
+                f"🚨 *КРИТИЧЕСКИЙ УБЫТОК ({state.name})!*\n"
+                f"• Текущая цена: `{current_price:.2f} RUB`\n"
+                f"• Убыток: `{profit:.2f}%`\n"
+                f"• Рекомендуется немедленная продажа!"
+            )
+        elif zone == RISK_STOP_LOSS:
+            text = (
+                f"⚠️ *ПРЕДУПРЕЖДЕНИЕ О СТОП-ЛОССЕ ({state.name})*\n"
+                f"• Текущая цена: `{current_price:.2f} RUB`\n"
+                f"• Убыток: `{profit:.2f}%`\n"
+                f"• Рассмотрите возможность продажи"
+            )
+        else:
+            text = (
+                f"⚠️ *ПРЕДУПРЕЖДЕНИЕ О ТЕЙК-ПРОФИТЕ ({state.name})*\n"
+                f"• Текущая цена: `{current_price:.2f} RUB`\n"
+                f"• Прибыль: `{profit:.2f}%`\n"
+                f"• Рассмотрите возможность фиксации прибыли"
+            )
+        reply_markup = None if zone == RISK_STOP_LOSS else create_signal_keyboard(state)
+        # Время входа в ключе: повтор гасится только в пределах одной позиции,
+        # первое оповещение по новой позиции уходит даже сразу после закрытия прежней
+        outbox.submit('send_message', (zone, state.figi, state.entry_time), text=text, reply_markup=reply_markup)
+    
+    def report_due(self, states, now=None):
+        """Отчеты о статусе позиций, время которых наступило; возвращает паузу до следующего"""
+        now = time.time() if now is None else now
+        next_due = now + POSITION_STATUS_INTERVAL
+        for state in states:
+            risk = self.track(state)
+            if risk is None:
+                continue
+            if now >= risk.next_status_at:
+                # Пропущенные периоды не досылаются - только один актуальный отчет
+                missed = (now - risk.next_status_at) // POSITION_STATUS_INTERVAL + 1
+                risk.next_status_at += missed * POSITION_STATUS_INTERVAL
+                self.report_status(state)
+            next_due = min(next_due, risk.next_status_at)
+        return next_due - now
+    
+    def report_status(self, state):
+        current_price = state.last_price
+        if current_price is None:
+            return
+        profit = position_profit(state, current_price)
+        hold_time = (datetime.datetime.now() - state.entry_time).total_seconds() / 60
+        outbox.submit(
+            'send_message', ('position_status', state.figi, state.entry_time),
+            text=(
+                f"ℹ️ *СТАТУС ПОЗИЦИИ ({state.name})*\n"
+                f"• Текущая цена: `{current_price:.2f} RUB`\n"
+                f"• Прибыль: `{'н/д' if profit is None else f'{profit:.2f}%'}`\n"
+                f"• Время удержания: `{hold_time:.1f} мин`"
+            ),
+            reply_markup=None
         )
-    # Предупреждение о тейк-профите
-    elif profit > 5:
-        await telegram_send_message(
-            f"⚠️ *ПРЕДУПРЕЖДЕНИЕ О ТЕЙК-ПРОФИТЕ*\n"
-            f"• Текущая цена: `{current_price:.2f} RUB`\n"
-            f"• Прибыль: `{profit:.2f}%`\n"
-            f"• Рассмотрите возможность фиксации прибыли",
-            reply_markup=create_signal_keyboard()
+    
+    async def run_status_reports(self, states, max_sleep=60):
+        """Таймер отчетов о статусе; новые позиции подхватываются не позже max_sleep"""
+        while True:
+            try:
+                delay = self.report_due(states)
+            except Exception as e:
+                logger.error(f"Ошибка отчета о статусе позиции: {str(e)}")
+                delay = max_sleep
+            await asyncio.sleep(min(max(delay, 0.1), max_sleep))
+
+risk_monitor = RiskMonitor()
+
+# ================== Order Book ================== #
+BID, ASK = 0, 1  # Стороны стакана
+BETTER = (operator.gt, operator.lt)  # Сравнение "цена лучше" для покупок и продаж
+
+def quotation_to_fixed(value):
+    """Quotation / MoneyValue в нано-единицах int (точно)"""
+    return value.units * NANO + value.nano
+
+class OrderBook:
+    """Верх стакана: depth уровней на сторону в массивах фиксированного размера
+    
+    Цены хранятся в нано-единицах int64 (точно, как Quotation), уровни идут от
+    лучшего: покупки по убыванию цены, продажи по возрастанию. Снимок и
+    изменение уровня переписывают массивы на месте за O(depth) без выделения
+    памяти. Если стакан обрезан по глубине, уровень ниже известных неизвестен:
+    новые уровни в хвост не добавляются до следующего снимка, поэтому в
+    массивах всегда лежит точное начало настоящего стакана.
+    """
+    
+    def __init__(self, figi, depth=ORDER_BOOK_DEPTH):
+        self.figi = figi
+        self.depth = depth
+        self.prices = (np.zeros(depth, dtype=np.int64), np.zeros(depth, dtype=np.int64))
+        self.quantities = (np.zeros(depth, dtype=np.int64), np.zeros(depth, dtype=np.int64))
+        self.levels = [0, 0]  # Заполненных уровней по сторонам
+        self.truncated = [False, False]  # За последним уровнем могут быть неизвестные
+        self.time = None  # Время биржи последнего обновления
+        self.updated = None  # time.monotonic() последнего обновления
+        self.updates = 0
+    
+    def apply_snapshot(self, bids, asks, timestamp=None):
+        """Замена стакана снимком (заявки Invest API: price - Quotation, quantity)"""
+        self._fill(BID, bids)
+        self._fill(ASK, asks)
+        self._touch(timestamp)
+    
+    def _fill(self, side, orders):
+        prices = self.prices[side]
+        quantities = self.quantities[side]
+        n = 0
+        for order in orders:
+            if n == self.depth:
+                break
+            prices[n] = quotation_to_fixed(order.price)
+            quantities[n] = order.quantity
+            n += 1
+        self.levels[side] = n
+        self.truncated[side] = n == self.depth
+    
+    def apply_level(self, side, price, quantity, timestamp=None):
+        """Изменение одного уровня (цена в нано-единицах); quantity=0 удаляет уровень"""
+        prices = self.prices[side]
+        quantities = self.quantities[side]
+        better = BETTER[side]
+        n = self.levels[side]
+        
+        # Позиция уровня - первый не лучше заданной цены
+        i = 0
+        while i < n and better(prices[i], price):
+            i += 1
+        
+        if i < n and prices[i] == price:
+            if quantity > 0:
+                quantities[i] = quantity
+            else:
+                for j in range(i, n - 1):
+                    prices[j] = prices[j + 1]
+                    quantities[j] = quantities[j + 1]
+                self.levels[side] = n - 1
+        elif quantity > 0 and i < self.depth and (i < n or not self.truncated[side]):
+            # Новый уровень: худшие сдвигаются, последний выпадает из полного стакана
+            if n == self.depth:
+                self.truncated[side] = True
+            last = min(n, self.depth - 1)
+            for j in range(last, i, -1):
+                prices[j] = prices[j - 1]
+                quantities[j] = quantities[j - 1]
+            prices[i] = price
+            quantities[i] = quantity
+            self.levels[side] = last + 1
+        self._touch(timestamp)
+    
+    def _touch(self, timestamp):
+        self.time = timestamp
+        self.updated = time.monotonic()
+        self.updates += 1
+    
+    def age(self):
+        """Секунд с последнего обновления (бесконечность, если обновлений не было)"""
+        return float('inf') if self.updated is None else time.monotonic() - self.updated
+    
+    def features(self, levels=ORDER_BOOK_IMBALANCE_LEVELS):
+        """Спред, дисбаланс объемов и микроцена; None, если одна из сторон пуста
+        
+        imbalance - (покупки - продажи) / сумма по levels лучшим уровням, от -1
+        до 1; microprice - середина, взвешенная объемами лучших уровней: она
+        ближе к той стороне, которую вот-вот "съедят".
+        """
+        if not self.levels[BID] or not self.levels[ASK]:
+            return None
+        
+        bid = self.prices[BID][0] / NANO
+        ask = self.prices[ASK][0] / NANO
+        bid_size = int(self.quantities[BID][0])
+        ask_size = int(self.quantities[ASK][0])
+        bid_volume = int(self.quantities[BID][:min(levels, self.levels[BID])].sum())
+        ask_volume = int(self.quantities[ASK][:min(levels, self.levels[ASK])].sum())
+        mid = (bid + ask) / 2
+        return {
+            'bid': bid,
+            'ask': ask,
+            'mid': mid,
+            'spread': ask - bid,
+            'spread_pct': (ask - bid) / mid * 100,
+            'imbalance': (bid_volume - ask_volume) / (bid_volume + ask_volume),
+            'microprice': (bid * ask_size + ask * bid_size) / (bid_size + ask_size),
+            'bid_volume': bid_volume,
+            'ask_volume': ask_volume
+        }
+
+class TradeFlow:
+    """Поток сделок: объемы покупок и продаж с экспоненциальным затуханием по времени биржи"""
+    
+    def __init__(self, half_life=TRADE_FLOW_HALF_LIFE):
+        self.half_life_ns = half_life * NANO
+        self.buy_volume = 0.0
+        self.sell_volume = 0.0
+        self.last_time = None  # нс
+        self.trades = 0
+    
+    def add(self, time_ns, quantity, buy):
+        """Учет сделки; сделки с опозданием учитываются без затухания"""
+        if self.last_time is None:
+            self.last_time = time_ns
+        elif time_ns > self.last_time:
+            decay = 0.5 ** ((time_ns - self.last_time) / self.half_life_ns)
+            self.buy_volume *= decay
+            self.sell_volume *= decay
+            self.last_time = time_ns
+        if buy:
+            self.buy_volume += quantity
+        else:
+            self.sell_volume += quantity
+        self.trades += 1
+    
+    def imbalance(self):
+        """(покупки - продажи) / сумма, от -1 до 1; None, пока сделок не было"""
+        total = self.buy_volume + self.sell_volume
+        return (self.buy_volume - self.sell_volume) / total if total else None
+
+def fetch_order_book(figi, depth=ORDER_BOOK_DEPTH):
+    """Блокирующий запрос стакана (выполняется в пуле потоков)"""
+    return invest_client.call(
+        lambda client: client.market_data.get_order_book(figi=figi, depth=depth)
+    )
+
+async def get_order_book(state):
+    """Стакан инструмента: из стрима, если свежий, иначе запросом к Invest API"""
+    book = state.order_book
+    if book is None:
+        return None
+    if book.age() <= ORDER_BOOK_MAX_AGE:
+        metrics.count('order_book_cache_hits_total')
+        return book
+    
+    try:
+        with metrics.time('get_order_book'):
+            response = await run_blocking(fetch_order_book, state.figi)
+        book.apply_snapshot(response.bids, response.asks)
+        return book
+    except Exception as e:
+        logger.error(f"Ошибка получения стакана {state.name}: {str(e)}")
+        return None
+
+def order_book_price_hint(signal_type, features):
+    """Цена заявки по стакану для рекомендации"""
+    # Микроцена выше середины - давление покупателей: покупать лучше сразу по
+    # лучшей продаже, продавать - не спеша по ней же; иначе - по лучшей покупке
+    if features['microprice'] > features['mid']:
+        price, side = features['ask'], "лучшая продажа"
+    else:
+        price, side = features['bid'], "лучшая покупка"
+    target = "входа" if signal_type == "BUY" else "выхода"
+    return f"Цена {target} по стакану: `{price:.3f} RUB` ({side})."
+
+def format_order_book(features, flow_imbalance=None):
+    """Блок уведомления со спредом, дисбалансом, микроценой и потоком сделок"""
+    lines = [
+        "📖 *Стакан*",
+        f"• Спред: `{features['spread']:.3f} RUB ({features['spread_pct']:.2f}%)`",
+        f"• Дисбаланс ({ORDER_BOOK_IMBALANCE_LEVELS} ур.): `{features['imbalance'] * 100:+.0f}%`",
+        f"• Микроцена: `{features['microprice']:.3f} RUB`"
+    ]
+    if flow_imbalance is not None:
+        lines.append(f"• Поток сделок: `{flow_imbalance * 100:+.0f}%`")
+    return "\n".join(lines)
+
+# ================== Market Data Stream ================== #
+class InvestStreamSource:
+    """Источник свечей и последних цен из стрима Invest API"""
+    
+    def __init__(self, figis):
+        self.figis = list(figis)
+    
+    async def events(self):
+        """Асинхронный генератор событий ('candle' | 'last_price' | 'orderbook' | 'trade', данные)"""
+        async with AsyncClient(TOKEN) as client:
+            stream = client.create_market_data_stream()
+            stream.candles.subscribe([
+                CandleInstrument(
+                    figi=figi,
+                    interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE
+                )
+                for figi in self.figis
+            ])
+            stream.last_price.subscribe([LastPriceInstrument(figi=figi) for figi in self.figis])
+            if ORDER_BOOK_ENABLED:
+                stream.order_book.subscribe([
+                    OrderBookInstrument(figi=figi, depth=ORDER_BOOK_DEPTH) for figi in self.figis
+                ])
+                stream.trades.subscribe([TradeInstrument(figi=figi) for figi in self.figis])
+            try:
+                async for marketdata in stream:
+                    if marketdata.candle is not None:
+                        yield 'candle', marketdata.candle
+                    elif marketdata.last_price is not None:
+                        yield 'last_price', marketdata.last_price
+                    elif marketdata.orderbook is not None:
+                        yield 'orderbook', marketdata.orderbook
+                    elif marketdata.trade is not None:
+                        yield 'trade', marketdata.trade
+            finally:
+                stream.stop()
+
+class FakeStreamSource:
+    """Подменный источник событий для проверки без доступа к бирже"""
+    
+    def __init__(self, events, delay=0.0, fail_after=None):
+        self.events_list = list(events)
+        self.delay = delay
+        self.fail_after = fail_after  # Имитация обрыва после N событий
+        self.position = 0
+        self.connections = 0
+    
+    async def events(self):
+        """Выдача событий; после переподключения продолжает с места обрыва"""
+        self.connections += 1
+        while self.position < len(self.events_list):
+            if self.fail_after is not None and self.position == self.fail_after:
+                self.fail_after = None
+                raise ConnectionError("Имитация обрыва стрима")
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            event = self.events_list[self.position]
+            self.position += 1
+            yield event
+
+# Облегченные события стрима для воспроизведения записи - с теми же полями, что у Invest API
+ReplayQuotation = namedtuple('ReplayQuotation', 'units nano')
+ReplayOrder = namedtuple('ReplayOrder', 'price quantity')
+ReplayCandle = namedtuple('ReplayCandle', 'figi time open close high low volume')
+ReplayLastPrice = namedtuple('ReplayLastPrice', 'figi time price')
+ReplayOrderBook = namedtuple('ReplayOrderBook', 'figi time bids asks')
+ReplayBookLevel = namedtuple('ReplayBookLevel', 'figi time side price quantity')
+ReplayTrade = namedtuple('ReplayTrade', 'figi time price quantity direction')
+
+def fixed_to_quotation(value):
+    """Нано-единицы в Quotation-подобную пару units, nano"""
+    units, nano = divmod(int(value), NANO)
+    return ReplayQuotation(units, nano)
+
+def encode_event(kind, payload):
+    """Событие стрима в словарь для JSON (цены в нано-единицах, время в нс)"""
+    record = {'kind': kind, 'figi': payload.figi, 'time': to_ns(payload.time)}
+    if kind == 'candle':
+        for field in ('open', 'close', 'high', 'low'):
+            record[field] = quotation_to_fixed(getattr(payload, field))
+        record['volume'] = payload.volume
+    elif kind == 'last_price':
+        record['price'] = quotation_to_fixed(payload.price)
+    elif kind == 'orderbook':
+        record['bids'] = [[quotation_to_fixed(o.price), o.quantity] for o in payload.bids]
+        record['asks'] = [[quotation_to_fixed(o.price), o.quantity] for o in payload.asks]
+    elif kind == 'orderbook_level':
+        record['side'] = 'bid' if payload.side == BID else 'ask'
+        record['price'] = quotation_to_fixed(payload.price)
+        record['quantity'] = payload.quantity
+    elif kind == 'trade':
+        record['price'] = quotation_to_fixed(payload.price)
+        record['quantity'] = payload.quantity
+        record['direction'] = int(payload.direction)
+    return record
+
+def decode_event(record):
+    """Словарь encode_event обратно в событие стрима (kind, payload)"""
+    kind = record['kind']
+    figi = record['figi']
+    timestamp = from_ns(record['time'])
+    if kind == 'candle':
+        payload = ReplayCandle(figi, timestamp, *(
+            fixed_to_quotation(record[field]) for field in ('open', 'close', 'high', 'low')
+        ), record['volume'])
+    elif kind == 'last_price':
+        payload = ReplayLastPrice(figi, timestamp, fixed_to_quotation(record['price']))
+    elif kind == 'orderbook':
+        payload = ReplayOrderBook(figi, timestamp, *(
+            [ReplayOrder(fixed_to_quotation(price), quantity) for price, quantity in record[side]]
+            for side in ('bids', 'asks')
+        ))
+    elif kind == 'orderbook_level':
+        payload = ReplayBookLevel(
+            figi, timestamp, BID if record['side'] == 'bid' else ASK,
+            fixed_to_quotation(record['price']), record['quantity']
         )
-    # Статус позиции (каждые 30 мин)
-    elif hold_time > 30 and int(hold_time) % 30 == 0:
-        await telegram_send_message(
-            f"ℹ️ *СТАТУС ПОЗИЦИИ*\n"
-            f"• Текущая цена: `{current_price:.2f} RUB`\n"
-            f"• Прибыль: `{profit:.2f}%`\n"
-            f"• Время удержания: `{hold_time:.1f} мин`"
+    elif kind == 'trade':
+        payload = ReplayTrade(
+            figi, timestamp, fixed_to_quotation(record['price']), record['quantity'], record['direction']
         )
+    else:
+        raise ValueError(f"Неизвестный тип события: {kind}")
+    return kind, payload
+
+def read_replay(path):
+    """События из записи стрима (JSON Lines) по порядку"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield decode_event(json.loads(line))
+
+class StreamRecorder:
+    """Обертка источника стрима: события передаются дальше и дописываются в JSON Lines"""
+    
+    def __init__(self, source, path):
+        self.source = source
+        self.path = path
+        self.recorded = 0
+    
+    async def events(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            async for kind, payload in self.source.events():
+                f.write(json.dumps(encode_event(kind, payload)) + '\n')
+                self.recorded += 1
+                yield kind, payload
+
+class ReplayStreamSource:
+    """Воспроизведение записи стрима вместо биржи
+    
+    speed - ускорение относительно времени биржи (None - без пауз между
+    событиями, цикл событий отпускается каждые 1000 событий).
+    """
+    
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = speed
+        self.replayed = 0
+        self.reader = None
+    
+    async def events(self):
+        """Выдача событий; после переподключения продолжает с места обрыва"""
+        if self.reader is None:
+            self.reader = read_replay(self.path)
+        previous = None
+        for kind, payload in self.reader:
+            current = to_ns(payload.time)
+            if self.speed and previous is not None and current > previous:
+                await asyncio.sleep((current - previous) / NANO / self.speed)
+            elif self.replayed % 1000 == 0:
+                await asyncio.sleep(0)
+            previous = current
+            self.replayed += 1
+            yield kind, payload
+
+class MarketDataStreamSupervisor:
+    """Чтение стрима с переподключением и передачей данных в состояние инструментов"""
+    
+    def __init__(self, source, states):
+        self.source = source
+        self.states = states  # FIGI -> InstrumentState
+        self.candle_closed = asyncio.Event()
+        self.reconnects = 0
+    
+    def handle_event(self, kind, payload):
+        """Применение события стрима к хранилищу свечей и цене инструмента"""
+        state = self.states.get(payload.figi)
+        if state is None:
+            return
+        
+        if kind == 'candle':
+            store = state.candles
+            row = candles_to_dataframe([payload])
+            previous_time = store.last_time
+            if store.df.empty:
+                store.df = row
+            else:
+                store.merge(row)
+            # Пришла свеча новой минуты - предыдущая закрылась
+            if previous_time is not None and row.index[0] > previous_time:
+                store.close_until(to_ns(previous_time))
+                self.candle_closed.set()
+        elif kind == 'last_price':
+            state.last_price = payload.price.units + payload.price.nano / 1e9
+            state.last_price_time = payload.time
+            # Риски проверяются на каждой цене, не дожидаясь закрытия свечи; ошибка
+            # проверки не должна обрывать стрим всего списка инструментов
+            try:
+                risk_monitor.update(state, state.last_price)
+            except Exception as e:
+                logger.error(f"Ошибка проверки рисков {state.figi}: {str(e)}", exc_info=True)
+        elif kind == 'orderbook' and state.order_book is not None:
+            state.order_book.apply_snapshot(payload.bids, payload.asks, payload.time)
+            metrics.count('order_book_updates_total')
+        elif kind == 'orderbook_level' and state.order_book is not None:
+            state.order_book.apply_level(
+                payload.side, quotation_to_fixed(payload.price), payload.quantity, payload.time
+            )
+            metrics.count('order_book_updates_total')
+        elif kind == 'trade' and state.trade_flow is not None:
+            state.trade_flow.add(
+                to_ns(payload.time), payload.quantity,
+                payload.direction == TradeDirection.TRADE_DIRECTION_BUY
+            )
+    
+    def fill_gap(self):
+        """Догрузка свечей, пропущенных во время обрыва стрима (блокирующая)"""
+        for state in self.states.values():
+            invest_client.call(state.candles.update)
+    
+    async def run(self):
+        """Бесконечное чтение стрима с экспоненциальной паузой при ошибках"""
+        delay = STREAM_RECONNECT_MIN_DELAY
+        while True:
+            try:
+                if self.reconnects:
+                    try:
+                        await run_blocking(self.fill_gap, timeout=None)
+                    except Exception as e:
+                        logger.error(f"Ошибка догрузки свечей после обрыва: {str(e)}")
+                    # Догруженные свечи закрыты - цикл сигналов учитывает их сразу
+                    self.candle_closed.set()
+                async for kind, payload in self.source.events():
+                    self.handle_event(kind, payload)
+                    delay = STREAM_RECONNECT_MIN_DELAY
+                logger.warning("Стрим рыночных данных завершился")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка стрима рыночных данных: {str(e)}")
+            
+            self.reconnects += 1
+            logger.info(f"Переподключение к стриму через {delay} сек")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STREAM_RECONNECT_MAX_DELAY)
 
 # ================== Main Trading Loop ================== #
-async def signal_monitoring():
-    """Основной цикл мониторинга сигналов"""
-    global signals_history, bot_instance
+class TickScheduler:
+    """Тики на границах свечей с задержкой на закрытие и паузой с джиттером после ошибок
+    
+    Следующий тик всегда считается от текущего времени, поэтому опоздавшие
+    тики пропускаются, а не выполняются пачкой.
+    """
+    
+    def __init__(self, interval=TICK_INTERVAL, settle=TICK_SETTLE_DELAY,
+                 backoff_min=LOOP_BACKOFF_MIN, backoff_max=LOOP_BACKOFF_MAX):
+        self.interval = interval
+        self.settle = settle
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.failures = 0
+        self.skipped = 0
+        self.boundary = self.current_boundary()
+    
+    def current_boundary(self, now=None):
+        """Последняя граница свечи, для которой уже прошла задержка на закрытие"""
+        now = time.time() if now is None else now
+        return (now - self.settle) // self.interval * self.interval
     
-    # Инициализация бота
+    async def wait(self):
+        """Ожидание следующего тика; возвращает его границу свечи"""
+        now = time.time()
+        boundary = self.current_boundary(now) + self.interval
+        skipped = int((boundary - self.boundary) // self.interval) - 1
+        if skipped > 0:
+            self.skipped += skipped
+            metrics.count('ticks_skipped_total', skipped)
+            logger.warning(f"Пропущено тиков из-за долгой обработки: {skipped}")
+        
+        target = boundary + self.settle
+        await asyncio.sleep(max(0.0, target - now))
+        metrics.observe('tick_lag', max(0.0, time.time() - target))
+        self.boundary = boundary
+        return boundary
+    
+    async def wait_event(self, event):
+        """Ожидание закрытия свечи в потоковом режиме (событие супервизора стрима)"""
+        await event.wait()
+        event.clear()
+    
+    def succeeded(self):
+        self.failures = 0
+    
+    def failed(self):
+        """Пауза после ошибки: экспоненциальный рост и случайная половина сверху"""
+        self.failures += 1
+        delay = min(self.backoff_max, self.backoff_min * 2 ** (self.failures - 1))
+        return random.uniform(delay / 2, delay)
+    
+    def resync(self):
+        """После паузы на ошибку тик пересчитывается по текущему времени"""
+        self.boundary = self.current_boundary()
+
+def build_application():
+    """Telegram-приложение с обработчиками команд и кнопок"""
     application = Application.builder().token(TELEGRAM_TOKEN).build()
     application.add_handler(CommandHandler('start', start_command))
     application.add_handler(CommandHandler('status', status_command))
     application.add_handler(CommandHandler('chart', chart_command))
     application.add_handler(CommandHandler('position', position_command))
+    application.add_handler(CommandHandler('metrics', metrics_command))
     application.add_handler(CallbackQueryHandler(button_handler))
+    return application
+
+def preload_pandas():
+    """Импорт pandas, если он еще не загружен (выполняется в пуле потоков)"""
+    if isinstance(pd, LazyModule):
+        pd.load()
+
+async def warm_up_charts():
+    """Импорт matplotlib и создание фигуры в потоке рендеринга заранее"""
+    try:
+        with startup.phase('charts'):
+            await run_blocking(get_chart_renderer, executor=render_executor, timeout=None)
+    except Exception as e:
+        logger.error(f"Ошибка подготовки графиков: {str(e)}")
+
+async def signal_monitoring(stream_source=None):
+    """Основной цикл мониторинга сигналов
+    
+    stream_source - источник событий стрима вместо Invest API (запись,
+    подменный источник); с ним потоковый режим включается независимо от
+    STREAMING_MODE.
+    """
+    global bot_instance
     
-    await application.initialize()
-    await application.start()
-    await application.updater.start_polling()
+    # Telegram поднимается первым: /status отвечает, пока грузятся pandas и история
+    with startup.phase('telegram'):
+        application = build_application()
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling()
+    logger.info(f"Бот отвечает на команды через {startup.elapsed('telegram') * 1000:.0f} мс после запуска")
     
     bot_instance = application.bot
-    await telegram_send_message("🚀 Система сигналов ВТБ активирована! Ожидание данных...")
+    outbox_task = asyncio.create_task(outbox.run(bot_instance))
+    await telegram_send_message(
+        f"🚀 Система сигналов активирована! Инструментов: {len(WATCHLIST)}. Ожидание данных..."
+    )
+    
+    # pandas импортируется в пуле потоков, чтобы не задерживать обработчики команд
+    with startup.phase('pandas'):
+        await run_blocking(preload_pandas, timeout=None)
+    
+    # Первичная загрузка истории - дальше догружаются только новые свечи
+    for figi, name in WATCHLIST.items():
+        instruments[figi] = InstrumentState(figi, name)
+    
+    # Позиции и недавние сигналы из журнала - прогрев после перезапуска не нужен
+    if state_journal is not None:
+        try:
+            with startup.phase('journal'):
+                opened = state_journal.restore(instruments)
+            logger.info(f"Состояние восстановлено из журнала, открытых позиций: {opened}")
+        except Exception as e:
+            logger.error(f"Ошибка восстановления состояния: {str(e)}", exc_info=True)
+    
+    # matplotlib и фигура графика готовятся в потоке рендеринга к первому сигналу
+    charts_task = asyncio.create_task(warm_up_charts())
+    
+    def backfill_all():
+        for state in instruments.values():
+            invest_client.call(state.candles.backfill)
     
+    try:
+        with startup.phase('history'):
+            await run_blocking(backfill_all, timeout=None)
+        with startup.phase('verify'):
+            history = instruments[next(iter(instruments))].candles.frame()
+            failed = verify_indicators(history, {rule.indicator for rule in signal_rules}) if signal_rules else []
+            if failed:
+                logger.warning(f"Индикаторы правил расходятся с эталоном pandas: {', '.join(failed)}")
+            failed = verify_timeframes(history) if TIMEFRAMES else []
+            if failed:
+                logger.warning(f"Агрегация таймфреймов расходится с resample pandas: {', '.join(failed)}")
+    except Exception as e:
+        logger.error(f"Ошибка загрузки истории: {str(e)}", exc_info=True)
+    
+    scheduler = SignalScheduler(instruments.values())
+    health_task = asyncio.create_task(client_health_monitoring())
+    status_task = asyncio.create_task(risk_monitor.run_status_reports(scheduler.states))
+    metrics_task = None
+    if METRICS_ENABLED and METRICS_HTTP_PORT:
+        metrics_task = asyncio.create_task(metrics.serve_http(METRICS_HTTP_PORT))
+    
+    # Потоковый режим: свечи и цены приходят из стрима, цикл ждет закрытия свечи
+    supervisor = None
+    stream_task = None
+    if STREAMING_MODE or stream_source is not None:
+        source = stream_source if stream_source is not None else InvestStreamSource(instruments)
+        if STREAM_RECORD_PATH:
+            source = StreamRecorder(source, STREAM_RECORD_PATH)
+        supervisor = MarketDataStreamSupervisor(source, instruments)
+        stream_task = asyncio.create_task(supervisor.run())
+    
+    ticker = TickScheduler()
+    first_tick = True
     try:
         while True:
             try:
-                with Client(TOKEN) as client:
-                    # Получение и анализ данных
-                    df = get_historical_candles(client, HISTORY_DAYS)
-                    if df.empty or len(df) < max(SHORT_MA_PERIOD, LONG_MA_PERIOD):
-                        await asyncio.sleep(30)
-                        continue
-                    
-                    # Рассчитываем индикаторы
-                    df = calculate_indicators(df)
-                    
-                    # Получение последнего сигнала
-                    last_signal = df.iloc[-1]['signal']
-                    current_price = df.iloc[-1]['close']
-                    
-                    # Сохранение сигнала в историю
-                    signals_history.append(last_signal)
+                # Получение данных: стрим или пакетный опрос. В стриме первый проход -
+                # по загруженной истории, как первый тик опроса, дальше - по закрытию свечей
+                if supervisor is not None:
+                    if not first_tick:
+                        await ticker.wait_event(supervisor.candle_closed)
+                else:
+                    with metrics.time('candle_fetch'):
+                        await scheduler.poll_tick()
+                tick_started = time.perf_counter()
+                
+                # Сигналы одним векторным расчетом и только по закрытым свечам: каждое
+                # хранилище само знает, до какой свечи оно закрыто, поэтому инструменты
+                # без новой закрытой свечи пропускаются
+                with metrics.time('signal_evaluate'):
+                    fresh = scheduler.evaluate()
+                
+                # Индикаторы правил сигналов - по тем же закрытым свечам, O(1) на свечу
+                if signal_rules:
+                    with metrics.time('indicator_update'):
+                        for state in scheduler.states:
+                            state.indicators.feed(state.candles.df, state.candles.closed_until)
+                
+                # Старшие таймфреймы из тех же закрытых минутных свечей, без запросов к API
+                if TIMEFRAMES:
+                    with metrics.time('timeframe_update'):
+                        for state in scheduler.states:
+                            state.feed_timeframes()
+                
+                for row, state in enumerate(scheduler.states):
+                    # Сигнал в историю - по каждой новой закрытой свече инструмента
+                    signal = None
+                    decisions = []
+                    for time_ns, close, signal in fresh.get(row, ()):
+                        # Свеча, учтенная в истории до перезапуска, повторно не анализируется
+                        if not state.record_signal(time_ns, signal):
+                            continue
+                        
+                        # Анализ сигналов
+                        with metrics.time('analyze_signals'):
+                            decision = analyze_signals(state)
+                        if decision:
+                            decisions.append((decision, time_ns, close))
+                            # Очистка истории после решения - подтверждения считаются заново
+                            state.signals_history.clear()
                     
-                    # Анализ сигналов
-                    decision = analyze_signals()
+                    # Снимок тика для обработчиков команд: дальше они обходятся без запросов
+                    snapshot = state.publish(signal, decisions[-1][0] if decisions else None)
                     
-                    # Отправка уведомления при наличии решения
-                    if decision:
-                        await send_signal_notification(decision, current_price, df)
-                        # Очистка истории после отправки сигнала
-                        signals_history = []
+                    # Отправка уведомления по каждому решению (несколько - только после догрузки пропуска).
+                    # Текущая цена - последняя цена тика: свеча решения могла закрыться несколько минут назад
+                    for decision, candle_time, close in decisions:
+                        metrics.count('signals_total')
+                        price = state.last_price if state.last_price is not None else close
+                        # Индикаторы для графика считаются один раз и остаются в снимке для /chart
+                        df = snapshot.indicators()
+                        with metrics.time('signal_notification'):
+                            await send_signal_notification(state, decision, price, df, candle_time)
                     
                     # Проверка текущей позиции
-                    await check_position_health()
-                    
-                    # Интервал проверки
-                    await asyncio.sleep(60)
-                    
-            except Exception as e:
-                logger.error(f"Ошибка в основном цикле: {str(e)}", exc_info=True)
-                await asyncio.sleep(120)
+                    with metrics.time('risk_check'):
+                        await check_position_health(state, state.last_price)
                 
+                if state_journal is not None:
+                    with metrics.time('state_save'):
+                        state_journal.save_signals(scheduler.states)
+                metrics.observe('tick', time.perf_counter() - tick_started)
+                if first_tick:
+                    first_tick = False
+                    startup.mark('first_tick', time.perf_counter() - tick_started)
+                    logger.info(f"Фазы запуска: {startup.report()}")
+                
+                # Следующий тик - на границе свечи плюс задержка на закрытие
+                ticker.succeeded()
+                if supervisor is None:
+                    await ticker.wait()
+            
+            except Exception as e:
+                metrics.count('loop_errors_total')
+                delay = ticker.failed()
+                logger.error(f"Ошибка в основном цикле, повтор через {delay:.0f} сек: {str(e)}", exc_info=True)
+                await asyncio.sleep(delay)
+                ticker.resync()
+    
     except KeyboardInterrupt:
         await telegram_send_message("🛑 Система сигналов остановлена вручную")
     finally:
+        if stream_task is not None:
+            stream_task.cancel()
+        health_task.cancel()
+        status_task.cancel()
+        charts_task.cancel()
+        if metrics_task is not None:
+            metrics_task.cancel()
+        await outbox.flush()
+        outbox_task.cancel()
         await application.stop()
+        invest_client.close()
+        if state_journal is not None:
+            state_journal.close()
+        io_executor.shutdown(wait=False)
+        render_executor.shutdown(wait=False)
+
+startup.mark('import', time.perf_counter() - STARTUP_STARTED)
 
 if __name__ == "__main__":
     asyncio.run(signal_monitoring())
@@ -0,0 +1,736 @@
+"""Офлайн-прогон бота на записанных свечах без биржи и Telegram.
+
+Invest API и Telegram-приложение подменяются локальными заменами, а время
+бота - часами симуляции: signal_monitoring, button_handler и
+check_position_health работают без изменений, тик за тиком по свечам из
+файла. Пользователь по умолчанию нажимает первую кнопку каждого сообщения
+(подтверждает сигнал), все сообщения бота записываются в протокол.
+
+Прогон служит и замером (тиков в секунду, задержка от закрытия свечи до
+доставки сигнала), и регрессионной проверкой: протокол сравнивается с
+сохраненным эталоном.
+
+Запуск:
+    python vtb_simulation.py candles.csv [--speed 600] [--transcript out.jsonl]
+    python vtb_simulation.py candles/ --figi BBG004730ZJ9 --check golden.jsonl
+    python vtb_simulation.py --synthetic 900 --instruments 50   # нагрузочный прогон
+    python vtb_simulation.py candles.csv --stream   # потоковый режим вместо опроса
+    python vtb_simulation.py candles.csv --warmup 0 --record stream.jsonl
+    python vtb_simulation.py --replay stream.jsonl   # запись стрима (STREAM_RECORD_PATH)
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from telegram.error import RetryAfter
+
+import vtb_backtest as backtest
+import vtb_scalper_signals as signals
+
+INTERVAL_NS = signals.TICK_INTERVAL * signals.NANO
+
+
+class SimClock:
+    """Часы симуляции: время Unix в секундах, двигается только тиками"""
+    
+    def __init__(self, now):
+        self.now = float(now)
+
+
+class SimTime:
+    """Замена модуля time для бота: time() и monotonic() идут по часам симуляции
+    
+    perf_counter и остальное - настоящие, поэтому метрики этапов показывают
+    реальное время обработки.
+    """
+    
+    def __init__(self, clock):
+        self.clock = clock
+    
+    def time(self):
+        return self.clock.now
+    
+    def monotonic(self):
+        return self.clock.now
+    
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class SimDatetimeModule:
+    """Замена модуля datetime для бота: datetime.now() по часам симуляции"""
+    
+    def __init__(self, clock):
+        def now(cls, tz=None):
+            return datetime.datetime.fromtimestamp(clock.now, tz)
+        self.datetime = type('datetime', (datetime.datetime,), {'now': classmethod(now)})
+    
+    def __getattr__(self, name):
+        return getattr(datetime, name)
+
+
+class SimMarket:
+    """Свечи инструментов, открывающиеся по часам симуляции"""
+    
+    def __init__(self, frames, clock):
+        self.clock = clock
+        self.times = {}
+        self.candles = {}
+        self.closes = {}
+        for figi, df in frames.items():
+            times = df.index.as_unit('ns').asi8
+            self.times[figi] = times
+            self.closes[figi] = df['close'].to_numpy(dtype=np.float64)
+            prices = {
+                column: np.rint(df[column].to_numpy(dtype=np.float64) * signals.NANO).astype(np.int64)
+                for column in ('open', 'close', 'high', 'low')
+            }
+            volumes = df['volume'].to_numpy(dtype=np.int64) if 'volume' in df else np.zeros(len(df), dtype=np.int64)
+            self.candles[figi] = [
+                signals.ReplayCandle(figi, signals.from_ns(t), *(
+                    signals.fixed_to_quotation(prices[column][i]) for column in ('open', 'close', 'high', 'low')
+                ), int(volumes[i]))
+                for i, t in enumerate(times)
+            ]
+    
+    def now_ns(self):
+        return int(self.clock.now * signals.NANO)
+    
+    def closed_count(self, figi):
+        """Сколько свечей инструмента уже закрыто"""
+        return int(np.searchsorted(self.times[figi], self.now_ns() - INTERVAL_NS, side='right'))
+    
+    def get_candles(self, figi, from_, to):
+        """Закрытые свечи интервала и формирующаяся - пока только с ценой открытия"""
+        times = self.times[figi]
+        start = int(np.searchsorted(times, signals.to_ns(from_)))
+        end = min(int(np.searchsorted(times, signals.to_ns(to))),
+                  int(np.searchsorted(times, self.now_ns(), side='right')))
+        closed = min(end, self.closed_count(figi))
+        candles = self.candles[figi][start:closed]
+        if closed < end:
+            candle = self.candles[figi][closed]
+            candles = candles + [candle._replace(
+                close=candle.open, high=candle.open, low=candle.open, volume=0
+            )]
+        return candles
+    
+    def last_price(self, figi):
+        """Цена закрытия последней закрытой свечи и время ее закрытия"""
+        closed = self.closed_count(figi)
+        if closed == 0:
+            return None
+        nano = int(round(self.closes[figi][closed - 1] * signals.NANO))
+        return types.SimpleNamespace(
+            figi=figi,
+            price=signals.fixed_to_quotation(nano),
+            time=signals.from_ns(self.times[figi][closed - 1] + INTERVAL_NS)
+        )
+
+
+class SimClient:
+    """Замена Client из tinkoff.invest поверх SimMarket с искусственной задержкой"""
+    
+    def __init__(self, token, market=None, latency=0.0):
+        self.market = market
+        self.latency = latency
+        self.market_data = self
+        self.users = self
+        self.calls = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def get_all_candles(self, figi, from_, to, interval=None):
+        self.call()
+        return self.market.get_candles(figi, from_, to)
+    
+    def get_last_prices(self, figi):
+        self.call()
+        prices = [self.market.last_price(f) for f in figi]
+        return types.SimpleNamespace(last_prices=[p for p in prices if p is not None])
+    
+    def get_info(self):
+        self.call()
+        return types.SimpleNamespace()
+
+
+class Transcript:
+    """Протокол сообщений бота со временем симуляции"""
+    
+    def __init__(self, clock):
+        self.clock = clock
+        self.entries = []
+    
+    def add(self, source, method, text=None, reply_markup=None):
+        buttons = []
+        if reply_markup is not None:
+            buttons = [button.callback_data for row in reply_markup.inline_keyboard for button in row]
+        self.entries.append({
+            'time': datetime.datetime.fromtimestamp(self.clock.now, datetime.timezone.utc).isoformat(),
+            'source': source,
+            'method': method,
+            'text': text,
+            'buttons': buttons
+        })
+
+
+class SimMessage:
+    """Сообщение чата: ответы бота попадают в протокол"""
+    
+    def __init__(self, harness):
+        self.harness = harness
+    
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        self.harness.transcript.add('reply', 'send_message', text, reply_markup)
+        self.harness.follow(reply_markup)
+    
+    async def reply_photo(self, photo, caption=None, reply_markup=None, **kwargs):
+        self.harness.transcript.add('reply', 'send_photo', caption, reply_markup)
+
+
+class SimCallbackQuery:
+    """Нажатие кнопки пользователем"""
+    
+    def __init__(self, harness, data):
+        self.harness = harness
+        self.data = data
+        self.message = SimMessage(harness)
+    
+    async def answer(self, *args, **kwargs):
+        pass
+    
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.harness.transcript.add('edit', 'edit_message_text', text, reply_markup)
+        self.harness.follow(reply_markup)
+
+
+class FakeBot:
+    """Бот без сети для замеров и офлайн-прогона: задержка ответа и RetryAfter сверх лимита в секунду"""
+    
+    def __init__(self, latency=0.05, limit_per_sec=None):
+        self.latency = latency
+        self.limit_per_sec = limit_per_sec
+        self.delivered = []  # (время доставки, метод, параметры)
+        self.rejected = 0
+    
+    async def deliver(self, method, kwargs):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        if self.limit_per_sec is not None:
+            recent = sum(1 for delivered_at, _, _ in self.delivered[-self.limit_per_sec:] if now - delivered_at < 1)
+            if recent >= self.limit_per_sec:
+                self.rejected += 1
+                raise RetryAfter(1)
+        self.delivered.append((now, method, kwargs))
+    
+    async def send_message(self, **kwargs):
+        await self.deliver('send_message', kwargs)
+    
+    async def send_photo(self, **kwargs):
+        await self.deliver('send_photo', kwargs)
+
+
+class SimBot(FakeBot):
+    """Бот без сети: доставленные сообщения записываются в протокол"""
+    
+    def __init__(self, harness, latency=0.0):
+        super().__init__(latency=latency)
+        self.harness = harness
+        self.in_flight = 0
+    
+    async def deliver(self, method, kwargs):
+        self.in_flight += 1
+        try:
+            await super().deliver(method, kwargs)
+        finally:
+            self.in_flight -= 1
+        text = kwargs.get('text') or kwargs.get('caption')
+        self.harness.delivered(method, text, kwargs.get('reply_markup'))
+
+
+class SimUpdater:
+    async def start_polling(self, *args, **kwargs):
+        pass
+    
+    async def stop(self):
+        pass
+
+
+class SimApplication:
+    """Замена telegram.ext.Application: обработчики вызываются напрямую из симуляции"""
+    
+    def __init__(self, harness):
+        self.harness = harness
+        self.handlers = []
+        self.bot = SimBot(harness, harness.bot_latency)
+        self.updater = SimUpdater()
+        harness.application = self
+    
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+    
+    async def initialize(self):
+        pass
+    
+    async def start(self):
+        pass
+    
+    async def stop(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+
+class SimApplicationBuilder:
+    def __init__(self, harness):
+        self.harness = harness
+    
+    def token(self, token):
+        return self
+    
+    def build(self):
+        return SimApplication(self.harness)
+
+
+class SimStreamSource:
+    """Стрим рыночных данных по часам симуляции: события минуты выдаются по команде тика
+    
+    Без записи события берутся из SimMarket: последняя цена, итоговая свеча
+    закрывшейся минуты и свеча новой минуты с ценой открытия - ее приход
+    закрывает предыдущую. С записью (ReplayStreamSource) события выдаются в
+    порядке файла, пока не дойдут до часов симуляции; события до первого тика
+    уже есть в загруженной истории и пропускаются.
+    """
+    
+    def __init__(self, market, start_ns, replay=None):
+        self.market = market
+        self.start_ns = start_ns
+        self.replay = replay
+        self.minutes = asyncio.Queue()
+        self.reader = None
+        self.pending = None
+    
+    async def release(self, boundary):
+        """Выдача событий до границы свечи boundary (сек); возвращается, когда бот их применил"""
+        await self.minutes.put(boundary)
+        await self.minutes.join()
+    
+    async def events(self):
+        while True:
+            boundary_ns = await self.minutes.get() * signals.NANO
+            try:
+                if self.replay is None:
+                    for event in self.market_events(boundary_ns):
+                        yield event
+                else:
+                    async for event in self.replay_events(boundary_ns):
+                        yield event
+            finally:
+                # Следующее событие запрошено - предыдущие уже обработаны супервизором
+                self.minutes.task_done()
+    
+    def market_events(self, boundary_ns):
+        for figi in self.market.candles:
+            price = self.market.last_price(figi)
+            if price is not None:
+                yield 'last_price', price
+            candles = self.market.get_candles(
+                figi, signals.from_ns(boundary_ns - INTERVAL_NS), signals.from_ns(boundary_ns + INTERVAL_NS)
+            )
+            for candle in candles:
+                yield 'candle', candle
+    
+    async def replay_events(self, boundary_ns):
+        if self.reader is None:
+            self.reader = self.replay.events()
+        while True:
+            if self.pending is None:
+                try:
+                    self.pending = await anext(self.reader)
+                except StopAsyncIteration:
+                    return
+            kind, payload = self.pending
+            time_ns = signals.to_ns(payload.time)
+            # Свеча помечена временем открытия, поэтому первое событие свечи новой
+            # минуты выдается на ее границе и закрывает предыдущую
+            if time_ns > boundary_ns:
+                return
+            self.pending = None
+            if time_ns >= self.start_ns:
+                yield kind, payload
+
+
+class SimTicker(signals.TickScheduler):
+    """Тики бота по часам симуляции: следующая свеча - после того как бот ответил на текущую
+    
+    При опросе бот ждет тик в wait, в потоковом режиме - в wait_event: минута
+    стрима выдается только после обработки предыдущей.
+    """
+    
+    def __init__(self, harness):
+        self.harness = harness
+        super().__init__()
+    
+    async def wait(self):
+        await self.finish_tick()
+        boundary = await self.advance()
+        self.start_tick()
+        return boundary
+    
+    async def wait_event(self, event):
+        await self.finish_tick()
+        # Минуты без закрывшихся свечей проходят без пробуждения бота
+        while not event.is_set():
+            await self.harness.stream.release(await self.advance())
+        event.clear()
+        self.start_tick()
+    
+    async def finish_tick(self):
+        await self.harness.settle()
+        self.harness.tick_done()
+    
+    async def advance(self):
+        """Перевод часов на следующую границу свечи с задержкой на закрытие"""
+        harness = self.harness
+        boundary = self.boundary + self.interval
+        if boundary > harness.end_boundary:
+            harness.finished.set()
+            await asyncio.Event().wait()  # Цикл бота остановит отмена задачи
+        
+        if harness.speed:
+            # Темп: одна свеча за interval / speed реальных секунд
+            target = harness.real_start + (boundary - harness.start_boundary) / harness.speed
+            await asyncio.sleep(max(0.0, target - time.perf_counter()))
+        else:
+            await asyncio.sleep(0)
+        
+        harness.clock.now = boundary + self.settle
+        self.boundary = boundary
+        return boundary
+    
+    def start_tick(self):
+        # Отчеты о статусе позиций - сразу, чтобы порядок сообщений не зависел от таймера
+        signals.risk_monitor.report_due(list(signals.instruments.values()))
+        self.harness.tick_started()
+
+
+class Simulation:
+    """Прогон signal_monitoring на свечах из файла с подменой биржи, Telegram и времени"""
+    
+    def __init__(self, frames, names=None, speed=None, warmup=60, auto_confirm=True,
+                 api_latency=0.0, bot_latency=0.0, stream=False, replay=None, record=None):
+        self.frames = frames
+        self.names = names or {figi: figi for figi in frames}
+        self.speed = speed
+        self.auto_confirm = auto_confirm
+        self.api_latency = api_latency
+        self.bot_latency = bot_latency
+        
+        first = min(int(df.index[0].value) for df in frames.values()) // signals.NANO
+        last = max(int(df.index[-1].value) for df in frames.values()) // signals.NANO
+        interval = signals.TICK_INTERVAL
+        # Первый тик - после прогрева, последний - на закрытии последней свечи
+        self.start_boundary = (first // interval + warmup) * interval
+        self.end_boundary = (last // interval + 1) * interval
+        
+        self.clock = SimClock(self.start_boundary + signals.TICK_SETTLE_DELAY)
+        self.market = SimMarket(frames, self.clock)
+        # Потоковый режим: из свечей файла или из записи стрима (replay - путь к ней)
+        self.stream = None
+        if stream or replay:
+            self.stream = SimStreamSource(
+                self.market, self.start_boundary * signals.NANO,
+                signals.ReplayStreamSource(replay) if replay else None
+            )
+        self.record = record
+        self.transcript = Transcript(self.clock)
+        self.application = None
+        self.finished = asyncio.Event()
+        self.presses = set()
+        self.ticks = 0
+        self.real_start = None
+        self.tick_real_start = None
+        self.signal_latencies = []
+        self.tick_durations = []
+    
+    # Обратные вызовы замен
+    def delivered(self, method, text, reply_markup):
+        self.transcript.add('bot', method, text, reply_markup)
+        if method == 'send_photo' and text and text.startswith("🚨 *СИГНАЛ"):
+            self.signal_latencies.append(time.perf_counter() - self.tick_real_start)
+        self.follow(reply_markup)
+    
+    def follow(self, reply_markup):
+        """Пользователь нажимает первую кнопку сообщения, если это подтверждение"""
+        if not self.auto_confirm or reply_markup is None:
+            return
+        data = reply_markup.inline_keyboard[0][0].callback_data
+        if data.startswith('confirm_'):
+            task = asyncio.get_running_loop().create_task(self.press(data))
+            self.presses.add(task)
+            task.add_done_callback(self.presses.discard)
+    
+    def tick_started(self):
+        self.ticks += 1
+        self.tick_real_start = time.perf_counter()
+    
+    def tick_done(self):
+        if self.tick_real_start is not None:
+            self.tick_durations.append(time.perf_counter() - self.tick_real_start)
+    
+    async def settle(self):
+        """Ожидание доставки всех сообщений и обработки нажатий текущего тика"""
+        outbox = signals.outbox
+        bot = self.application.bot
+        while outbox.pending or bot.in_flight or self.presses:
+            if self.presses:
+                await asyncio.gather(*self.presses, return_exceptions=True)
+            else:
+                await asyncio.sleep(0)
+    
+    # Действия пользователя
+    def handler(self, kind, command=None):
+        for handler in self.application.handlers:
+            if kind == 'callback' and isinstance(handler, signals.CallbackQueryHandler):
+                return handler.callback
+            if kind == 'command' and isinstance(handler, signals.CommandHandler) and command in handler.commands:
+                return handler.callback
+        raise KeyError(command or kind)
+    
+    async def press(self, data):
+        """Нажатие кнопки с callback_data через зарегистрированный обработчик бота"""
+        self.transcript.add('user', 'press', data)
+        update = types.SimpleNamespace(callback_query=SimCallbackQuery(self, data), message=None)
+        await self.handler('callback')(update, types.SimpleNamespace(args=[]))
+    
+    async def command(self, name, *args):
+        """Команда пользователя, например command('status', 'ВТБ')"""
+        self.transcript.add('user', 'command', ' '.join((f'/{name}',) + args))
+        update = types.SimpleNamespace(message=SimMessage(self), callback_query=None)
+        await self.handler('command', name)(update, types.SimpleNamespace(args=list(args)))
+    
+    def patches(self):
+        """Атрибуты модуля бота, подменяемые на время прогона"""
+        return {
+            'time': SimTime(self.clock),
+            'datetime': SimDatetimeModule(self.clock),
+            'Client': functools.partial(SimClient, market=self.market, latency=self.api_latency),
+            'Application': types.SimpleNamespace(builder=lambda: SimApplicationBuilder(self)),
+            'TickScheduler': functools.partial(SimTicker, self),
+            'WATCHLIST': dict(self.names),
+            'STREAMING_MODE': self.stream is not None,
+            'STREAM_RECORD_PATH': self.record,
+            'METRICS_HTTP_PORT': None,
+            'state_journal': None,
+            'candle_archive': None,
+            'io_executor': ThreadPoolExecutor(max_workers=signals.IO_WORKERS, thread_name_prefix='sim-io'),
+            'render_executor': ThreadPoolExecutor(max_workers=1, thread_name_prefix='sim-render'),
+        }
+    
+    async def run(self):
+        """Прогон до закрытия последней свечи; возвращает сводку"""
+        patches = self.patches()
+        saved = {name: getattr(signals, name) for name in patches}
+        saved_instruments = dict(signals.instruments)
+        for name, value in patches.items():
+            setattr(signals, name, value)
+        # Часы и очередь создаются заново: лимит Telegram в симуляции не нужен
+        signals.outbox = signals.TelegramOutbox(rate=1e9, burst=1e9)
+        signals.invest_client = signals.SharedInvestClient('sim')
+        signals.risk_monitor = signals.RiskMonitor()
+        signals.instruments.clear()
+        
+        self.real_start = time.perf_counter()
+        self.tick_real_start = self.real_start
+        bot_task = asyncio.create_task(signals.signal_monitoring(self.stream))
+        try:
+            finished = asyncio.create_task(self.finished.wait())
+            await asyncio.wait({bot_task, finished}, return_when=asyncio.FIRST_COMPLETED)
+            if bot_task.done():
+                bot_task.result()  # Ошибка запуска бота
+            elapsed = time.perf_counter() - self.real_start
+        finally:
+            bot_task.cancel()
+            await asyncio.gather(bot_task, return_exceptions=True)
+            # Запросы в потоках прерванного тика не должны застать настоящие модули бота
+            for name in ('io_executor', 'render_executor'):
+                patches[name].shutdown(wait=True)
+            for name, value in saved.items():
+                setattr(signals, name, value)
+            signals.instruments.clear()
+            signals.instruments.update(saved_instruments)
+        
+        return self.summary(elapsed)
+    
+    def summary(self, elapsed):
+        entries = self.transcript.entries
+        bot_messages = [e for e in entries if e['source'] == 'bot']
+        return {
+            'candles': sum(len(df) for df in self.frames.values()),
+            'instruments': len(self.frames),
+            'ticks': self.ticks,
+            'elapsed_s': elapsed,
+            'ticks_per_s': self.ticks / elapsed if elapsed else 0.0,
+            'speedup': self.ticks * signals.TICK_INTERVAL / elapsed if elapsed else 0.0,
+            'messages': len(bot_messages),
+            'signals': len(self.signal_latencies),
+            'opened': sum(1 for e in entries if e['method'] == 'edit_message_text'
+                          and e['text'].startswith("✅ *Позиция открыта")),
+            'closed': sum(1 for e in entries if e['method'] == 'edit_message_text'
+                          and e['text'].startswith("✅ *Позиция закрыта")),
+            'signal_latency_ms': percentiles_ms(self.signal_latencies),
+            'tick_ms': percentiles_ms(self.tick_durations)
+        }
+
+
+def percentiles_ms(samples):
+    """p50, p95 и максимум в миллисекундах"""
+    if not samples:
+        return None
+    return {
+        'p50': float(np.percentile(samples, 50)) * 1000,
+        'p95': float(np.percentile(samples, 95)) * 1000,
+        'max': max(samples) * 1000
+    }
+
+
+def synthetic_day(count, seed=0):
+    """Торговый день случайного блуждания с минутными свечами"""
+    rng = np.random.default_rng(seed)
+    close = 25 * np.exp(np.cumsum(rng.normal(0, 0.0015, count)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    index = pd.date_range('2024-01-15 07:00', periods=count, freq='min', tz='UTC', name='time')
+    return pd.DataFrame({
+        'open': open_,
+        'close': close,
+        'high': np.maximum(open_, close) + 0.005,
+        'low': np.minimum(open_, close) - 0.005,
+        'volume': rng.integers(100, 10000, count)
+    }, index=index).round(3)
+
+
+def replay_frames(path):
+    """Итоговые минутные свечи инструментов из записи стрима - история для SimMarket"""
+    candles = {}
+    for kind, payload in signals.read_replay(path):
+        if kind == 'candle':
+            # Обновления свечи идут по порядку: остается последнее
+            candles.setdefault(payload.figi, {})[payload.time] = payload
+    return {
+        figi: signals.candles_to_dataframe([candle for _, candle in sorted(by_time.items())])
+        for figi, by_time in candles.items()
+    }
+
+
+def replicate(df, figi, count):
+    """Одни и те же свечи под count инструментами - для нагрузочного прогона"""
+    frames = {figi: df}
+    names = {figi: signals.WATCHLIST.get(figi, figi)}
+    for i in range(1, count):
+        frames[f'SIM{i:05d}'] = df
+        names[f'SIM{i:05d}'] = f'SIM{i}'
+    return frames, names
+
+
+def compare_transcripts(expected, actual):
+    """Первое расхождение протоколов или None"""
+    for i, (left, right) in enumerate(zip(expected, actual)):
+        if left != right:
+            return i, left, right
+    if len(expected) != len(actual):
+        i = min(len(expected), len(actual))
+        return i, expected[i] if i < len(expected) else None, actual[i] if i < len(actual) else None
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-прогон бота на записанных свечах")
+    parser.add_argument('path', nargs='?', help="CSV или Parquet со свечами либо каталог архива свечей")
+    parser.add_argument('--figi', default=signals.FIGI, help="Инструмент в архиве свечей")
+    parser.add_argument('--stream', action='store_true', help="Потоковый режим: свечи и цены из стрима вместо опроса")
+    parser.add_argument('--replay', help="Воспроизвести запись стрима (STREAM_RECORD_PATH) вместо файла свечей")
+    parser.add_argument('--record', help="Записать стрим симуляции в JSON Lines для --replay")
+    parser.add_argument('--synthetic', type=int, default=0, help="Вместо файла - N синтетических свечей")
+    parser.add_argument('--instruments', type=int, default=1, help="Размножить свечи на N инструментов")
+    parser.add_argument('--speed', type=float, default=None, help="Ускорение относительно биржи (по умолчанию - без пауз)")
+    parser.add_argument('--warmup', type=int, default=60, help="Свечей истории до первого тика")
+    parser.add_argument('--no-confirm', action='store_true', help="Не нажимать кнопки подтверждения")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Задержка ответа Invest API, мс")
+    parser.add_argument('--bot-latency', type=float, default=0.0, help="Задержка ответа Telegram, мс")
+    parser.add_argument('--transcript', help="Сохранить протокол сообщений в JSON Lines")
+    parser.add_argument('--check', help="Сравнить протокол с эталоном; код выхода 1 при расхождении")
+    parser.add_argument('--verbose', action='store_true', help="Логи бота")
+    args = parser.parse_args()
+    
+    if not args.verbose:
+        logging.getLogger('VTBSignalSystem').setLevel(logging.WARNING)
+    # Бот пишет местное время - протокол не должен зависеть от пояса машины
+    if hasattr(time, 'tzset'):
+        os.environ['TZ'] = 'UTC'
+        time.tzset()
+    if args.replay:
+        frames = replay_frames(args.replay)
+        names = {figi: signals.WATCHLIST.get(figi, figi) for figi in frames}
+    else:
+        if args.path:
+            df = backtest.load_candles(args.path, args.figi)
+        elif args.synthetic:
+            df = synthetic_day(args.synthetic)
+        else:
+            parser.error("Нужен файл свечей, --synthetic N или --replay")
+        frames, names = replicate(df, args.figi, args.instruments)
+    simulation = Simulation(
+        frames, names, args.speed, args.warmup, not args.no_confirm,
+        args.api_latency / 1000, args.bot_latency / 1000,
+        stream=args.stream or args.record is not None, replay=args.replay, record=args.record
+    )
+    summary = asyncio.run(simulation.run())
+    
+    print(f"Свечей: {summary['candles']}, инструментов: {summary['instruments']}, тиков: {summary['ticks']}")
+    print(f"Прогон: {summary['elapsed_s']:.1f} с, {summary['ticks_per_s']:.1f} тиков/с "
+          f"(x{summary['speedup']:.0f} к реальному времени)")
+    print(f"Сообщений бота: {summary['messages']}, сигналов: {summary['signals']}, "
+          f"открыто позиций: {summary['opened']}, закрыто: {summary['closed']}")
+    for title, key in (("Тик", 'tick_ms'), ("Задержка сигнала", 'signal_latency_ms')):
+        if summary[key]:
+            print(f"{title}: p50 {summary[key]['p50']:.1f} мс, p95 {summary[key]['p95']:.1f} мс, "
+                  f"max {summary[key]['max']:.1f} мс")
+    
+    entries = simulation.transcript.entries
+    if args.transcript:
+        with open(args.transcript, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    if args.check:
+        with open(args.check, encoding='utf-8') as f:
+            expected = [json.loads(line) for line in f if line.strip()]
+        difference = compare_transcripts(expected, entries)
+        if difference is not None:
+            i, left, right = difference
+            print(f"Протокол расходится с эталоном в записи {i}:\n  ожидалось: {left}\n  получено:  {right}")
+            sys.exit(1)
+        print(f"Протокол совпадает с эталоном ({len(entries)} записей)")
+
+
+if __name__ == '__main__':
+    main()